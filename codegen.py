@@ -3,17 +3,19 @@ import logging
 import os
 import sys
 
-import textx
-
-import core
 import dsl
-from dsl import ir
-import codegen
 
 logging.basicConfig(level=logging.WARNING,
                     format='%(levelname)s:%(name)s:%(lineno)d: %(message)s')
 logger = logging.getLogger().getChild(os.path.basename(__file__))
 
+def int_tuple(text):
+    '''Parses comma separated integers, e.g. the extents of --tile'''
+    try:
+        return tuple(int(extent) for extent in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected comma separated integers, got %s' % text)
+
 def main():
     parser = argparse.ArgumentParser(
         prog='test_textx',
@@ -24,6 +26,126 @@ def main():
         type=str,
         dest='test_file'
     )
+    parser.add_argument(
+        '--golden',
+        type=str,
+        dest='golden_dir',
+        help='compute check.data from the input data files in this directory '
+             'with the NumPy reference executor instead of generating code'
+    )
+    parser.add_argument(
+        '--data-format',
+        type=str,
+        dest='data_format',
+        choices=['text', 'binary'],
+        default='text',
+        help='layout of the data files read by the host: whitespace separated '
+             'text (*.data) or raw floats loaded with mmap (*.bin)'
+    )
+    parser.add_argument(
+        '--width',
+        type=int,
+        default=None,
+        help='interface width in bits, overriding the WIDTH of the DSL '
+             'header; PARA_FACTOR is width/32 (default: 512)'
+    )
+    parser.add_argument(
+        '--fast-math',
+        action='store_true',
+        dest='fast_math',
+        help='allow rewrites that change rounding: division by a constant '
+             'becomes multiplication by its reciprocal and products are '
+             'accumulated with fmaf'
+    )
+    parser.add_argument(
+        '--reassociate',
+        action='store_true',
+        help='regroup long chains of additions and multiplications into '
+             'balanced trees and fold literals and repeated terms across '
+             'them, which shortens the pipeline but changes rounding and '
+             'may change integer results too; quotients are only regrouped '
+             'when the stencil computes in float or half'
+    )
+    parser.add_argument(
+        '--architecture',
+        type=str,
+        choices=['inline', 'dataflow'],
+        default='inline',
+        help='structure of the generated kernels: stages that access memory '
+             'in their compute loop (inline), or load, compute and store '
+             'processes connected by streams with burst m_axi ports (dataflow)'
+    )
+    parser.add_argument(
+        '--pack-inputs',
+        action='store_true',
+        dest='pack_inputs',
+        help='interleave read-only inputs into one buffer per pack, read '
+             'through one wide m_axi port and HBM pseudo channel'
+    )
+    parser.add_argument(
+        '--tile',
+        type=int_tuple,
+        default=None,
+        help='split every partition into tiles of these extents of the inner '
+             'dimensions, e.g. 256 or 32,64; tiles run one after another and '
+             'recompute a halo, so line buffers only span a tile row'
+    )
+    parser.add_argument(
+        '--partition',
+        type=int_tuple,
+        default=None,
+        help='kernels along every dimension, e.g. 4,2 splits the rows into '
+             '4 bands and the columns into 2 blocks for 8 kernels, overriding '
+             'COUNT; blocks of columns recompute a halo like --tile'
+    )
+    parser.add_argument(
+        '--epoch',
+        type=int,
+        default=None,
+        help='iterations of one launch of the kernels with BOARDER: hybrid, '
+             'which the host follows with a refresh of the halos; chosen by '
+             'the cycle model by default'
+    )
+    parser.add_argument(
+        '--estimate',
+        action='store_true',
+        help='print the estimated cycles and throughput of the design '
+             'instead of generating code'
+    )
+    parser.add_argument(
+        '--freq',
+        type=float,
+        default=300.0,
+        help='kernel clock in MHz assumed by --estimate and --dse (default: 300)'
+    )
+    parser.add_argument(
+        '--dse',
+        action='store_true',
+        help='sweep kernel count, repeat count, border type and unroll factor '
+             'with the cycle model and print the Pareto-optimal designs'
+    )
+    parser.add_argument(
+        '--batch',
+        type=str,
+        nargs='+',
+        default=None,
+        metavar='PATH',
+        help='generate code for many DSL files, directories searched for '
+             '*.dsl and glob patterns in parallel, each into a directory of '
+             'its own below --out, and print a summary'
+    )
+    parser.add_argument(
+        '--out',
+        type=str,
+        default='.',
+        help='directory of the generated files (default: current directory)'
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=None,
+        help='worker processes of --dse and --batch (default: number of CPUs)'
+    )
 
     logging.getLogger().setLevel(logging.DEBUG)
     logger.info('Begin Logging:')
@@ -35,26 +157,60 @@ def main():
     else:
         logger.info('Test File: %s', args.test_file)
 
-    dsl_mm = textx.metamodel_from_str(dsl.lan, classes=ir.CLASSES)
-    dsl_m = dsl_mm.model_from_file(args.test_file)
+    # the generators are only imported once the arguments are valid
+    import core
+    import codegen
+
+    if args.dse:
+        from codegen import dse
+        for line in dse.report(dse.explore(args.test_file, args.freq, args.jobs)):
+            print(line)
+        return
+
+    options = {'data_format': args.data_format, 'fast_math': args.fast_math,
+               'reassociate': args.reassociate, 'architecture': args.architecture,
+               'pack_inputs': args.pack_inputs, 'tile': args.tile,
+               'partition': args.partition, 'epoch': args.epoch}
+    if args.width is not None:
+        options['width'] = args.width
+
+    if args.batch:
+        from codegen import batch
+        results = batch.compile_all(args.batch, args.out, options, args.jobs)
+        for line in batch.report(results):
+            print(line)
+        if any(result.error is not None for result in results):
+            sys.exit(1)
+        return
+
+    generating = args.golden_dir is None and not args.estimate
+    if generating:
+        with open(args.test_file) as file:
+            key = codegen.fingerprint(file.read(), options)
+        if codegen.is_current(args.out, key):
+            logger.info('%s and its options are unchanged since %s was generated', args.test_file, args.out)
+            return
+
+    dsl_m = dsl.metamodel().model_from_file(args.test_file)
 
     logger.info('Program successfully parsed:\n %s',
                 str(dsl_m).replace('\n', '\n '))
 
-    stencil = core.Stencil(
-        iterate=dsl_m.iterate,
-        boarder_type=dsl_m.boarder_type,
-        kernel_count=dsl_m.kernel_count,
-        repeat_count=dsl_m.repeat_count,
-        app_name=dsl_m.app_name,
-        size=dsl_m.size,
-        scalar_stmts=dsl_m.scalar_stmts,
-        input_stmts=dsl_m.input_stmts,
-        local_stmts=dsl_m.local_stmts,
-        output_stmt=dsl_m.output_stmt
-    )
+    stencil = core.stencil_from_program(dsl_m, **options)
+
+    if args.golden_dir is not None:
+        from core import reference
+        # the hybrid border zeroes the halo beyond the grid with every launch
+        codegen.plan_epoch(stencil)
+        reference.golden_gen(stencil, args.golden_dir)
+        return
+
+    if args.estimate:
+        for line in codegen.estimate(stencil, args.freq).report():
+            print(line)
+        return
 
-    codegen.hls_codegen(stencil)
+    codegen.hls_codegen(stencil, args.out, key)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,40 +1,221 @@
-from codegen import hls_kernel_gen
-from codegen import head_gen
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+
+import core
+import dsl
 from codegen import buffer
-from codegen import host_gen
-from codegen import hbm_gen
+from codegen import perf_model
 
 from core.utils import find_refs_by_offset
 
+_logger = logging.getLogger().getChild(__name__)
+
+# records the fingerprint of the inputs and the hash of every file generated
+# into a directory, see write_artifacts
+MANIFEST = 'manifest.json'
+
 
-def hls_codegen(stencil):
+def buffer_configs(stencil):
     input_buffer_configs = {}
     for input_var in stencil.input_vars:
-        var_references = stencil.all_refs[input_var]
-        refs_by_offset = find_refs_by_offset(var_references, stencil.size)
-        input_buffer_configs[input_var] = (buffer.InputBufferConfig(input_var, refs_by_offset, 16, stencil.size))
+        # packed inputs read one beat together, so they share a line buffer
+        # layout that holds the references of all of them
+        pack = next((pack for pack in stencil.packs if input_var in pack), (input_var,))
+        var_references = [ref for var in pack for ref in stencil.all_refs[var]]
+        refs_by_offset = sorted(set(find_refs_by_offset(var_references, stencil.tile_size)))
+        input_buffer_configs[input_var] = (buffer.InputBufferConfig(input_var, refs_by_offset, stencil.unroll_factor,
+                                                                          stencil.tile_size, stencil.types[input_var]))
 
+    # the halo a stage adds is the reach of the last input alone, it is the
+    # only one that changes between iterations, see core.Stencil.cone; the
+    # other inputs are padded by their own reach in their buffers
     output_buffer_config = buffer.OutputBufferConfig(stencil.output_var,
                                                      input_buffer_configs[stencil.input_vars[-1]].lineBuffer.min_block_offset,
                                                      input_buffer_configs[stencil.input_vars[-1]].lineBuffer.max_block_offset)
+    return input_buffer_configs, output_buffer_config
+
+
+def plan_epoch(stencil, freq_mhz=300.0):
+    '''Picks the iterations of one launch of the hybrid border with the shortest estimated run, unless given'''
+    if stencil.boarder_type != 'hybrid' or stencil.epoch is not None:
+        return
+    cycles = {}
+    for epoch in range(1, stencil.iterate + 1):
+        if stencil.iterate % epoch == 0:
+            stencil.epoch = epoch
+            cycles[epoch] = estimate(stencil, freq_mhz).cycles
+    stencil.epoch = min(cycles, key=lambda epoch: (cycles[epoch], -epoch))
+    _logger.info('refresh halos on the host every %d of %d iterations', stencil.epoch, stencil.iterate)
+
+
+def estimate(stencil, freq_mhz=300.0):
+    plan_epoch(stencil, freq_mhz)
+    input_buffer_configs, output_buffer_config = buffer_configs(stencil)
+    return perf_model.estimate(stencil, input_buffer_configs, output_buffer_config, freq_mhz)
+
+
+class _Artifact(io.StringIO):
+    '''Buffer of one generated file, named like the file write_artifacts creates'''
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
 
-    with open('%s.h' % stencil.app_name, 'w') as file:
-        head_gen.head_gen(stencil, file, output_buffer_config)
 
-    with open('host.cpp', 'w') as file:
-        host_gen.host_gen(stencil, file, input_buffer_configs, output_buffer_config)
+def generate(stencil, **options):
+    """Generates the code of a stencil in memory.
 
-    with open('hbm_config.h', 'w') as head_file:
-        with open('settings.cfg', 'w') as cfg_file:
-            hbm_gen.hbm_files_gen(stencil, head_file, cfg_file)
+    Args:
+        stencil: core.Stencil, or the text of a DSL program.
+        options: Stencil options of a DSL program, e.g. data_format, or
+            overrides of its header such as width.
 
-    if stencil.iterate == 1 or stencil.boarder_type == 'overlap':
-        with open('unikernel.cpp', 'w') as file:
-            hls_kernel_gen.kernel_gen(stencil, file, input_buffer_configs, output_buffer_config)
+    Returns:
+        dict of the text of every generated file by its name.
+    """
+    # the emitters are only imported to generate code, not to estimate it
+    from codegen import hbm_gen
+    from codegen import head_gen
+    from codegen import hls_kernel_gen
+    from codegen import host_gen
+
+    if isinstance(stencil, str):
+        stencil = core.stencil_from_program(dsl.metamodel().model_from_str(stencil), **options)
+    elif options:
+        raise TypeError('options only apply to the text of a DSL program')
+    plan_epoch(stencil)
+    input_buffer_configs, output_buffer_config = buffer_configs(stencil)
+    artifacts = {}
+
+    def artifact(name):
+        artifacts[name] = _Artifact(name)
+        return artifacts[name]
+
+    head_gen.head_gen(stencil, artifact('%s.h' % stencil.app_name), output_buffer_config)
+
+    host_gen.host_gen(stencil, artifact('host.cpp'), input_buffer_configs, output_buffer_config)
+
+    hbm_gen.hbm_files_gen(stencil, artifact('hbm_config.h'), artifact('settings.cfg'),
+                          perf_model.buffer_traffic(stencil, input_buffer_configs, output_buffer_config))
+
+    if stencil.iterate == 1 or stencil.overlapped:
+        hls_kernel_gen.kernel_gen(stencil, artifact('unikernel.cpp'), input_buffer_configs, output_buffer_config)
     else:
-        with open('upkernel.cpp', 'w') as file:
-            hls_kernel_gen.kernel_gen(stencil, file, input_buffer_configs, output_buffer_config, 'up')
-        with open('midkernel.cpp', 'w') as file:
-            hls_kernel_gen.kernel_gen(stencil, file, input_buffer_configs, output_buffer_config, 'mid')
-        with open('downkernel.cpp', 'w') as file:
-            hls_kernel_gen.kernel_gen(stencil, file, input_buffer_configs, output_buffer_config, 'down')
\ No newline at end of file
+        for position in ('up', 'mid', 'down'):
+            hls_kernel_gen.kernel_gen(stencil, artifact('%skernel.cpp' % position), input_buffer_configs,
+                                      output_buffer_config, position)
+
+    return {name: file.getvalue() for name, file in artifacts.items()}
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _file_digest(path):
+    '''Hash of the text of a file, None if it does not exist'''
+    try:
+        with open(path) as file:
+            return _digest(file.read())
+    except FileNotFoundError:
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def _generator_digest():
+    '''Hash of the sources of the packages the generated code depends on'''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    digest = hashlib.sha256()
+    for package in ('codegen', 'core', 'dsl'):
+        for directory, dirs, files in os.walk(os.path.join(root, package)):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    path = os.path.join(directory, name)
+                    digest.update(os.path.relpath(path, root).encode())
+                    with open(path, 'rb') as file:
+                        digest.update(file.read())
+    return digest.hexdigest()
+
+
+def fingerprint(source, options):
+    """Hash of everything the generated code of a DSL program depends on.
+
+    Args:
+        source: text of the DSL program.
+        options: Stencil options of the program.
+
+    Returns:
+        hex digest of the program, the options and the sources of the generator.
+    """
+    digest = hashlib.sha256()
+    digest.update(_generator_digest().encode())
+    digest.update(json.dumps(options, sort_keys=True, default=repr).encode())
+    digest.update(source.encode())
+    return digest.hexdigest()
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def is_current(directory, key):
+    '''Whether directory holds the unmodified files generated from the inputs of fingerprint key'''
+    manifest = _read_manifest(directory)
+    if key is None or manifest.get('fingerprint') != key:
+        return False
+    return all(_file_digest(os.path.join(directory, name)) == digest
+               for name, digest in manifest.get('artifacts', {}).items())
+
+
+def write_artifacts(artifacts, directory='.', key=None):
+    """Writes the files returned by generate into directory.
+
+    Files whose text did not change are not touched, so their modification
+    times do not trigger rebuilds. Files of the previous manifest that are no
+    longer generated are removed. The manifest records key and the hash of
+    every file, see is_current.
+
+    Args:
+        artifacts: dict of the text of every file by its name.
+        directory: directory of the files, created if it does not exist.
+        key: fingerprint of the inputs of the files, if known.
+
+    Returns:
+        list of the names of the files written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    previous = _read_manifest(directory).get('artifacts', {})
+    digests = {name: _digest(text) for name, text in artifacts.items()}
+    written = []
+    for name, text in sorted(artifacts.items()):
+        path = os.path.join(directory, name)
+        if _file_digest(path) == digests[name]:
+            continue
+        with open(path, 'w') as file:
+            file.write(text)
+        written.append(name)
+    for name in sorted(set(previous) - set(artifacts)):
+        _logger.info('remove %s, which is no longer generated', name)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, name))
+
+    manifest = json.dumps({'fingerprint': key, 'artifacts': digests}, indent=2, sort_keys=True) + '\n'
+    if _file_digest(os.path.join(directory, MANIFEST)) != _digest(manifest):
+        with open(os.path.join(directory, MANIFEST), 'w') as file:
+            file.write(manifest)
+    _logger.info('%d of %d files in %s changed', len(written), len(artifacts), directory)
+    return written
+
+
+def hls_codegen(stencil, directory='.', key=None):
+    return write_artifacts(generate(stencil), directory, key)
\ No newline at end of file
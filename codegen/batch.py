@@ -0,0 +1,129 @@
+import collections
+import concurrent.futures
+import glob
+import logging
+import os
+import time
+
+import codegen
+import core
+import dsl
+
+_logger = logging.getLogger().getChild(__name__)
+
+Result = collections.namedtuple('Result', ['dsl_file', 'output_dir', 'seconds', 'artifacts', 'written', 'error'])
+
+# per process state of the worker pool, see _init_worker
+_worker_metamodel = None
+
+
+def find_programs(patterns):
+    """Expands paths, directories and glob patterns into DSL programs.
+
+    Args:
+        patterns: sequence of DSL files, directories searched recursively for
+            *.dsl files, or glob patterns, where ** matches any directory.
+
+    Returns:
+        sorted list of the paths of the DSL files, without duplicates.
+    """
+    dsl_files = set()
+    for pattern in patterns:
+        paths = glob.glob(pattern, recursive=True) if glob.has_magic(pattern) else [pattern]
+        if not paths:
+            _logger.warning('%s matches no DSL program', pattern)
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    dsl_files.update(os.path.join(root, name) for name in files if name.endswith('.dsl'))
+            else:
+                dsl_files.add(path)
+    return sorted(os.path.normpath(dsl_file) for dsl_file in dsl_files)
+
+
+def output_dirs(dsl_files, output_root):
+    '''Output directory of every program, its path below the directory common to all of them'''
+    if not dsl_files:
+        return {}
+    common = os.path.commonpath([os.path.dirname(os.path.abspath(dsl_file)) for dsl_file in dsl_files])
+    return {dsl_file: os.path.join(output_root, os.path.splitext(os.path.relpath(os.path.abspath(dsl_file),
+                                                                                 common))[0])
+            for dsl_file in dsl_files}
+
+
+def _init_worker():
+    global _worker_metamodel
+    logging.getLogger().setLevel(logging.WARNING)
+    _worker_metamodel = dsl.metamodel()
+
+
+def compile_program(dsl_file, output_dir, options):
+    """Generates the code of one DSL program into output_dir.
+
+    Errors are returned rather than raised, so one program does not stop the
+    batch; semantic errors of the generators exit, which is caught as well.
+    Programs whose source, options and generator did not change since their
+    code was generated into output_dir are skipped.
+
+    Returns:
+        Result of the program.
+    """
+    start = time.perf_counter()
+    try:
+        with open(dsl_file) as file:
+            key = codegen.fingerprint(file.read(), options)
+        if codegen.is_current(output_dir, key):
+            return Result(dsl_file, output_dir, time.perf_counter() - start, 0, 0, None)
+        program = _worker_metamodel.model_from_file(dsl_file)
+        artifacts = codegen.generate(core.stencil_from_program(program, **options))
+        written = codegen.write_artifacts(artifacts, output_dir, key)
+    except (Exception, SystemExit) as error:
+        return Result(dsl_file, output_dir, time.perf_counter() - start, 0, 0,
+                      '%s: %s' % (type(error).__name__, error))
+    return Result(dsl_file, output_dir, time.perf_counter() - start, len(artifacts), len(written), None)
+
+
+def compile_all(patterns, output_root, options, jobs=None):
+    """Generates the code of many DSL programs in a process pool.
+
+    Every worker builds the textX metamodel once, and every program is
+    generated into a directory of its own below output_root, named after its
+    path relative to the other programs.
+
+    Args:
+        patterns: DSL files, directories and glob patterns, see find_programs.
+        output_root: directory of the output directories.
+        options: Stencil options applied to every program.
+        jobs: number of worker processes, defaults to the number of CPUs.
+
+    Returns:
+        list of Result in the order of the DSL files.
+    """
+    dsl_files = find_programs(patterns)
+    dirs = output_dirs(dsl_files, output_root)
+    _logger.info('generate %d DSL programs into %s', len(dsl_files), output_root)
+    jobs = jobs or os.cpu_count()
+    # forked workers inherit the metamodel instead of building their own
+    dsl.metamodel()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) as executor:
+        futures = [executor.submit(compile_program, dsl_file, dirs[dsl_file], options) for dsl_file in dsl_files]
+        return [future.result() for future in futures]
+
+
+def report(results):
+    width = max([len('file')] + [len(result.dsl_file) for result in results])
+    lines = ['%-*s %9s %6s %7s  %s' % (width, 'file', 'time(s)', 'files', 'written', 'output')]
+    for result in results:
+        if result.error is not None:
+            output = 'FAILED %s' % result.error
+        elif not result.artifacts:
+            output = '%s (unchanged)' % result.output_dir
+        else:
+            output = result.output_dir
+        lines.append('%-*s %9.3f %6d %7d  %s' % (width, result.dsl_file, result.seconds, result.artifacts,
+                                                result.written, output))
+    failures = sum(result.error is not None for result in results)
+    unchanged = sum(result.error is None and not result.artifacts for result in results)
+    lines.append('%d programs, %d unchanged, %d failed, %.3f s of generation'
+                 % (len(results), unchanged, failures, sum(result.seconds for result in results)))
+    return lines
@@ -1,3 +1,5 @@
+import collections
+import contextlib
 import math
 import copy
 from functools import reduce
@@ -5,26 +7,70 @@ import logging
 
 from codegen.codegen_utils import Printer, idx2str, cvt_idx2offset
 from codegen import codegen_utils
+from core import analysis
+from core import dtype
 
 _logger = logging.getLogger().getChild(__name__)
 
+# Memories of the U280 the reuse buffers of a line buffer are built from.
+SRL_DEPTH = 32
+BRAM18K_WIDTH = 36
+BRAM18K_DEPTH = 512
+URAM_WIDTH = 72
+URAM_DEPTH = 4096
+U280_BRAM18K = 4032
+U280_URAM = 960
+
+# kind is one of 'srl' and 'bram' FIFOs, or 'uram' and 'uram_cascade'
+# circular buffers, the latter deeper than one URAM
+Storage = collections.namedtuple('Storage', ['kind', 'bram', 'uram'])
+
+
+def plan_storage(length, width) -> Storage:
+    """Picks the memory of a reuse buffer.
+
+    Short buffers are shift registers. Longer ones are a BRAM FIFO or a URAM
+    circular buffer, whichever takes the smaller share of the device.
+
+    Args:
+        length: beats the buffer delays its input by.
+        width: bits of a beat.
+
+    Returns:
+        Storage of the buffer.
+    """
+    if length <= SRL_DEPTH:
+        return Storage('srl', 0, 0)
+    bram = math.ceil(width / BRAM18K_WIDTH) * math.ceil(length / BRAM18K_DEPTH)
+    uram = math.ceil(width / URAM_WIDTH) * math.ceil(length / URAM_DEPTH)
+    if uram / U280_URAM < bram / U280_BRAM18K:
+        return Storage('uram' if length <= URAM_DEPTH else 'uram_cascade', 0, uram)
+    return Storage('bram', bram, 0)
+
+
 class Block:
     def __init__(self, var_name, ref_by_offset, size, unroll_factor):
         self.index = ref_by_offset
         self.name = '%s_block_%s' % (var_name, idx2str(ref_by_offset))
 
 class StreamBuffer:
-    def __init__(self, var_name, ref_by_offset1, ref_by_offset2, size, unroll_factor):
+    def __init__(self, var_name, ref_by_offset1, ref_by_offset2, size, unroll_factor, element_width=32):
         self.index = ref_by_offset1
         self.index2 = ref_by_offset2
         self.length = self.index2 - self.index + 1
         self.name = '%s_stream_%s_to_%s' % (var_name, idx2str(ref_by_offset1), idx2str(ref_by_offset2))
+        self.storage = plan_storage(self.length, unroll_factor * element_width)
+
+    @property
+    def circular(self):
+        '''Whether the buffer is an array in URAM with a pointer instead of a FIFO'''
+        return self.storage.kind.startswith('uram')
 
 class LineBuffer:
-    def __init__(self, var_name, refs_by_offset, unroll_factor, size):
+    def __init__(self, var_name, refs_by_offset, unroll_factor, size, element_width=32):
         self.unroll_factor = unroll_factor
         self.min_offset = min(refs_by_offset)
-        self.max_offset = max(refs_by_offset) + 15
+        self.max_offset = max(refs_by_offset) + unroll_factor - 1
         '''
         if self.min_offset >= 0:
             self.min_row = 0
@@ -38,7 +84,6 @@ class LineBuffer:
 
         #TODO: Assume min_offset <= 0 here
         self.min_block_offset = math.ceil(-self.min_offset/self.unroll_factor)
-        self.max_block_offset = math.ceil(self.max_offset / self.unroll_factor)
 
         self.blocks = list()
         for ref in refs_by_offset:
@@ -62,7 +107,8 @@ class LineBuffer:
             elif block2.index - block1.index == 2:
                 more_blocks.append(Block(var_name, block1.index+1, size, unroll_factor))
             else:
-                self.streams.append(StreamBuffer(var_name, block1.index+1, block2.index-1, size, unroll_factor))
+                self.streams.append(StreamBuffer(var_name, block1.index+1, block2.index-1, size, unroll_factor,
+                                                 element_width))
 
         for block in more_blocks:
             self.blocks.append(block)
@@ -70,6 +116,26 @@ class LineBuffer:
         self.buffer_flow = copy.copy(self.blocks+self.streams)
         self.buffer_flow.sort(key=lambda x: x.index)
 
+        # the last block is read from memory one iteration ahead, so a stage
+        # reads min_block_offset + max_block_offset = fill_length blocks more
+        # than it outputs
+        self.max_block_offset = self.buffer_flow[-1].index + 1
+
+    @property
+    def bram(self):
+        '''BRAM18Ks of the reuse buffers'''
+        return sum(stream.storage.bram for stream in self.streams)
+
+    @property
+    def uram(self):
+        '''URAMs of the reuse buffers'''
+        return sum(stream.storage.uram for stream in self.streams)
+
+    @property
+    def fill_length(self):
+        '''Blocks read before the first output, one per iteration'''
+        return self.buffer_flow[-1].index - self.buffer_flow[0].index + 1
+
     def find_block(self, offset: int) -> Block:
         block_offset = math.floor(offset/self.unroll_factor)
         for block in self.blocks:
@@ -81,12 +147,23 @@ class LineBuffer:
 
 class InputBufferConfig:
 
-    def __init__(self, var_name, refs_by_offset, unroll_factor, size):
+    def __init__(self, var_name, refs_by_offset, unroll_factor, size, data_type=dtype.FLOAT):
         self.var_name = var_name
         self.refs_by_offset = refs_by_offset
         self.unroll_factor = unroll_factor
         self.size = size
-        self.lineBuffer = LineBuffer(var_name, refs_by_offset, unroll_factor, size)
+        self.data_type = data_type
+        self.lineBuffer = LineBuffer(var_name, refs_by_offset, unroll_factor, size, data_type.bits)
+        # beat of the input within a PackedBufferConfig beat
+        self.lane = 0
+
+    @property
+    def port_name(self):
+        return self.var_name
+
+    @property
+    def port_type(self):
+        return 'INTERFACE_WIDTH'
 
 
     def print_define_buffer(self, printer: Printer):
@@ -95,198 +172,363 @@ class InputBufferConfig:
         for buffer_element in self.lineBuffer.buffer_flow:
             if type(buffer_element) == Block:
                 printer.println('INTERFACE_WIDTH %s;' % buffer_element.name)
+            elif buffer_element.circular:
+                printer.println('INTERFACE_WIDTH %s[%d];' % (buffer_element.name, buffer_element.length))
+                printer.println('#pragma HLS bind_storage variable=%s type=ram_2p impl=uram' % buffer_element.name)
+                printer.println('unsigned int %s_ptr = 0;' % buffer_element.name)
             else:
                 printer.println('hls::stream<INTERFACE_WIDTH, %s> %s;'
                                 % (buffer_element.index2 - buffer_element.index + 2, buffer_element.name))
-
-    def print_init_buffer(self, printer: Printer):
-        '''Print HLS code to fill in buffer elements'''
-
-        for buffer_element in self.lineBuffer.buffer_flow:
-            if type(buffer_element) == Block:
-                printer.println('%s = %s[%s + %s];' %
-                                (buffer_element.name, self.var_name, self.lineBuffer.min_block_offset, buffer_element.index))
-            else:
-                with printer.for_('int i = %s + %s'
-                                    % (self.lineBuffer.min_block_offset, buffer_element.index),
-                                  'i < %s + %s'
-                                    % (self.lineBuffer.min_block_offset, buffer_element.index2 + 1),
-                                  'i++'):
-                    printer.println('%s << %s[i];' % (buffer_element.name, self.var_name))
-
-    def print_init_buffer_from_stream(self, printer: Printer):
-        '''Print HLS code to fill in buffer elements'''
-
-        for buffer_element in self.lineBuffer.buffer_flow:
-            if type(buffer_element) == Block:
-                printer.println('%s = %s.read();' %
-                                (buffer_element.name, self.var_name))
-            else:
-                with printer.for_('int i = %s + %s'
-                                    % (self.lineBuffer.min_block_offset, buffer_element.index),
-                                  'i < %s + %s'
-                                    % (self.lineBuffer.min_block_offset, buffer_element.index2 + 1),
-                                  'i++'):
-                    printer.println('%s << %s.read();' % (buffer_element.name, self.var_name))
+                printer.println('#pragma HLS bind_storage variable=%s type=fifo impl=%s'
+                                % (buffer_element.name, buffer_element.storage.kind))
+
+    def print_loop_pragmas(self, printer: Printer):
+        '''Print the MAJOR_LOOP pragmas of the circular buffers'''
+        for stream in self.lineBuffer.streams:
+            if stream.circular:
+                # every iteration reads and writes the slot of the pointer,
+                # which moves on before the next one
+                printer.println('#pragma HLS dependence variable=%s inter false' % stream.name)
+
+    def _base(self, offset):
+        '''Memory index of block_0 at i = 0, offset is a C expression of the beats the pass skips'''
+        if offset is None:
+            return '%s' % self.lineBuffer.min_block_offset
+        return '%s + %s' % (self.lineBuffer.min_block_offset, offset)
+
+    def first_read(self, offset=None):
+        '''C expression of the first memory index print_data_movement reads, fill_length before i = 0'''
+        return '%s + %s' % (self._base(offset), self.lineBuffer.buffer_flow[0].index)
 
     def print_data_retrieve_with_unroll(self, printer: Printer, src_idx, dst='', default_stmt='', default_value=0):
+        bits = self.data_type.bits
+        value = self.data_type.c_from_raw('temp_%s' % dst)
         if src_idx[-1] % self.unroll_factor == 0:
             src_offset = cvt_idx2offset(src_idx, self.size)
-            printer.println('uint32_t temp_%s = %s.range(idx_k+31, idx_k);'
-                            % (dst, self.lineBuffer.find_block(src_offset).name))
+            printer.println('%s temp_%s = %s.range(idx_k+%d, idx_k);'
+                            % (self.data_type.raw_type, dst, self.lineBuffer.find_block(src_offset).name, bits - 1))
             if default_stmt is not '':
-                printer.println('%s[k] = (%s)? %s: *((float*)(&temp_%s));'
-                            % (dst, default_stmt, str(default_value), dst))
+                printer.println('%s[k] = (%s)? %s: %s;'
+                            % (dst, default_stmt, str(default_value), value))
             else:
-                printer.println('%s[k] = *((float*)(&temp_%s));'
-                                % (dst, dst))
+                printer.println('%s[k] = %s;'
+                                % (dst, value))
         else:
             src_offset1 = cvt_idx2offset(src_idx, self.size)
             src_offset2 = src_offset1 + self.unroll_factor
             block1 = self.lineBuffer.find_block(src_offset1)
             block2 = self.lineBuffer.find_block(src_offset2)
 
-            block1_align_left = (src_offset1 - block1.index*self.unroll_factor)*32
-            block1_align_right = block1_align_left + 31
-            block2_align_left = (src_offset1 - block2.index*self.unroll_factor)*32
-            block2_align_right = block2_align_left + 31
-            k_to_switch = int(abs(block2_align_left/32))
-            printer.println('uint32_t temp_%s = (k<%s)?%s.range(idx_k + %s, idx_k + %s)'
+            block1_align_left = (src_offset1 - block1.index*self.unroll_factor)*bits
+            block1_align_right = block1_align_left + bits - 1
+            block2_align_left = (src_offset1 - block2.index*self.unroll_factor)*bits
+            block2_align_right = block2_align_left + bits - 1
+            k_to_switch = int(abs(block2_align_left/bits))
+            printer.println('%s temp_%s = (k<%s)?%s.range(idx_k + %s, idx_k + %s)'
                             ' : %s.range(idx_k + %s, idx_k + %s);'
-                            % (dst, str(k_to_switch), block1.name, block1_align_right, block1_align_left,
-                               block2.name, block2_align_right, block2_align_left))
+                            % (self.data_type.raw_type, dst, str(k_to_switch), block1.name, block1_align_right,
+                               block1_align_left, block2.name, block2_align_right, block2_align_left))
             if default_stmt is not '':
-                printer.println('%s[k] = (%s)? %s: *((float*)(&temp_%s));'
-                            % (dst, default_stmt, str(default_value), dst))
-            else:
-                printer.println('%s[k] = *((float*)(&temp_%s));'
-                                % (dst, dst))
-
-
-    def print_data_movement(self, printer: Printer):
-        ''' Print aata flow along the Line Buffer'''
-        for item1, item2 in zip(self.lineBuffer.buffer_flow, self.lineBuffer.buffer_flow[1:]):
-            temp = ''
-            if type(item1) != Block:
-                temp += item1.name + ' << '
+                printer.println('%s[k] = (%s)? %s: %s;'
+                            % (dst, default_stmt, str(default_value), value))
             else:
-                temp += item1.name + ' = '
+                printer.println('%s[k] = %s;'
+                                % (dst, value))
 
-            if type(item2) != Block:
-                temp += item2.name + '.read()'
-            else:
-                temp += 'HLS_REG(%s)' % item2.name
-            temp += ';'
-            printer.println(temp)
 
-        printer.println()
-        printer.println('unsigned int idx_%s = %s + (i + %s);'
-                        % (self.var_name, self.lineBuffer.min_block_offset, self.lineBuffer.buffer_flow[-1].index + 1))
-        printer.println('%s = HLS_REG(%s[idx_%s]);'
-                        % (self.lineBuffer.buffer_flow[-1].name, self.var_name, self.var_name))
+    def _print_shift(self, printer: Printer, loop_start: int):
+        '''Print data flow along the Line Buffer.
 
-    def print_data_movement_from_stream(self, printer: Printer):
-        ''' Print aata flow along the Line Buffer'''
+        MAJOR_LOOP starts fill_length iterations before i = 0 with empty
+        streams. A stream is only read once it holds its length, and is no
+        longer written in the last length iterations, so it is empty again
+        when the loop ends. A circular buffer reads and then overwrites the
+        slot of its pointer in every iteration.
+        '''
         for item1, item2 in zip(self.lineBuffer.buffer_flow, self.lineBuffer.buffer_flow[1:]):
-            temp = ''
-            if type(item1) != Block:
-                temp += item1.name + ' << '
+            if type(item1) != Block and item1.circular:
+                printer.println('%s[%s_ptr] = HLS_REG(%s);' % (item1.name, item1.name, item2.name))
+                printer.println('%s_ptr = %s_ptr == %d ? 0 : %s_ptr + 1;'
+                                % (item1.name, item1.name, item1.length - 1, item1.name))
+            elif type(item1) != Block:
+                with printer.if_('i < trip_count - %d' % item1.length):
+                    printer.println('%s << HLS_REG(%s);' % (item1.name, item2.name))
+            elif type(item2) != Block and item2.circular:
+                # the slot written length iterations ago, before it is overwritten
+                printer.println('%s = %s[%s_ptr];' % (item1.name, item2.name, item2.name))
+            elif type(item2) != Block:
+                with printer.if_('i >= %d' % (loop_start + item2.length)):
+                    printer.println('%s = %s.read();' % (item1.name, item2.name))
             else:
-                temp += item1.name + ' = '
+                printer.println('%s = HLS_REG(%s);' % (item1.name, item2.name))
 
-            if type(item2) != Block:
-                temp += item2.name + '.read()'
-            else:
-                temp += 'HLS_REG(%s)' % item2.name
-            temp += ';'
-            printer.println(temp)
-
-        printer.println()
-        printer.println('%s = %s.read();'
-                        % (self.lineBuffer.buffer_flow[-1].name, self.var_name))
+    def print_data_movement(self, printer: Printer, loop_start: int, offset=None):
+        '''Print data flow along the Line Buffer, reading the next block from memory'''
+        with self._filling(printer, loop_start) as loop_start:
+            self._print_shift(printer, loop_start)
 
+            printer.println()
+            printer.println('unsigned int idx_%s = %s + (i + %s);'
+                            % (self.var_name, self._base(offset), self.lineBuffer.buffer_flow[-1].index + 1))
+            printer.println('%s = HLS_REG(%s[idx_%s]);'
+                            % (self.lineBuffer.buffer_flow[-1].name, self.var_name, self.var_name))
 
-    def print_pop_out(self, printer:Printer):
-        '''Print Pop Out all stream buffer'''
-        for stream_buffer in self.lineBuffer.streams:
-            printer.println('INTERFACE_WIDTH popout_%s;'
-                            % (stream_buffer.name))
-            with printer.for_('int i = 0', 'i < %s' % stream_buffer.length, 'i++'):
-                printer.println('#pragma HLS pipeline II=1')
-                printer.println('%s >> popout_%s;'
-                                % (stream_buffer.name, stream_buffer.name))
+    def print_data_movement_from_stream(self, printer: Printer, loop_start: int):
+        '''Print data flow along the Line Buffer, reading the next block from the previous stage'''
+        with self._filling(printer, loop_start) as loop_start:
+            self._print_shift(printer, loop_start)
 
+            printer.println()
+            printer.println('%s = %s.read();'
+                            % (self.lineBuffer.buffer_flow[-1].name, self.var_name))
+
+    def print_unpack(self, printer: Printer, beat: str):
+        '''Print the read of the next block from its lane of a packed beat'''
+        printer.println('%s = %s.range(DWIDTH*%d - 1, DWIDTH*%d);'
+                        % (self.lineBuffer.buffer_flow[-1].name, beat, self.lane + 1, self.lane))
+
+    @contextlib.contextmanager
+    def _filling(self, printer: Printer, loop_start: int):
+        '''Starts moving data once the Line Buffer is fill_length iterations from i = 0'''
+        if loop_start == -self.lineBuffer.fill_length:
+            yield loop_start
+        else:
+            with printer.if_('i >= %d' % -self.lineBuffer.fill_length):
+                yield -self.lineBuffer.fill_length
 
     def print_c_buffer_def(self, printer:Printer):
-        printer.println('unsigned int %s_buffer_size = GRID_COLS*PART_ROWS + %d*WIDTH_FACTOR'
-                        ' + (TOP_APPEND+BOTTOM_APPEND)*WIDTH_FACTOR*(STAGE_COUNT-1)'
-                        ' + (OVERLAP_TOP_OVERHEAD + OVERLAP_BOTTOM_OVERHEAD)*WIDTH_FACTOR;' %
+        printer.println('unsigned int %s_buffer_size = TILE_BEATS(%d)*WIDTH_FACTOR*TILE_COUNT;' %
                         (self.var_name, self.lineBuffer.min_block_offset + self.lineBuffer.max_block_offset))
-        printer.println('std::vector<std::vector<float, aligned_allocator<float> > > %ss;' % self.var_name)
+        printer.println('std::vector<std::vector<%s_t, aligned_allocator<%s_t> > > %ss;'
+                        % (self.var_name, self.var_name, self.var_name))
         with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
-            printer.println('%ss.emplace_back(%s_buffer_size, 0);' % (self.var_name, self.var_name))
+            printer.println('%ss.emplace_back(%s_buffer_size, %s_t());' % (self.var_name, self.var_name, self.var_name))
 
     def print_c_buffer_init(self, printer:Printer):
         printer.println('read_%s_buffer(%ss);' % (self.var_name, self.var_name))
 
     def print_c_buffer_allocate(self, printer:Printer):
-        printer.println('std::vector<cl_mem_ext_ptr_t> ptr_%ss(KERNEL_COUNT);' % self.var_name)
-        printer.println('std::vector<cl::Buffer> device_%ss;' % self.var_name)
-
+        _print_c_buffer_allocate(printer, self.var_name, '%s_t' % self.var_name)
+
+    def _c_partition_slices(self):
+        '''(condition, destination, file offset, length) of each partition in read_*_buffer'''
+        return [
+            ('i == 0',
+             '%ss[i].data() + %d*WIDTH_FACTOR/*min_block_offsets*/ + TOP_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) '
+             '+ OVERLAP_TOP_OVERHEAD*WIDTH_FACTOR' % (self.var_name, self.lineBuffer.min_block_offset),
+             '0',
+             'GRID_COLS*PART_ROWS + %d*WIDTH_FACTOR/*max_block_offsets*/ + BOTTOM_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) '
+             '+ OVERLAP_BOTTOM_OVERHEAD*WIDTH_FACTOR' % self.lineBuffer.max_block_offset),
+            ('i == KERNEL_COUNT - 1',
+             '%ss[i].data()' % self.var_name,
+             'GRID_COLS*PART_ROWS*i - %d*WIDTH_FACTOR/*min_block_offsets*/ '
+             '- TOP_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) - OVERLAP_TOP_OVERHEAD*WIDTH_FACTOR'
+             % self.lineBuffer.min_block_offset,
+             'GRID_COLS*PART_ROWS + %d*WIDTH_FACTOR/*min_block_offsets*/ + TOP_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) '
+             '+ OVERLAP_TOP_OVERHEAD*WIDTH_FACTOR' % self.lineBuffer.min_block_offset),
+            (None,
+             '%ss[i].data()' % self.var_name,
+             'GRID_COLS*PART_ROWS*i - %d*WIDTH_FACTOR/*min_block_offsets*/ '
+             '- TOP_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) - OVERLAP_TOP_OVERHEAD*WIDTH_FACTOR'
+             % self.lineBuffer.min_block_offset,
+             'GRID_COLS*PART_ROWS + %d*WIDTH_FACTOR + (TOP_APPEND+BOTTOM_APPEND)*WIDTH_FACTOR*(STAGE_COUNT-1) '
+             '+ (OVERLAP_TOP_OVERHEAD + OVERLAP_BOTTOM_OVERHEAD)*WIDTH_FACTOR'
+             % (self.lineBuffer.max_block_offset + self.lineBuffer.min_block_offset)),
+        ]
+
+    def _print_c_fill_partitions(self, printer: Printer, source):
+        slices = self._c_partition_slices()
         with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
-            printer.println('ptr_%ss[i].obj = %ss[i].data();' % (self.var_name, self.var_name))
-            printer.println('ptr_%ss[i].param = 0;' % self.var_name)
-            printer.println('ptr_%ss[i].flags = pc[hbm_offset_%s[i]];' % (self.var_name, self.var_name))
-            printer.println()
-            printer.println('OCL_CHECK(err, device_%ss.emplace_back(context, ' 
-                            'CL_MEM_USE_HOST_PTR | CL_MEM_EXT_PTR_XILINX | CL_MEM_READ_WRITE, ' % self.var_name)
-            printer.println('\t%s_buffer_size*sizeof(float), &ptr_%ss[i], &err));' % (self.var_name, self.var_name))
+            with printer.ifel_(slices[0][0]):
+                printer.println('fill_buffer(%s, %s, %s, %s);' % (slices[0][1], source, slices[0][2], slices[0][3]))
+            with printer.elifel_(slices[1][0]):
+                printer.println('fill_buffer(%s, %s, %s, %s);' % (slices[1][1], source, slices[1][2], slices[1][3]))
+            with printer.else_():
+                printer.println('fill_buffer(%s, %s, %s, %s);' % (slices[2][1], source, slices[2][2], slices[2][3]))
+
+    def _print_c_fill_tiles(self, printer: Printer, source):
+        '''Cuts the tiles of every kernel out of the whole grid, see tile_buffer'''
+        printer.println('std::vector<%s_t> %s_grid((size_t)GRID_ROWS*GRID_COLS);' % (self.var_name, self.var_name))
+        printer.println('fill_buffer(%s_grid.data(), %s, 0, (size_t)GRID_ROWS*GRID_COLS);' % (self.var_name, source))
+        self._print_c_scatter_tiles(printer)
 
-    def print_c_load_func(self, printer: Printer):
-        printer.println('void read_%s_buffer(std::vector<std::vector<float, aligned_allocator<float> > >& %ss) {'
-                        % (self.var_name, self.var_name))
+    def _print_c_scatter_tiles(self, printer: Printer):
+        with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
+            printer.println('size_t %s_tile_size = %ss[i].size()/TILE_COUNT;' % (self.var_name, self.var_name))
+            with printer.for_('int t = 0', 't < TILE_COUNT', 't++'):
+                printer.println('tile_buffer(%ss[i].data() + t*%s_tile_size, %s_grid, i, t, '
+                                '(long)TILE_COLS*PART_ROWS*(i/BLOCK_COUNT)'
+                                ' - %d*WIDTH_FACTOR/*min_block_offsets*/ - TOP_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1)'
+                                ' - OVERLAP_TOP_OVERHEAD*WIDTH_FACTOR, %s_tile_size);'
+                                % (self.var_name, self.var_name, self.var_name, self.lineBuffer.min_block_offset,
+                                   self.var_name))
+
+    def print_c_load_func(self, printer: Printer, data_format='text', tiled=False):
+        printer.println('void read_%s_buffer(std::vector<std::vector<%s_t, aligned_allocator<%s_t> > >& %ss) {'
+                        % (self.var_name, self.var_name, self.var_name, self.var_name))
         printer.do_indent()
 
-        printer.println('const std::string %s_path("../data/%s.data");' % (self.var_name, self.var_name))
-        printer.println('std::ifstream %s_file(%s_path);' % (self.var_name, self.var_name))
+        if data_format == 'binary':
+            printer.println('const std::string %s_path("../data/%s.bin");' % (self.var_name, self.var_name))
+            printer.println('size_t %s_count;' % self.var_name)
+            printer.println('const %s_t* %s_data = map_data_file<%s_t>(%s_path, %s_count);'
+                            % (self.var_name, self.var_name, self.var_name, self.var_name, self.var_name))
+        else:
+            printer.println('const std::string %s_path("../data/%s.data");' % (self.var_name, self.var_name))
+            printer.println('std::ifstream %s_file(%s_path);' % (self.var_name, self.var_name))
 
         printer.println()
         printer.println('std::cout << "Start loading %s" << std::endl;' % (self.var_name))
 
         printer.println()
 
-        with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
-
-            with printer.ifel_('i == 0'):
-                printer.println('fill_buffer(%ss[i].data() + %d*WIDTH_FACTOR/*min_block_offsets*/ + TOP_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) '
-                                '+ OVERLAP_TOP_OVERHEAD*WIDTH_FACTOR,'
-                                ' %s_file, 0, GRID_COLS*PART_ROWS + %d*WIDTH_FACTOR/*max_block_offsets*/ + BOTTOM_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) '
-                                '+ OVERLAP_BOTTOM_OVERHEAD*WIDTH_FACTOR);'
-                                % (self.var_name, self.lineBuffer.min_block_offset,
-                                   self.var_name, self.lineBuffer.max_block_offset))
-
-            with printer.elifel_('i == KERNEL_COUNT - 1'):
-                printer.println('fill_buffer(%ss[i].data(), %s_file, GRID_COLS*PART_ROWS*i - %d*WIDTH_FACTOR/*min_block_offsets*/ '
-                                '- TOP_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) - OVERLAP_TOP_OVERHEAD*WIDTH_FACTOR, '
-                                'GRID_COLS*PART_ROWS + %d*WIDTH_FACTOR/*min_block_offsets*/ + TOP_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) '
-                                '+ OVERLAP_TOP_OVERHEAD*WIDTH_FACTOR);'
-                                % (self.var_name, self.var_name, self.lineBuffer.min_block_offset,
-                                   self.lineBuffer.min_block_offset))
-
-            with printer.else_():
-                printer.println('fill_buffer(%ss[i].data(), %s_file, GRID_COLS*PART_ROWS*i - %d*WIDTH_FACTOR/*min_block_offsets*/ '
-                                '- TOP_APPEND*WIDTH_FACTOR*(STAGE_COUNT-1) - OVERLAP_TOP_OVERHEAD, '
-                                'GRID_COLS*PART_ROWS + %d*WIDTH_FACTOR + (TOP_APPEND+BOTTOM_APPEND)*WIDTH_FACTOR*(STAGE_COUNT-1) '
-                                '+ (OVERLAP_TOP_OVERHEAD + OVERLAP_BOTTOM_OVERHEAD)*WIDTH_FACTOR);'
-                                % (self.var_name, self.var_name, self.lineBuffer.min_block_offset,
-                                   self.lineBuffer.max_block_offset + self.lineBuffer.min_block_offset))
+        fill = self._print_c_fill_tiles if tiled else self._print_c_fill_partitions
+        if data_format == 'binary':
+            fill(printer, '%s_data, %s_count' % (self.var_name, self.var_name))
+        else:
+            fill(printer, '%s_file' % self.var_name)
 
         printer.println()
 
-        printer.println('%s_file.close();' % self.var_name)
+        if data_format == 'binary':
+            printer.println('unmap_data_file(%s_data, %s_count);' % (self.var_name, self.var_name))
+        else:
+            printer.println('%s_file.close();' % self.var_name)
         printer.un_indent()
         printer.println('}')
 
+    def print_c_scatter_func(self, printer: Printer, tiled=False):
+        '''Print scatter_*_buffer, which lays out the partitions of the whole grid x_grid like read_*_buffer'''
+        printer.println('void scatter_%s_buffer(std::vector<std::vector<%s_t, aligned_allocator<%s_t> > >& %ss, '
+                        'const std::vector<%s_t> &%s_grid) {'
+                        % (self.var_name, self.var_name, self.var_name, self.var_name, self.var_name, self.var_name))
+        printer.do_indent()
+        if tiled:
+            self._print_c_scatter_tiles(printer)
+        else:
+            # the halo the kernels wrote around the partitions is read as 0
+            with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
+                printer.println('std::fill(%ss[i].begin(), %ss[i].end(), %s_t());'
+                                % (self.var_name, self.var_name, self.var_name))
+            self._print_c_fill_partitions(printer, '%s_grid' % self.var_name)
+        printer.un_indent()
+        printer.println('}')
+
+
+class PackedBufferConfig:
+    """Read-only inputs interleaved into one buffer in memory.
+
+    Beat j of the buffer holds beat j of every input, the input of lane l
+    in bits [DWIDTH*l, DWIDTH*(l+1)), so one m_axi port and one HBM pseudo
+    channel serve all of them. The inputs share a line buffer layout and
+    read the same beat in every iteration.
+
+    Attributes:
+        var_name: buffer and port of the pack, see analysis.pack_name.
+        members: InputBufferConfig of every input, by lane.
+    """
+
+    def __init__(self, var_name, members):
+        self.var_name = var_name
+        self.members = members
+        for lane, member in enumerate(members):
+            member.lane = lane
+        self.lineBuffer = members[0].lineBuffer
+
+    @property
+    def port_name(self):
+        return self.var_name
+
+    @property
+    def port_type(self):
+        return 'PACKED_WIDTH(%d)' % len(self.members)
+
+    def print_define_buffer(self, printer: Printer):
+        for member in self.members:
+            member.print_define_buffer(printer)
+
+    def print_loop_pragmas(self, printer: Printer):
+        for member in self.members:
+            member.print_loop_pragmas(printer)
+
+    def first_read(self, offset=None):
+        return self.members[0].first_read(offset)
+
+    def print_data_movement(self, printer: Printer, loop_start: int, offset=None):
+        '''Print data flow along the Line Buffers, reading one packed beat from memory'''
+        with self.members[0]._filling(printer, loop_start) as loop_start:
+            for member in self.members:
+                member._print_shift(printer, loop_start)
+
+            printer.println()
+            printer.println('unsigned int idx_%s = %s + (i + %s);'
+                            % (self.var_name, self.members[0]._base(offset), self.lineBuffer.buffer_flow[-1].index + 1))
+            printer.println('%s %s_beat = HLS_REG(%s[idx_%s]);'
+                            % (self.port_type, self.var_name, self.var_name, self.var_name))
+            for member in self.members:
+                member.print_unpack(printer, '%s_beat' % self.var_name)
+
+    def print_data_movement_from_stream(self, printer: Printer, loop_start: int):
+        '''Print data flow along the Line Buffers, reading one packed beat from the previous stage'''
+        with self.members[0]._filling(printer, loop_start) as loop_start:
+            for member in self.members:
+                member._print_shift(printer, loop_start)
+
+            printer.println()
+            printer.println('%s %s_beat = %s.read();' % (self.port_type, self.var_name, self.var_name))
+            for member in self.members:
+                member.print_unpack(printer, '%s_beat' % self.var_name)
+
+    def print_c_buffer_def(self, printer: Printer):
+        for member in self.members:
+            member.print_c_buffer_def(printer)
+        # inputs have the same element width and layout, so the same size
+        printer.println('unsigned int %s_buffer_size = %d*%s_buffer_size*sizeof(%s_t);'
+                        % (self.var_name, len(self.members), self.members[0].var_name, self.members[0].var_name))
+        printer.println('std::vector<std::vector<unsigned char, aligned_allocator<unsigned char> > > %ss;'
+                        % self.var_name)
+        with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
+            printer.println('%ss.emplace_back(%s_buffer_size, 0);' % (self.var_name, self.var_name))
+
+    def print_c_buffer_init(self, printer: Printer):
+        for member in self.members:
+            member.print_c_buffer_init(printer)
+        with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
+            for member in self.members:
+                printer.println('pack_buffer(%ss[i], %ss[i], %d, %d);'
+                                % (self.var_name, member.var_name, member.lane, len(self.members)))
+
+    def print_c_buffer_allocate(self, printer: Printer):
+        _print_c_buffer_allocate(printer, self.var_name, 'unsigned char')
+
+
+def port_configs(stencil, input_buffer_configs):
+    '''Buffer config of every input port in the order of stencil.input_ports'''
+    configs = {}
+    for var, buffer_config in input_buffer_configs.items():
+        pack = next((pack for pack in stencil.packs if var in pack), None)
+        if pack is None:
+            configs[var] = buffer_config
+        elif var == pack[0]:
+            name = analysis.pack_name(pack)
+            configs[name] = PackedBufferConfig(name, [input_buffer_configs[member] for member in pack])
+    return configs
+
+
+def _print_c_buffer_allocate(printer: Printer, var_name, element_type):
+    printer.println('std::vector<cl_mem_ext_ptr_t> ptr_%ss(KERNEL_COUNT);' % var_name)
+    printer.println('std::vector<cl::Buffer> device_%ss;' % var_name)
+
+    with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
+        printer.println('ptr_%ss[i].obj = %ss[i].data();' % (var_name, var_name))
+        printer.println('ptr_%ss[i].param = 0;' % var_name)
+        printer.println('ptr_%ss[i].flags = pc[hbm_offset_%s[i]];' % (var_name, var_name))
+        printer.println()
+        printer.println('OCL_CHECK(err, device_%ss.emplace_back(context, ' 
+                        'CL_MEM_USE_HOST_PTR | CL_MEM_EXT_PTR_XILINX | CL_MEM_READ_WRITE, ' % var_name)
+        printer.println('\t%s_buffer_size*sizeof(%s), &ptr_%ss[i], &err));'
+                        % (var_name, element_type, var_name))
+
 
 class OutputBufferConfig:
     def __init__(self, var_name, min_block_offset, max_block_offset):
@@ -295,23 +537,12 @@ class OutputBufferConfig:
         self.max_block_offset = max_block_offset
 
     def print_c_buffer_def(self, printer:Printer):
-        printer.println('unsigned int %s_buffer_size = GRID_COLS*PART_ROWS + %d*WIDTH_FACTOR'
-                        ' + (TOP_APPEND+BOTTOM_APPEND)*WIDTH_FACTOR*(STAGE_COUNT-1)'
-                        ' + (OVERLAP_TOP_OVERHEAD + OVERLAP_BOTTOM_OVERHEAD)*WIDTH_FACTOR;' %
+        printer.println('unsigned int %s_buffer_size = TILE_BEATS(%d)*WIDTH_FACTOR*TILE_COUNT;' %
                         (self.var_name, self.min_block_offset + self.max_block_offset))
-        printer.println('std::vector<std::vector<float, aligned_allocator<float> > > %ss;' % self.var_name)
+        printer.println('std::vector<std::vector<%s_t, aligned_allocator<%s_t> > > %ss;'
+                        % (self.var_name, self.var_name, self.var_name))
         with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
-            printer.println('%ss.emplace_back(%s_buffer_size, 0);' % (self.var_name, self.var_name))
+            printer.println('%ss.emplace_back(%s_buffer_size, %s_t());' % (self.var_name, self.var_name, self.var_name))
 
     def print_c_buffer_allocate(self, printer:Printer):
-        printer.println('std::vector<cl_mem_ext_ptr_t> ptr_%ss(KERNEL_COUNT);' % self.var_name)
-        printer.println('std::vector<cl::Buffer> device_%ss;' % self.var_name)
-
-        with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
-            printer.println('ptr_%ss[i].obj = %ss[i].data();' % (self.var_name, self.var_name))
-            printer.println('ptr_%ss[i].param = 0;' % self.var_name)
-            printer.println('ptr_%ss[i].flags = pc[hbm_offset_%s[i]];' % (self.var_name, self.var_name))
-            printer.println()
-            printer.println('OCL_CHECK(err, device_%ss.emplace_back(context, ' 
-                            'CL_MEM_USE_HOST_PTR | CL_MEM_EXT_PTR_XILINX | CL_MEM_READ_WRITE, ' % self.var_name)
-            printer.println('\t%s_buffer_size*sizeof(float), &ptr_%ss[i], &err));' % (self.var_name, self.var_name))
+        _print_c_buffer_allocate(printer, self.var_name, '%s_t' % self.var_name)
@@ -0,0 +1,206 @@
+import collections
+import concurrent.futures
+import copy
+import logging
+import math
+import os
+from functools import reduce
+
+import codegen
+import core
+from core import analysis
+import dsl
+from dsl import ir
+from codegen import buffer
+from codegen import hbm_gen
+from codegen import perf_model
+
+_logger = logging.getLogger().getChild(__name__)
+
+# Resources of the U280 available to kernels.
+U280_DSP = 9024
+U280_BRAM18K = buffer.U280_BRAM18K
+U280_URAM = buffer.U280_URAM
+# Fraction of the device left to the kernels after the shell and routing.
+UTILIZATION_LIMIT = 0.8
+
+# DSPs of one operator in a PE, by the kind of type the kernel computes in;
+# integer and fixed-point additions are mapped to LUTs.
+OP_DSPS = {
+    'float': {'+': 2, '-': 2, '*': 3},
+    'half': {'+': 2, '-': 2, '*': 2},
+    'fixed': {'*': 1},
+    'int': {'*': 1},
+}
+KERNEL_COUNTS = tuple(range(1, hbm_gen.HBM_CHANNEL_COUNT + 1))
+BOARDER_TYPES = ('overlap', 'streaming', 'hybrid')
+
+DesignPoint = collections.namedtuple('DesignPoint',
+                                     ['kernel_count', 'repeat_count', 'boarder_type', 'unroll_factor'])
+
+Evaluation = collections.namedtuple('Evaluation',
+                                    ['point', 'cycles', 'seconds', 'gcells_per_second', 'dsp', 'bram', 'uram'])
+
+# per process state of the worker pool, see _init_worker
+_worker_stencil = None
+_worker_pe_dsp = 0
+
+
+def load_stencil(dsl_file):
+    return core.stencil_from_program(dsl.metamodel().model_from_file(dsl_file))
+
+
+def pe_dsp(stencil):
+    '''DSPs of one PE evaluating the local and output statements'''
+
+    def visitor(node, args):
+        if isinstance(node, ir.BinaryOp):
+            args.extend(node.operator)
+        elif isinstance(node, ir.Call) and node.name == 'fmaf':
+            args.extend('*+')
+
+    operators = []
+    stencil.output_stmt.expr.visit(visitor, operators)
+    for local_stmt in stencil.local_stmts:
+        local_stmt.let.expr.visit(visitor, operators)
+    return sum(OP_DSPS[stencil.compute_type.kind].get(operator, 0) for operator in operators)
+
+
+def design_points(stencil):
+    """Enumerates the configurations the generator accepts for a stencil.
+
+    Kernel counts must split GRID_ROWS evenly and leave every kernel one HBM
+    pseudo channel per buffer, unroll factors must split GRID_COLS evenly,
+    streaming mode needs an up and a down kernel and hybrid mode more than
+    one partition to refresh.
+    """
+    grid_cols = reduce(lambda x, y: x*y, stencil.size[1:])
+    buffer_count = len(stencil.input_ports) + 1
+    points = []
+    for kernel_count in KERNEL_COUNTS:
+        if stencil.size[0] % kernel_count != 0 or not hbm_gen.fits_hbm(kernel_count, buffer_count):
+            continue
+        for repeat_count in range(1, stencil.iterate + 1):
+            for boarder_type in BOARDER_TYPES:
+                # a single pass never exchanges, every mode generates unikernel
+                if stencil.iterate / repeat_count <= 1 and boarder_type != 'overlap':
+                    continue
+                if boarder_type != 'overlap' and kernel_count < 2:
+                    continue
+                for width in analysis.INTERFACE_WIDTHS:
+                    unroll_factor = width // stencil.element_width
+                    if grid_cols % unroll_factor == 0:
+                        points.append(DesignPoint(kernel_count, repeat_count, boarder_type, unroll_factor))
+    return points
+
+
+def _init_worker(dsl_file):
+    global _worker_stencil, _worker_pe_dsp
+    logging.getLogger().setLevel(logging.WARNING)
+    _worker_stencil = load_stencil(dsl_file)
+    _worker_pe_dsp = pe_dsp(_worker_stencil)
+
+
+def evaluate(point, freq_mhz):
+    """Estimates the performance and resources of one design point.
+
+    Args:
+        point: DesignPoint to evaluate.
+        freq_mhz: kernel clock in MHz.
+
+    Returns:
+        Evaluation of the point.
+    """
+    stencil = copy.copy(_worker_stencil)
+    stencil.kernel_count = point.kernel_count
+    stencil.repeat_count = point.repeat_count
+    stencil.boarder_type = point.boarder_type
+    stencil.width = point.unroll_factor * stencil.element_width
+    stencil.epoch = None
+    codegen.plan_epoch(stencil, freq_mhz)
+
+    input_buffer_configs, output_buffer_config = codegen.buffer_configs(stencil)
+    result = perf_model.estimate(stencil, input_buffer_configs, output_buffer_config, freq_mhz)
+
+    instances = point.kernel_count * point.repeat_count
+    return Evaluation(point, result.cycles, result.seconds, result.gcells_per_second,
+                      instances * point.unroll_factor * _worker_pe_dsp, instances * result.bram,
+                      instances * result.uram)
+
+
+def fits_device(evaluation):
+    return (evaluation.dsp <= U280_DSP * UTILIZATION_LIMIT and
+            evaluation.bram <= U280_BRAM18K * UTILIZATION_LIMIT and
+            evaluation.uram <= U280_URAM * UTILIZATION_LIMIT)
+
+
+def utilization(evaluation):
+    return max(evaluation.dsp / U280_DSP, evaluation.bram / U280_BRAM18K, evaluation.uram / U280_URAM)
+
+
+def pareto_rank(evaluations):
+    """Sorts evaluations into non-dominated fronts.
+
+    A point dominates another if it is at least as fast with at most the
+    utilization of the scarcest resource, and strictly better in one of them.
+
+    Returns:
+        list of fronts, each sorted by descending throughput.
+    """
+    fronts = []
+    remaining = sorted(evaluations, key=lambda e: (-e.gcells_per_second, utilization(e)))
+    while remaining:
+        front, dominated = [], []
+        best_utilization = math.inf
+        # sorted by throughput, so a point is dominated if and only if a faster
+        # point uses less resources
+        for evaluation in remaining:
+            if utilization(evaluation) < best_utilization:
+                front.append(evaluation)
+                best_utilization = utilization(evaluation)
+            else:
+                dominated.append(evaluation)
+        fronts.append(front)
+        remaining = dominated
+    return fronts
+
+
+def explore(dsl_file, freq_mhz=300.0, jobs=None):
+    """Sweeps kernel count, repeat count, border type and unroll factor.
+
+    The points are evaluated with perf_model in a process pool; every worker
+    parses dsl_file once, since textX models cannot be pickled.
+
+    Args:
+        dsl_file: path of the DSL program.
+        freq_mhz: kernel clock in MHz.
+        jobs: number of worker processes, defaults to the number of CPUs.
+
+    Returns:
+        list of Pareto fronts of the points that fit the device.
+    """
+    points = design_points(load_stencil(dsl_file))
+    _logger.info('explore %d design points of %s', len(points), dsl_file)
+    jobs = jobs or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                                initargs=(dsl_file,)) as executor:
+        evaluations = list(executor.map(evaluate, points, [freq_mhz]*len(points),
+                                        chunksize=max(1, len(points) // (jobs*4))))
+    feasible = [evaluation for evaluation in evaluations if fits_device(evaluation)]
+    _logger.info('%d of %d design points fit the device', len(feasible), len(points))
+    return pareto_rank(feasible)
+
+
+def report(fronts, max_rank=1):
+    lines = ['%4s %7s %6s %9s %6s %12s %10s %9s %6s %6s %6s'
+             % ('rank', 'kernels', 'repeat', 'border', 'unroll', 'cycles', 'time(ms)', 'GCell/s', 'DSP%', 'BRAM%',
+                'URAM%')]
+    for rank, front in enumerate(fronts[:max_rank], 1):
+        for evaluation in front:
+            point = evaluation.point
+            lines.append('%4d %7d %6d %9s %6d %12d %10.3f %9.3f %6.1f %6.1f %6.1f'
+                         % (rank, point.kernel_count, point.repeat_count, point.boarder_type,
+                            point.unroll_factor, evaluation.cycles, evaluation.seconds * 1e3,
+                            evaluation.gcells_per_second, 100.0 * evaluation.dsp / U280_DSP,
+                            100.0 * evaluation.bram / U280_BRAM18K, 100.0 * evaluation.uram / U280_URAM))
+    return lines
@@ -3,49 +3,127 @@ import math
 from copy import copy
 
 from codegen import codegen_utils
+from core import analysis
 
 _logger = logging.getLogger().getChild(__name__)
 
-
-def hbm_files_gen(stencil, head_file, cfg_file):
+HBM_CHANNEL_COUNT = 32
+
+
+def fits_hbm(kernel_count, buffer_count):
+    '''Every kernel owns an interval of at least one pseudo channel, which its buffers share if they must'''
+    return kernel_count <= HBM_CHANNEL_COUNT
+
+
+class HbmPlan():
+    """Pseudo channels of the buffers of every kernel.
+
+    Attributes:
+        channels: dict of the channel of every kernel by variable.
+        slrs: SLR of every kernel.
+        channel_count: fewest channels of the interval of a kernel.
+        loads: dict of the bytes one kernel moves through each of its
+            channels, by channel of the kernel with the busiest channel.
+        contention: how many INTERFACE_WIDTH ports' worth of traffic the
+            busiest channel of all kernels carries, 1 if every buffer has a
+            channel of its own and none is packed.
+    """
+
+    def __init__(self, variables):
+        self.channels = {var: [] for var in variables}
+        self.slrs = []
+        self.channel_count = HBM_CHANNEL_COUNT
+        self.loads = {}
+        self.contention = 1.0
+
+
+def _kernel_slots(stencil):
+    '''SLR of every kernel and the position of its channel interval'''
+    if stencil.iterate == 1 or stencil.overlapped:
+        return [i % 3 for i in range(stencil.kernel_count)], list(range(stencil.kernel_count))
+
+    # streaming kernels exchange with their neighbours, consecutive kernels
+    # share an SLR and their channels interleave with the other SLRs
+    kernel_per_slr = math.ceil(stencil.kernel_count/3)
+    slrs, slots = [], []
+    for i in range(0, stencil.kernel_count):
+        slrs.append(math.floor(i/kernel_per_slr))
+        if slrs[-1] == 1:
+            slots.append(slrs[-1] + (kernel_per_slr - i % kernel_per_slr - 1) * 3)
+        else:
+            slots.append(slrs[-1] + (i % kernel_per_slr) * 3)
+    # rank the slots, they skip positions when the kernels do not fill every SLR
+    ranks = sorted(range(stencil.kernel_count), key=lambda i: slots[i])
+    return slrs, [ranks.index(i) for i in range(stencil.kernel_count)]
+
+
+def allocate(stencil, traffic):
+    """Assigns pseudo channels to the buffers of every kernel.
+
+    Every kernel owns an interval of HBM_CHANNEL_COUNT/kernel_count
+    adjacent channels, close to each other on the HBM switch. Its buffers
+    are placed from the most to the least traffic, each on the channel of
+    the interval that moves the fewest bytes so far, so buffers only share
+    a channel when the interval has fewer channels than buffers, and then
+    the busiest buffers share the least.
+
+    Args:
+        stencil: core.Stencil to allocate for.
+        traffic: dict of the bytes every buffer of one kernel moves, see
+            perf_model.buffer_traffic.
+
+    Returns:
+        HbmPlan of the kernels.
+    """
+    all_vars = copy(stencil.input_ports)
+    all_vars.append(stencil.output_var)
+    plan = HbmPlan(all_vars)
+    plan.slrs, slots = _kernel_slots(stencil)
+
+    interval = HBM_CHANNEL_COUNT / stencil.kernel_count
+    # stable, so buffers of equal traffic keep the order of the variables
+    order = sorted(all_vars, key=lambda var: -traffic[var])
+    for slot in slots:
+        channels = range(math.floor(slot*interval), math.floor((slot + 1)*interval))
+        loads = {channel: 0 for channel in channels}
+        for var in order:
+            channel = min(channels, key=lambda channel: loads[channel])
+            loads[channel] += traffic[var]
+            plan.channels[var].append(channel)
+        # intervals are rounded to whole channels, some kernels get fewer
+        plan.channel_count = min(plan.channel_count, len(channels))
+        if not plan.loads or max(loads.values()) > max(plan.loads.values()):
+            plan.loads = loads
+
+    if len(all_vars) > plan.channel_count:
+        _logger.debug('%d buffers share %d HBM pseudo channels per kernel', len(all_vars), plan.channel_count)
+    # a packed port moves a beat of every input it packs
+    lanes = {analysis.pack_name(pack): len(pack) for pack in stencil.packs}
+    port_traffic = max(traffic[var] / lanes.get(var, 1) for var in all_vars)
+    if port_traffic:
+        plan.contention = max(plan.loads.values()) / port_traffic
+    _logger.debug('HBM pseudo channels of kernel 0: %s',
+                  ', '.join('%s:%d' % (var, plan.channels[var][0]) for var in all_vars))
+    return plan
+
+
+def hbm_files_gen(stencil, head_file, cfg_file, traffic):
     _logger.info('generate hbm config head code as %s', head_file.name)
     printer = codegen_utils.Printer(head_file)
 
-    all_vars = copy(stencil.input_vars)
+    all_vars = copy(stencil.input_ports)
     all_vars.append(stencil.output_var)
 
-    interval = 32 / stencil.kernel_count
-
-    if interval < len(all_vars):
+    if not fits_hbm(stencil.kernel_count, len(all_vars)):
         _logger.error('required buffer num is out of bound, consider use less kernels')
         exit(1)
 
-    '''different heuristic schedules for overlap and streaming mode'''
-    hbm_schedules = {}
-    slr_schedules = []
-    for var in all_vars:
-        hbm_schedules[var] = []
-
-    if stencil.iterate == 1 or stencil.boarder_type == 'overlap':
-        for i in range(0, stencil.kernel_count):
-            slr_schedules.append(i % 3)
-            j = 0
-            for var in all_vars:
-                hbm_schedules[var].append(math.floor(i*interval)+j)
-                j += 1
-    else:
-        kernel_per_slr = math.ceil(stencil.kernel_count/3)
-        for i in range(0, stencil.kernel_count):
-            slr_schedules.append(math.floor(i/kernel_per_slr))
-            j = 0
-            for var in all_vars:
-                if slr_schedules[-1] == 1:
-                    hbm_to_assign = math.floor(interval * (slr_schedules[-1] +
-                                                           (kernel_per_slr - i % kernel_per_slr - 1) * 3)) + j
-                else:
-                    hbm_to_assign = math.floor(interval * (slr_schedules[-1] + (i % kernel_per_slr) * 3)) + j
-                hbm_schedules[var].append(hbm_to_assign)
-                j += 1
+    plan = allocate(stencil, traffic)
+    if len(all_vars) > plan.channel_count:
+        _logger.warning('%d buffers share %d HBM pseudo channels per kernel, which limits their bandwidth',
+                        len(all_vars), plan.channel_count)
+    hbm_schedules = plan.channels
+    slr_schedules = plan.slrs
 
     '''hbm_config.h generation'''
     printer.println('#ifndef HBM_CONFIG_H')
@@ -65,7 +143,7 @@ def hbm_files_gen(stencil, head_file, cfg_file):
 
     printer.println('[connectivity]')
 
-    if stencil.iterate == 1 or stencil.boarder_type == 'overlap':
+    if stencil.iterate == 1 or stencil.overlapped:
         printer.println('nk=unikernel:%s' % stencil.kernel_count)
         printer.println()
 
@@ -20,18 +20,47 @@ def head_gen(stencil, output_file, output_buffer_config):
     printer.println()
 
     printer.println('#define KERNEL_COUNT %d' % stencil.kernel_count)
-    printer.println('#define PART_ROWS GRID_ROWS / KERNEL_COUNT')
+    if stencil.partition is None:
+        printer.println('#define PART_ROWS GRID_ROWS / KERNEL_COUNT')
+    else:
+        printer.println('#define ROW_PARTS %d' % stencil.row_parts)
+        printer.println('#define PART_ROWS GRID_ROWS / ROW_PARTS')
+    printer.println()
+
+    # a partition is streamed tile by tile, rows of a tile are TILE_COLS long
+    printer.println('#define TILE_COUNT %d' % stencil.tile_count)
+    printer.println('#define TILE_COLS %d' % reduce(lambda x,y: x*y, stencil.tile_size[1:]))
+    if stencil.tiled:
+        # kernel i computes block i % BLOCK_COUNT of the rows of band i / BLOCK_COUNT
+        printer.println('#define BLOCK_COUNT %d' % (stencil.kernel_count // stencil.row_parts))
+        printer.println('#define TILE_DIM_COUNT %d' % len(stencil.tile_extents))
+        printer.println('const int GRID_DIMS[] = {%s};' % ', '.join('%d' % dim for dim in stencil.size[1:]))
+        printer.println('const int BLOCK_DIMS[] = {%s};' % ', '.join('%d' % dim for dim in stencil.block_size[1:]))
+        printer.println('const int TILE_DIMS[] = {%s};' % ', '.join('%d' % extent for extent in stencil.tile_extents))
+        printer.println('const int TILE_WIDTHS[] = {%s};' % ', '.join('%d' % width for width in stencil.tile_size[1:]))
+        printer.println('const int TILE_HALOS[] = {%s};' % ', '.join('%d' % before for before, _ in stencil.tile_halos))
     printer.println()
 
-    printer.println('#define ITERATION %d' % stencil.iterate)
+    printer.println('#define ITERATION %d' % stencil.kernel_iterate)
+    if stencil.boarder_type == 'hybrid':
+        # the host refreshes the halos of the partitions between launches
+        printer.println('#define EPOCH_COUNT %d' % stencil.epoch_count)
     printer.println()
 
     printer.println('#include "ap_int.h"')
     printer.println('#include <inttypes.h>')
-    printer.println('#define DWIDTH 512')
+    kinds = set(data_type.kind for data_type in stencil.types.values())
+    if 'fixed' in kinds:
+        printer.println('#include "ap_fixed.h"')
+    if 'half' in kinds:
+        printer.println('#include "hls_half.h"')
+    printer.println('#define DWIDTH %d' % stencil.width)
     printer.println('#define INTERFACE_WIDTH ap_uint<DWIDTH>')
-    printer.println('\tconst int WIDTH_FACTOR = DWIDTH/32;')
-    printer.println('#define PARA_FACTOR 16')
+    if stencil.packs:
+        printer.println('#define PACKED_WIDTH(lanes) ap_uint<DWIDTH*(lanes)>')
+    printer.println('#define ELEMENT_WIDTH %d' % stencil.element_width)
+    printer.println('\tconst int WIDTH_FACTOR = DWIDTH/ELEMENT_WIDTH;')
+    printer.println('#define PARA_FACTOR %d' % stencil.unroll_factor)
     printer.println()
 
     printer.println('#define STAGE_COUNT %d' % stencil.repeat_count)
@@ -44,13 +73,28 @@ def head_gen(stencil, output_file, output_buffer_config):
         printer.println('#include "ap_axi_sdata.h"')
         printer.println('typedef ap_axiu<DWIDTH, 0, 0, 0> pkt;')
 
-    if stencil.boarder_type == 'overlap':
-        printer.println('#define OVERLAP_TOP_OVERHEAD %d' % ((stencil.iterate-stencil.repeat_count)*output_buffer_config.min_block_offset))
-        printer.println('#define OVERLAP_BOTTOM_OVERHEAD %d' % ((stencil.iterate-stencil.repeat_count)*output_buffer_config.max_block_offset))
+    if stencil.overlapped:
+        printer.println('#define OVERLAP_TOP_OVERHEAD %d' % ((stencil.kernel_iterate-stencil.repeat_count)*output_buffer_config.min_block_offset))
+        printer.println('#define OVERLAP_BOTTOM_OVERHEAD %d' % ((stencil.kernel_iterate-stencil.repeat_count)*output_buffer_config.max_block_offset))
     else:
         printer.println('#define OVERLAP_TOP_OVERHEAD 0')
         printer.println('#define OVERLAP_BOTTOM_OVERHEAD 0')
 
+    if stencil.overlapped and stencil.kernel_iterate > stencil.repeat_count:
+        # a pass only computes the halo the passes after it still consume
+        printer.println('#define PASS_ITERATIONS_LEFT(finished) '
+                        '(ITERATION-(finished)-STAGE_COUNT > 0 ? ITERATION-(finished)-STAGE_COUNT : 0)')
+        printer.println('#define PASS_TOP_OVERHEAD(finished) (PASS_ITERATIONS_LEFT(finished)*TOP_APPEND)')
+        printer.println('#define PASS_BOTTOM_OVERHEAD(finished) (PASS_ITERATIONS_LEFT(finished)*BOTTOM_APPEND)')
+    else:
+        printer.println('#define PASS_TOP_OVERHEAD(finished) OVERLAP_TOP_OVERHEAD')
+        printer.println('#define PASS_BOTTOM_OVERHEAD(finished) OVERLAP_BOTTOM_OVERHEAD')
+    printer.println('#define PASS_TOP_SKIP(finished) (OVERLAP_TOP_OVERHEAD-PASS_TOP_OVERHEAD(finished))')
+
+    # beats of one tile of a buffer whose line buffer reaches blocks before and after a block
+    printer.println('#define TILE_BEATS(blocks) (TILE_COLS/WIDTH_FACTOR*PART_ROWS + (blocks)'
+                    ' + (TOP_APPEND+BOTTOM_APPEND)*(STAGE_COUNT-1) + OVERLAP_TOP_OVERHEAD + OVERLAP_BOTTOM_OVERHEAD)')
+
     printer.println('#define DECRE_TOP_APPEND %d' % output_buffer_config.min_block_offset)
     printer.println('#define DECRE_BOTTOM_APPEND %d' % output_buffer_config.max_block_offset)
 
@@ -1,73 +1,53 @@
-up_exchange = '''
-static void exchange_stream(INTERFACE_WIDTH *result, hls::stream<pkt> &streaming_to, hls::stream<pkt> &streaming_from){
-    int i;
-    for(i = 0; i < TOP_APPEND*STAGE_COUNT; i++){
-#pragma HLS pipeline II=1        
-        pkt temp; 
-        temp.data = result[i + GRID_COLS/WIDTH_FACTOR*PART_ROWS].range(511, 0);
-        streaming_to.write(temp);  
-    }
-    for(i = 0; i < BOTTOM_APPEND*STAGE_COUNT; i++){
+send_halo = '''
+static void send_halo(INTERFACE_WIDTH *src, hls::stream<pkt> &dst, int offset, int count){
+    SEND_LOOP:
+    for(int i = 0; i < count; i++){
 #pragma HLS pipeline II=1
-        pkt temp2 = streaming_from.read();          
-        result[i + GRID_COLS/PARA_FACTOR*PART_ROWS + (TOP_APPEND-BOTTOM_APPEND)*STAGE_COUNT].range(511, 0) = temp2.data;
+        pkt temp;
+        temp.data = src[offset + i].range(DWIDTH-1, 0);
+        dst.write(temp);
     }
 }
 '''
 
-mid_exchange = '''
-static void exchange_with_up(INTERFACE_WIDTH *result, hls::stream<pkt> &streaming_to, hls::stream<pkt> &streaming_from){
-    int i;
-    for(i = 0; i < TOP_APPEND*STAGE_COUNT; i++){
+receive_halo = '''
+static void receive_halo(hls::stream<pkt> &src, hls::stream<INTERFACE_WIDTH> &dst, int count){
+    RECEIVE_LOOP:
+    for(int i = 0; i < count; i++){
 #pragma HLS pipeline II=1
-        pkt temp2 = streaming_from.read();          
-        result[i].range(511, 0) = temp2.data;
-    }
-    for(i = 0; i < BOTTOM_APPEND*STAGE_COUNT; i++){
-#pragma HLS pipeline II=1        
-        pkt temp; 
-        temp.data = result[i + TOP_APPEND*STAGE_COUNT].range(511, 0);
-        streaming_to.write(temp);
+        pkt temp = src.read();
+        dst << temp.data;
     }
 }
+'''
 
-static void exchange_with_down(INTERFACE_WIDTH *result, hls::stream<pkt> &streaming_to, 
-        hls::stream<pkt> &streaming_from){
-    int i;
-    for(i = 0; i < TOP_APPEND*STAGE_COUNT; i++){
-#pragma HLS pipeline II=1        
-        pkt temp; 
-        temp.data = result[i + GRID_COLS/WIDTH_FACTOR*PART_ROWS].range(511, 0);
-        streaming_to.write(temp);  
-    }
-    for(i = 0; i < BOTTOM_APPEND*STAGE_COUNT; i++){
+burst_load = '''
+template<class T>
+static void load(T *src, hls::stream<T> &dst, int offset, int count){
+    LOAD_LOOP:
+    for(int i = 0; i < count; i++){
 #pragma HLS pipeline II=1
-        pkt temp2 = streaming_from.read();          
-        result[i + GRID_COLS/PARA_FACTOR*PART_ROWS + (TOP_APPEND-BOTTOM_APPEND)*STAGE_COUNT].range(511, 0) = temp2.data;
+        dst << src[offset + i];
     }
 }
-
-static void exchange_stream(INTERFACE_WIDTH *result, 
-        hls::stream<pkt> &streaming_to_up, hls::stream<pkt> &streaming_from_up, 
-        hls::stream<pkt> &streaming_to_down, hls::stream<pkt> &streaming_from_down){
-    exchange_with_up(result, streaming_to_up, streaming_from_up);
-    exchange_with_down(result, streaming_to_down, streaming_from_down);
-}
 '''
 
-down_exchange = '''
-static void exchange_stream(INTERFACE_WIDTH *result, hls::stream<pkt> &streaming_to, hls::stream<pkt> &streaming_from){
-    int i;
-    for(i = 0; i < TOP_APPEND*STAGE_COUNT; i++){
+burst_store = '''
+static void store(hls::stream<INTERFACE_WIDTH> &src, INTERFACE_WIDTH *dst, int offset, int count){
+    STORE_LOOP:
+    for(int i = 0; i < count; i++){
 #pragma HLS pipeline II=1
-        pkt temp2 = streaming_from.read();          
-        result[i].range(511, 0) = temp2.data;
-    }
-    for(i = 0; i < BOTTOM_APPEND*STAGE_COUNT; i++){
-#pragma HLS pipeline II=1        
-        pkt temp; 
-        temp.data = result[i + TOP_APPEND*STAGE_COUNT].range(511, 0);
-        streaming_to.write(temp);
+        dst[offset + i] = src.read();
     }
 }
-'''
\ No newline at end of file
+'''
+
+fixed_from_raw = '''
+template<class T, class R>
+T fixed_from_raw(R raw){
+#pragma HLS inline
+    T value;
+    value.range() = raw;
+    return value;
+}
+'''
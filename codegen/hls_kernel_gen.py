@@ -1,14 +1,22 @@
 import copy
 import logging
+import re
 from itertools import chain
 
+from codegen import buffer
 from codegen import codegen_utils
 from codegen import hls_kernel_codes
 import core
+from core import analysis
 from dsl import ir
 
 _logger = logging.getLogger().getChild(__name__)
 
+# m_axi settings of the dataflow architecture: bursts of up to 4 KiB and
+# enough outstanding requests to prefetch across the HBM latency
+BURST_LENGTH = 64
+OUTSTANDING = 16
+
 
 def kernel_gen(stencil, output_file, input_buffer_configs, output_buffer_config, position='uni'):
     _logger.info('generate kernel code as %s', output_file.name)
@@ -21,31 +29,43 @@ def kernel_gen(stencil, output_file, input_buffer_configs, output_buffer_config,
     printer.println()
     _print_force_movement(printer)
 
+    if any(data_type.kind == 'fixed' for data_type in stencil.types.values()):
+        printer.println(hls_kernel_codes.fixed_from_raw)
+
     printer.println()
     _print_stencil_kernel(stencil, printer)
 
     printer.println()
-    if stencil.repeat_count == 1:
+    if stencil.architecture == 'dataflow':
+        printer.println(hls_kernel_codes.burst_load)
+    if stencil.architecture == 'dataflow' or position != 'uni':
+        printer.println(hls_kernel_codes.burst_store)
+    if position != 'uni':
+        _print_stream_function(stencil, printer, position)
+        printer.println()
+
+    if stencil.architecture == 'dataflow':
+        for i in range(stencil.repeat_count):
+            _print_stage_mid(stencil, printer, input_buffer_configs, i, 'stage_%d' % i)
+        _print_dataflow_backbone(stencil, printer, input_buffer_configs, position)
+    elif stencil.repeat_count == 1:
         _print_backbone(stencil, printer, input_buffer_configs)
     elif stencil.repeat_count == 2:
         _print_stage_in(stencil, printer, input_buffer_configs)
         _print_stage_out(stencil, printer, input_buffer_configs, 1)
-        _print_multistage_backbone(stencil, printer)
+        _print_multistage_backbone(stencil, printer, input_buffer_configs)
     else:
         _print_stage_in(stencil, printer, input_buffer_configs)
         for i in range(1, stencil.repeat_count-1):
             _print_stage_mid(stencil, printer, input_buffer_configs, i)
         _print_stage_out(stencil, printer, input_buffer_configs, stencil.repeat_count-1)
-        _print_multistage_backbone(stencil, printer)
-
-
-    _print_stream_function(printer, output_buffer_config, position)
+        _print_multistage_backbone(stencil, printer, input_buffer_configs)
 
     printer.println()
     printer.println('extern "C"{')
 
     if position == 'uni':
-        _print_interface(stencil, printer)
+        _print_interface(stencil, printer, input_buffer_configs, output_buffer_config)
     else:
         _print_stream_interface(stencil, printer, position)
     printer.println('}')
@@ -63,22 +83,67 @@ def _print_force_movement(printer):
     printer.un_indent()
     println('}')
 
+def _element_shift(stencil: core.Stencil) -> int:
+    '''log2 of the element width, idx_k = k << shift is the lowest bit of lane k'''
+    return stencil.element_width.bit_length() - 1
+
+def _fill_length(input_buffer_configs) -> int:
+    '''Iterations of MAJOR_LOOP before i = 0 that fill the line buffers'''
+    return max(buffer_instance.lineBuffer.fill_length for buffer_instance in input_buffer_configs.values())
+
+def _trip_count(stencil: core.Stencil, decrement=0) -> str:
+    '''C expression of the MAJOR_LOOP trip count of a stage after decrement stages'''
+    trip = 'TILE_COLS/WIDTH_FACTOR*PART_ROWS + (PASS_TOP_OVERHEAD(finished)+PASS_BOTTOM_OVERHEAD(finished))'
+    if stencil.repeat_count > 1:
+        trip += ' + (TOP_APPEND+BOTTOM_APPEND)*(STAGE_COUNT-1)'
+    if decrement:
+        trip += ' - (DECRE_TOP_APPEND+DECRE_BOTTOM_APPEND)*%d' % decrement
+    return trip
+
+def _burst_options(stencil: core.Stencil) -> str:
+    '''m_axi options of the dataflow architecture, whose load and store only access memory sequentially'''
+    if stencil.architecture != 'dataflow':
+        return ''
+    return (' max_read_burst_length=%d num_read_outstanding=%d max_write_burst_length=%d num_write_outstanding=%d'
+            % (BURST_LENGTH, OUTSTANDING, BURST_LENGTH, OUTSTANDING))
+
+def _port_type(stencil: core.Stencil, port: str) -> str:
+    '''Type of the m_axi port of an input or the output'''
+    for pack in stencil.packs:
+        if port == analysis.pack_name(pack):
+            return 'PACKED_WIDTH(%d)' % len(pack)
+    return 'INTERFACE_WIDTH'
+
+def _num_c_type(stencil: core.Stencil, num: str) -> str:
+    '''Integer stencils keep floating-point literals float, as C would'''
+    if stencil.compute_type.kind == 'int' and not re.fullmatch(r'[+-]?\d+[UuLl]*', num):
+        return 'float'
+    return stencil.compute_type.c_type
+
 def _print_stencil_kernel(stencil: core.Stencil, printer: codegen_utils.Printer):
     all_refs = stencil.all_refs
     ports = []
     for name, positions in all_refs.items():
         for position in positions:
-            ports.append("float %s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
+            ports.append("%s %s_%s" % (stencil.types[name].c_type, name,
+                                       '_'.join(codegen_utils.idx2str(idx) for idx in position)))
     for scalar in stencil.scalar_vars:
         ports.append('float %s' % scalar)
 
-    printer.print_func('static float %s_stencil_kernel' % stencil.app_name, ports)
+    printer.print_func('static %s %s_stencil_kernel' % (stencil.types[stencil.output_var].c_type, stencil.app_name),
+                       ports)
     printer.do_scope('stencil kernel definition')
 
     def mutate_name(node: ir.Node, relative_idx: (int,)):
         if isinstance(node, ir.Ref):
             real_idx = codegen_utils.cal_relative(node.idx, relative_idx)
             node.name = node.name + '_' + '_'.join(codegen_utils.idx2str(x) for x in real_idx)
+        elif isinstance(node, ir.Let) and stencil.compute_type.c_type != ir.Let.c_type:
+            node.c_type = stencil.compute_type.c_type
+        elif isinstance(node, ir.Operand) and node.num is not None:
+            num_c_type = _num_c_type(stencil, str(node.num))
+            if num_c_type != ir.Operand.num_c_type:
+                node.num_c_type = num_c_type
         return node
 
     output_stmt = stencil.output_stmt.visit(mutate_name, stencil.output_idx)
@@ -99,91 +164,88 @@ def _print_stencil_kernel(stencil: core.Stencil, printer: codegen_utils.Printer)
 
     printer.un_scope()
 
-# TODO: add skip parameter to 1-stage backbone
 def _print_backbone(stencil: core.Stencil, printer: codegen_utils.Printer, input_buffer_configs):
+    output_type = stencil.types[stencil.output_var]
     input_names = stencil.input_vars
+    port_configs = buffer.port_configs(stencil, input_buffer_configs)
     input_def = []
-    for input_var in stencil.input_vars:
-        input_def.append('INTERFACE_WIDTH *%s' % input_var)
+    for port, buffer_instance in port_configs.items():
+        input_def.append('%s *%s' % (buffer_instance.port_type, port))
 
     input_def.append('INTERFACE_WIDTH *%s' % stencil.output_var)
     for scalar in stencil.scalar_vars:
         input_def.append('float %s' % scalar)
 
+    input_def.append('int finished')
+
     printer.print_func('static void %s' % stencil.app_name, input_def)
     printer.do_scope('stencil kernel definition')
-    for buffer_instance in input_buffer_configs.values():
+    for buffer_instance in port_configs.values():
         buffer_instance.print_define_buffer(printer)
         printer.println()
 
-    for buffer_instance in input_buffer_configs.values():
-        buffer_instance.print_init_buffer(printer)
-        printer.println()
-
+    fill = _fill_length(input_buffer_configs)
+    printer.println('const int trip_count = %s;' % _trip_count(stencil))
     printer.println('MAJOR_LOOP:')
-    with printer.for_('int i = 0',
-                      'i < GRID_COLS/WIDTH_FACTOR*PART_ROWS + (OVERLAP_TOP_OVERHEAD+OVERLAP_BOTTOM_OVERHEAD)',
-                      'i++'):
+    with printer.for_('int i = -%d' % fill, 'i < trip_count', 'i++'):
         printer.println('#pragma HLS pipeline II=1')
+        for buffer_instance in port_configs.values():
+            buffer_instance.print_loop_pragmas(printer)
         printer.println()
-        printer.println('COMPUTE_LOOP:')
-        with printer.for_('int k = 0', 'k < PARA_FACTOR', 'k++'):
-            printer.println('#pragma HLS unroll')
-
-            all_refs = stencil.all_refs
-            all_ports = []
-            for name, positions in all_refs.items():
-                ports = []
-                for position in positions:
-                    ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
-                    all_ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
-                printer.println('float ' + ', '.join(map(lambda x: x + '[PARA_FACTOR]', ports)) + ';')
-                for port in ports:
-                    printer.println('#pragma HLS array_partition variable=%s complete dim=0'
-                                    % port)
-                printer.println()
-
-            printer.println()
-            printer.println('unsigned int idx_k = k << 5;')
-            printer.println()
-
-            for name, positions in all_refs.items():
-                buffer_instance = input_buffer_configs[name]
-                for position in positions:
-                    buffer_instance.print_data_retrieve_with_unroll(printer, position,
-                                                                    "%s_%s" % (name, '_'.join(
-                                                                        codegen_utils.idx2str(idx) for idx in
-                                                                        position)))
-
-            printer.println()
-            input_for_kernel = []
-            for port in ports:
-                input_for_kernel.append(port + '[k]')
-            for scalar in stencil.scalar_vars:
-                input_for_kernel.append(scalar)
-            printer.println('float result = %s_stencil_kernel(%s);'
-                            % (stencil.app_name, ', '.join(input_for_kernel)))
-            printer.println('%s[i + TOP_APPEND + OVERLAP_TOP_OVERHEAD].range(idx_k+31, idx_k) = *((uint32_t *)(&result));'
-                            % stencil.output_var)
-
-        for buffer_instance in input_buffer_configs.values():
-            buffer_instance.print_data_movement(printer)
-    printer.println()
+        with printer.if_('i >= 0'):
+            printer.println('COMPUTE_LOOP:')
+            with printer.for_('int k = 0', 'k < PARA_FACTOR', 'k++'):
+                printer.println('#pragma HLS unroll')
+
+                all_refs = stencil.all_refs
+                all_ports = []
+                for name, positions in all_refs.items():
+                    ports = []
+                    for position in positions:
+                        ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
+                        all_ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
+                    printer.println(stencil.types[name].c_type + ' ' + ', '.join(map(lambda x: x + '[PARA_FACTOR]', ports)) + ';')
+                    for port in ports:
+                        printer.println('#pragma HLS array_partition variable=%s complete dim=0'
+                                        % port)
+                    printer.println()
 
+                printer.println()
+                printer.println('unsigned int idx_k = k << %d;' % _element_shift(stencil))
+                printer.println()
 
-    if stencil.iterate > 1:
-        for buffer_instance in input_buffer_configs.values():
-            buffer_instance.print_pop_out(printer)
+                for name, positions in all_refs.items():
+                    buffer_instance = input_buffer_configs[name]
+                    for position in positions:
+                        buffer_instance.print_data_retrieve_with_unroll(printer, position,
+                                                                        "%s_%s" % (name, '_'.join(
+                                                                            codegen_utils.idx2str(idx) for idx in
+                                                                            position)))
 
+                printer.println()
+                input_for_kernel = []
+                for port in ports:
+                    input_for_kernel.append(port + '[k]')
+                for scalar in stencil.scalar_vars:
+                    input_for_kernel.append(scalar)
+                printer.println('%s result = %s_stencil_kernel(%s);'
+                                % (output_type.c_type, stencil.app_name, ', '.join(input_for_kernel)))
+                printer.println('%s[i + TOP_APPEND + PASS_TOP_SKIP(finished)].range(idx_k+%d, idx_k) = %s;'
+                                % (stencil.output_var, output_type.bits - 1, output_type.c_to_raw('result')))
+
+        for buffer_instance in port_configs.values():
+            buffer_instance.print_data_movement(printer, -fill, 'PASS_TOP_SKIP(finished)')
+    printer.println()
 
     printer.println('return;')
 
     printer.un_scope()
 
-def _print_multistage_backbone(stencil: core.Stencil, printer: codegen_utils.Printer):
+def _print_multistage_backbone(stencil: core.Stencil, printer: codegen_utils.Printer, input_buffer_configs):
+    port_configs = buffer.port_configs(stencil, input_buffer_configs)
     input_def = []
-    for input_var in stencil.input_vars:
-        input_def.append('INTERFACE_WIDTH *%s' % input_var)
+    for port, buffer_instance in port_configs.items():
+        input_def.append('%s *%s' % (buffer_instance.port_type, port))
 
     input_def.append('INTERFACE_WIDTH *%s' % stencil.output_var)
     for scalar in stencil.scalar_vars:
@@ -201,291 +263,347 @@ def _print_multistage_backbone(stencil: core.Stencil, printer: codegen_utils.Pri
                     + ';')
 
 
-    parameter = codegen_utils.get_parameter_printed(stencil.input_vars, 'temp_out_0', stencil.scalar_vars)
-    printer.println('stage_in(%s, finished>=ITERATION);' % parameter)
+    parameter = codegen_utils.get_parameter_printed(stencil.input_ports, 'temp_out_0', stencil.scalar_vars)
+    printer.println('stage_in(%s, finished>=ITERATION, finished);' % parameter)
     for i in range(1, stencil.repeat_count - 1):
         parameter = codegen_utils.get_parameter_printed(['temp_out_%d' % (i-1),], 'temp_out_%d' % i, stencil.scalar_vars)
-        printer.println('stage_mid_%d(%s, finished+%s>=ITERATION);' % (i, parameter, i))
+        printer.println('stage_mid_%d(%s, finished+%s>=ITERATION, finished);' % (i, parameter, i))
     parameter = codegen_utils.get_parameter_printed(['temp_out_%d' % (stencil.repeat_count-2),], stencil.output_var, stencil.scalar_vars)
-    printer.println('stage_out(%s, finished+STAGE_COUNT>ITERATION);' % parameter)
+    printer.println('stage_out(%s, finished+STAGE_COUNT>ITERATION, finished);' % parameter)
+
+    printer.println('return;')
+
+    printer.un_scope()
+
+def _print_dataflow_backbone(stencil: core.Stencil, printer: codegen_utils.Printer, input_buffer_configs,
+                             position='uni'):
+    '''Connects load, the stages and store with streams, so m_axi bursts run apart from the compute pipeline'''
+    port_configs = buffer.port_configs(stencil, input_buffer_configs)
+    input_def = []
+    for port, buffer_instance in port_configs.items():
+        input_def.append('%s *%s' % (buffer_instance.port_type, port))
+
+    input_def.append('INTERFACE_WIDTH *%s' % stencil.output_var)
+    for scalar in stencil.scalar_vars:
+        input_def.append('float %s' % scalar)
+
+    input_def.append('int finished')
+    streams = _stream_ports(position) if position != 'uni' else []
+    for _, to, from_ in streams:
+        input_def.extend(['hls::stream<pkt> &%s' % to, 'hls::stream<pkt> &%s' % from_])
+
+    printer.print_func('static void %s' % stencil.app_name, input_def)
+    printer.do_scope('dataflow backbone definition')
+    printer.println('#pragma HLS dataflow')
+
+    memory_streams = ['%s_in' % port for port in port_configs] + ['%s_out' % stencil.output_var]
+    stage_streams = ['temp_out_%d' % i for i in range(stencil.repeat_count - 1)]
+    packed_streams = ['%s_in' % port for port, buffer_instance in port_configs.items()
+                      if buffer_instance.port_type != 'INTERFACE_WIDTH']
+    printer.println('static hls::stream<INTERFACE_WIDTH> %s;'
+                    % ', '.join(stream for stream in memory_streams + stage_streams if stream not in packed_streams))
+    for port, buffer_instance in port_configs.items():
+        if '%s_in' % port in packed_streams:
+            printer.println('static hls::stream<%s> %s_in;' % (buffer_instance.port_type, port))
+    for stream in memory_streams:
+        printer.println('#pragma HLS stream variable=%s depth=%d' % (stream, BURST_LENGTH))
+    printer.println()
+
+    for port, buffer_instance in port_configs.items():
+        printer.println('load(%s, %s_in, %s, %s + %d);'
+                        % (port, port, buffer_instance.first_read('PASS_TOP_SKIP(finished)'),
+                           _trip_count(stencil), buffer_instance.lineBuffer.fill_length))
+
+    inputs = ['%s_in' % port for port in port_configs]
+    for i in range(stencil.repeat_count):
+        output = 'temp_out_%d' % i if i < stencil.repeat_count - 1 else '%s_out' % stencil.output_var
+        parameter = codegen_utils.get_parameter_printed(inputs, output, stencil.scalar_vars)
+        printer.println('stage_%d(%s, finished%s>=ITERATION, finished);' % (i, parameter, '+%d' % i if i else ''))
+        inputs = [output]
+
+    if streams:
+        _print_halo_receive(printer, position)
+        printer.println('store_forward(%s_out, %s, TOP_APPEND*STAGE_COUNT + PASS_TOP_SKIP(finished), %s, %s, %s);'
+                        % (stencil.output_var, stencil.output_var, _trip_count(stencil, stencil.repeat_count - 1),
+                           ', '.join(to for _, to, _ in streams),
+                           ', '.join('halo_from_%s' % neighbour for neighbour, _, _ in streams)))
+    else:
+        printer.println('store(%s_out, %s, TOP_APPEND*STAGE_COUNT + PASS_TOP_SKIP(finished), %s);'
+                        % (stencil.output_var, stencil.output_var,
+                           _trip_count(stencil, stencil.repeat_count - 1)))
 
     printer.println('return;')
 
     printer.un_scope()
 
 def _print_stage_in(stencil: core.Stencil, printer: codegen_utils.Printer, input_buffer_configs):
+    output_type = stencil.types[stencil.output_var]
     input_names = stencil.input_vars
+    port_configs = buffer.port_configs(stencil, input_buffer_configs)
     input_def = []
-    for input_var in stencil.input_vars:
-        input_def.append('INTERFACE_WIDTH *%s' % input_var)
+    for port, buffer_instance in port_configs.items():
+        input_def.append('%s *%s' % (buffer_instance.port_type, port))
 
     input_def.append('hls::stream<INTERFACE_WIDTH> &%s' % stencil.output_var)
     for scalar in stencil.scalar_vars:
         input_def.append('float %s' % scalar)
 
     input_def.append('bool skip')
+    input_def.append('int finished')
 
     printer.print_func('static void stage_in', input_def)
     printer.do_scope('stencil kernel definition')
-    for buffer_instance in input_buffer_configs.values():
+    for buffer_instance in port_configs.values():
         buffer_instance.print_define_buffer(printer)
         printer.println()
 
-    for buffer_instance in input_buffer_configs.values():
-        buffer_instance.print_init_buffer(printer)
-        printer.println()
-
     printer.println('INTERFACE_WIDTH temp_out;')
 
+    fill = _fill_length(input_buffer_configs)
+    printer.println('const int trip_count = %s;' % _trip_count(stencil))
     printer.println('MAJOR_LOOP:')
-    with printer.for_('int i = 0',
-                      'i < GRID_COLS/WIDTH_FACTOR*PART_ROWS + (OVERLAP_TOP_OVERHEAD+OVERLAP_BOTTOM_OVERHEAD) '
-                        '+ (TOP_APPEND+BOTTOM_APPEND)*(STAGE_COUNT-1)',
-                      'i++'):
+    with printer.for_('int i = -%d' % fill, 'i < trip_count', 'i++'):
         printer.println('#pragma HLS pipeline II=1')
+        for buffer_instance in port_configs.values():
+            buffer_instance.print_loop_pragmas(printer)
         printer.println()
-        printer.println('COMPUTE_LOOP:')
-        with printer.for_('int k = 0', 'k < PARA_FACTOR', 'k++'):
-            printer.println('#pragma HLS unroll')
-
-            all_refs = stencil.all_refs
-            all_ports = []
-            for name, positions in all_refs.items():
-                ports = []
-                for position in positions:
-                    ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
-                    all_ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
-                printer.println('float ' + ', '.join(map(lambda x: x + '[PARA_FACTOR]', ports)) + ';')
-                for port in ports:
-                    printer.println('#pragma HLS array_partition variable=%s complete dim=0'
-                                    % port)
+        with printer.if_('i >= 0'):
+            printer.println('COMPUTE_LOOP:')
+            with printer.for_('int k = 0', 'k < PARA_FACTOR', 'k++'):
+                printer.println('#pragma HLS unroll')
+
+                all_refs = stencil.all_refs
+                all_ports = []
+                for name, positions in all_refs.items():
+                    ports = []
+                    for position in positions:
+                        ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
+                        all_ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
+                    printer.println(stencil.types[name].c_type + ' ' + ', '.join(map(lambda x: x + '[PARA_FACTOR]', ports)) + ';')
+                    for port in ports:
+                        printer.println('#pragma HLS array_partition variable=%s complete dim=0'
+                                        % port)
+                    printer.println()
+
+                printer.println()
+                printer.println('unsigned int idx_k = k << %d;' % _element_shift(stencil))
                 printer.println()
 
-            printer.println()
-            printer.println('unsigned int idx_k = k << 5;')
-            printer.println()
-
-            for name, positions in all_refs.items():
-                buffer_instance = input_buffer_configs[name]
-                for position in positions:
-                    buffer_instance.print_data_retrieve_with_unroll(printer, position,
-                                                                    "%s_%s" % (name, '_'.join(
-                                                                        codegen_utils.idx2str(idx) for idx in
-                                                                        position)))
-
-            printer.println()
-            input_for_kernel = []
-            for port in ports:
-                input_for_kernel.append(port + '[k]')
-            for scalar in stencil.scalar_vars:
-                input_for_kernel.append(scalar)
-
-            # TODO: no guarantee that %s_0_0[k] is retrieved
-            printer.println('float result = skip?%s_0_0[k]:%s_stencil_kernel(%s);'
-                            % (stencil.output_var, stencil.app_name, ', '.join(input_for_kernel)))
-            printer.println('temp_out.range(idx_k+31, idx_k) = *((uint32_t *)(&result));')
-
-        printer.println('%s << temp_out;' % stencil.output_var)
-
-        for buffer_instance in input_buffer_configs.values():
-            buffer_instance.print_data_movement(printer)
-    printer.println()
+                for name, positions in all_refs.items():
+                    buffer_instance = input_buffer_configs[name]
+                    for position in positions:
+                        buffer_instance.print_data_retrieve_with_unroll(printer, position,
+                                                                        "%s_%s" % (name, '_'.join(
+                                                                            codegen_utils.idx2str(idx) for idx in
+                                                                            position)))
 
+                printer.println()
+                input_for_kernel = []
+                for port in ports:
+                    input_for_kernel.append(port + '[k]')
+                for scalar in stencil.scalar_vars:
+                    input_for_kernel.append(scalar)
 
-    if stencil.iterate > 1:
-        for buffer_instance in input_buffer_configs.values():
-            buffer_instance.print_pop_out(printer)
+                # TODO: no guarantee that %s_0_0[k] is retrieved
+                printer.println('%s result = skip?%s_0_0[k]:%s_stencil_kernel(%s);'
+                                % (output_type.c_type, stencil.output_var, stencil.app_name, ', '.join(input_for_kernel)))
+                printer.println('temp_out.range(idx_k+%d, idx_k) = %s;'
+                                % (output_type.bits - 1, output_type.c_to_raw('result')))
 
+            printer.println('%s << temp_out;' % stencil.output_var)
+
+        for buffer_instance in port_configs.values():
+            buffer_instance.print_data_movement(printer, -fill, 'PASS_TOP_SKIP(finished)')
+    printer.println()
 
     printer.println('return;')
 
     printer.un_scope()
 
-def _print_stage_mid(stencil: core.Stencil, printer: codegen_utils.Printer, input_buffer_configs, decrement: int):
+def _print_stage_mid(stencil: core.Stencil, printer: codegen_utils.Printer, input_buffer_configs, decrement: int,
+                     name=None):
+    output_type = stencil.types[stencil.output_var]
     input_names = stencil.input_vars
+    port_configs = buffer.port_configs(stencil, input_buffer_configs)
     input_def = []
-    for input_var in stencil.input_vars:
-        input_def.append('hls::stream<INTERFACE_WIDTH> &%s' % input_var)
+    for port, buffer_instance in port_configs.items():
+        input_def.append('hls::stream<%s> &%s' % (buffer_instance.port_type, port))
 
     input_def.append('hls::stream<INTERFACE_WIDTH> &%s' % stencil.output_var)
     for scalar in stencil.scalar_vars:
         input_def.append('float %s' % scalar)
 
     input_def.append('bool skip')
+    input_def.append('int finished')
 
-    printer.print_func('static void stage_mid_%d' % decrement, input_def)
+    printer.print_func('static void %s' % (name or 'stage_mid_%d' % decrement), input_def)
     printer.do_scope('stencil kernel definition')
-    for buffer_instance in input_buffer_configs.values():
+    for buffer_instance in port_configs.values():
         buffer_instance.print_define_buffer(printer)
         printer.println()
 
-    for buffer_instance in input_buffer_configs.values():
-        buffer_instance.print_init_buffer_from_stream(printer)
-        printer.println()
-
     printer.println('INTERFACE_WIDTH temp_out;')
 
+    fill = _fill_length(input_buffer_configs)
+    printer.println('const int trip_count = %s;' % _trip_count(stencil, decrement))
     printer.println('MAJOR_LOOP:')
-    with printer.for_('int i = 0',
-                      'i < GRID_COLS/WIDTH_FACTOR*PART_ROWS + (OVERLAP_TOP_OVERHEAD+OVERLAP_BOTTOM_OVERHEAD) '
-                        '+ (TOP_APPEND+BOTTOM_APPEND)*(STAGE_COUNT-1) '
-                        '- (DECRE_TOP_APPEND+DECRE_BOTTOM_APPEND)*%d' % decrement,
-                      'i++'):
+    with printer.for_('int i = -%d' % fill, 'i < trip_count', 'i++'):
         printer.println('#pragma HLS pipeline II=1')
+        for buffer_instance in port_configs.values():
+            buffer_instance.print_loop_pragmas(printer)
         printer.println()
-        printer.println('COMPUTE_LOOP:')
-        with printer.for_('int k = 0', 'k < PARA_FACTOR', 'k++'):
-            printer.println('#pragma HLS unroll')
-
-            all_refs = stencil.all_refs
-            all_ports = []
-            for name, positions in all_refs.items():
-                ports = []
-                for position in positions:
-                    ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
-                    all_ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
-                printer.println('float ' + ', '.join(map(lambda x: x + '[PARA_FACTOR]', ports)) + ';')
-                for port in ports:
-                    printer.println('#pragma HLS array_partition variable=%s complete dim=0'
-                                    % port)
-                printer.println()
-
-            printer.println()
-            printer.println('unsigned int idx_k = k << 5;')
-            printer.println()
-
-            for name, positions in all_refs.items():
-                buffer_instance = input_buffer_configs[name]
-                for position in positions:
-                    buffer_instance.print_data_retrieve_with_unroll(printer, position,
-                                                                        "%s_%s" % (name, '_'.join(
-                                                                            codegen_utils.idx2str(idx) for idx in
-                                                                            position)))
+        with printer.if_('i >= 0'):
+            printer.println('COMPUTE_LOOP:')
+            with printer.for_('int k = 0', 'k < PARA_FACTOR', 'k++'):
+                printer.println('#pragma HLS unroll')
+
+                all_refs = stencil.all_refs
+                all_ports = []
+                for name, positions in all_refs.items():
+                    ports = []
+                    for position in positions:
+                        ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
+                        all_ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
+                    printer.println(stencil.types[name].c_type + ' ' + ', '.join(map(lambda x: x + '[PARA_FACTOR]', ports)) + ';')
+                    for port in ports:
+                        printer.println('#pragma HLS array_partition variable=%s complete dim=0'
+                                        % port)
+                    printer.println()
 
-            printer.println()
-            input_for_kernel = []
-            for port in ports:
-                input_for_kernel.append(port + '[k]')
-            for scalar in stencil.scalar_vars:
-                input_for_kernel.append(scalar)
-            printer.println('float result = skip?%s_0_0[k]:%s_stencil_kernel(%s);'
-                            % (stencil.output_var, stencil.app_name, ', '.join(input_for_kernel)))
-            printer.println('temp_out.range(idx_k+31, idx_k) = *((uint32_t *)(&result));')
+                printer.println()
+                printer.println('unsigned int idx_k = k << %d;' % _element_shift(stencil))
+                printer.println()
 
-        printer.println('%s << temp_out;' % stencil.output_var)
+                for name, positions in all_refs.items():
+                    buffer_instance = input_buffer_configs[name]
+                    for position in positions:
+                        buffer_instance.print_data_retrieve_with_unroll(printer, position,
+                                                                            "%s_%s" % (name, '_'.join(
+                                                                                codegen_utils.idx2str(idx) for idx in
+                                                                                position)))
 
-        for buffer_instance in input_buffer_configs.values():
-            buffer_instance.print_data_movement_from_stream(printer)
+                printer.println()
+                input_for_kernel = []
+                for port in ports:
+                    input_for_kernel.append(port + '[k]')
+                for scalar in stencil.scalar_vars:
+                    input_for_kernel.append(scalar)
+                printer.println('%s result = skip?%s_0_0[k]:%s_stencil_kernel(%s);'
+                                % (output_type.c_type, stencil.output_var, stencil.app_name, ', '.join(input_for_kernel)))
+                printer.println('temp_out.range(idx_k+%d, idx_k) = %s;'
+                                % (output_type.bits - 1, output_type.c_to_raw('result')))
+
+            printer.println('%s << temp_out;' % stencil.output_var)
+
+        for buffer_instance in port_configs.values():
+            buffer_instance.print_data_movement_from_stream(printer, -fill)
     printer.println()
 
-
-    if stencil.iterate > 1:
-        for buffer_instance in input_buffer_configs.values():
-            buffer_instance.print_pop_out(printer)
-
-
     printer.println('return;')
 
     printer.un_scope()
 
 
 def _print_stage_out(stencil: core.Stencil, printer: codegen_utils.Printer, input_buffer_configs, decrement: int):
+    output_type = stencil.types[stencil.output_var]
     input_names = stencil.input_vars
+    port_configs = buffer.port_configs(stencil, input_buffer_configs)
     input_def = []
-    for input_var in stencil.input_vars:
-        input_def.append('hls::stream<INTERFACE_WIDTH> &%s' % input_var)
+    for port, buffer_instance in port_configs.items():
+        input_def.append('hls::stream<%s> &%s' % (buffer_instance.port_type, port))
 
     input_def.append('INTERFACE_WIDTH* %s' % stencil.output_var)
     for scalar in stencil.scalar_vars:
         input_def.append('float %s' % scalar)
 
     input_def.append('bool skip')
+    input_def.append('int finished')
 
     printer.print_func('static void stage_out', input_def)
     printer.do_scope('stencil kernel definition')
-    for buffer_instance in input_buffer_configs.values():
+    for buffer_instance in port_configs.values():
         buffer_instance.print_define_buffer(printer)
         printer.println()
 
-    for buffer_instance in input_buffer_configs.values():
-        buffer_instance.print_init_buffer_from_stream(printer)
-        printer.println()
-
+    fill = _fill_length(input_buffer_configs)
+    printer.println('const int trip_count = %s;' % _trip_count(stencil, decrement))
     printer.println('MAJOR_LOOP:')
-    with printer.for_('int i = 0',
-                      'i < GRID_COLS/WIDTH_FACTOR*PART_ROWS + (OVERLAP_TOP_OVERHEAD+OVERLAP_BOTTOM_OVERHEAD) '
-                        '+ (TOP_APPEND+BOTTOM_APPEND)*(STAGE_COUNT-1) '
-                        '- (DECRE_TOP_APPEND+DECRE_BOTTOM_APPEND)*%d' % decrement,
-                      'i++'):
+    with printer.for_('int i = -%d' % fill, 'i < trip_count', 'i++'):
         printer.println('#pragma HLS pipeline II=1')
+        for buffer_instance in port_configs.values():
+            buffer_instance.print_loop_pragmas(printer)
         printer.println()
-        printer.println('COMPUTE_LOOP:')
-        with printer.for_('int k = 0', 'k < PARA_FACTOR', 'k++'):
-            printer.println('#pragma HLS unroll')
-
-            all_refs = stencil.all_refs
-            all_ports = []
-            for name, positions in all_refs.items():
-                ports = []
-                for position in positions:
-                    ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
-                    all_ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
-                printer.println('float ' + ', '.join(map(lambda x: x + '[PARA_FACTOR]', ports)) + ';')
-                for port in ports:
-                    printer.println('#pragma HLS array_partition variable=%s complete dim=0'
-                                    % port)
-                printer.println()
-
-            printer.println()
-            printer.println('unsigned int idx_k = k << 5;')
-            printer.println()
-
-            for name, positions in all_refs.items():
-                buffer_instance = input_buffer_configs[name]
-                for position in positions:
-                    buffer_instance.print_data_retrieve_with_unroll(printer, position,
-                                                                    "%s_%s" % (name, '_'.join(
-                                                                        codegen_utils.idx2str(idx) for idx in
-                                                                        position)))
-
-            printer.println()
-            input_for_kernel = []
-            for port in ports:
-                input_for_kernel.append(port + '[k]')
-            for scalar in stencil.scalar_vars:
-                input_for_kernel.append(scalar)
-            printer.println('float result = skip?%s_0_0[k]:%s_stencil_kernel(%s);'
-                            % (stencil.output_var, stencil.app_name, ', '.join(input_for_kernel)))
-            printer.println('%s[i + TOP_APPEND*STAGE_COUNT + OVERLAP_TOP_OVERHEAD].range(idx_k+31, idx_k) = *((uint32_t *)(&result));'
-                            % stencil.output_var)
-
-        for buffer_instance in input_buffer_configs.values():
-            buffer_instance.print_data_movement_from_stream(printer)
-    printer.println()
+        with printer.if_('i >= 0'):
+            printer.println('COMPUTE_LOOP:')
+            with printer.for_('int k = 0', 'k < PARA_FACTOR', 'k++'):
+                printer.println('#pragma HLS unroll')
+
+                all_refs = stencil.all_refs
+                all_ports = []
+                for name, positions in all_refs.items():
+                    ports = []
+                    for position in positions:
+                        ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
+                        all_ports.append("%s_%s" % (name, '_'.join(codegen_utils.idx2str(idx) for idx in position)))
+                    printer.println(stencil.types[name].c_type + ' ' + ', '.join(map(lambda x: x + '[PARA_FACTOR]', ports)) + ';')
+                    for port in ports:
+                        printer.println('#pragma HLS array_partition variable=%s complete dim=0'
+                                        % port)
+                    printer.println()
 
+                printer.println()
+                printer.println('unsigned int idx_k = k << %d;' % _element_shift(stencil))
+                printer.println()
 
-    if stencil.iterate > 1:
-        for buffer_instance in input_buffer_configs.values():
-            buffer_instance.print_pop_out(printer)
+                for name, positions in all_refs.items():
+                    buffer_instance = input_buffer_configs[name]
+                    for position in positions:
+                        buffer_instance.print_data_retrieve_with_unroll(printer, position,
+                                                                        "%s_%s" % (name, '_'.join(
+                                                                            codegen_utils.idx2str(idx) for idx in
+                                                                            position)))
 
+                printer.println()
+                input_for_kernel = []
+                for port in ports:
+                    input_for_kernel.append(port + '[k]')
+                for scalar in stencil.scalar_vars:
+                    input_for_kernel.append(scalar)
+                printer.println('%s result = skip?%s_0_0[k]:%s_stencil_kernel(%s);'
+                                % (output_type.c_type, stencil.output_var, stencil.app_name, ', '.join(input_for_kernel)))
+                printer.println('%s[i + TOP_APPEND*STAGE_COUNT + PASS_TOP_SKIP(finished)].range(idx_k+%d, idx_k) = %s;'
+                                % (stencil.output_var, output_type.bits - 1, output_type.c_to_raw('result')))
+
+        for buffer_instance in port_configs.values():
+            buffer_instance.print_data_movement_from_stream(printer, -fill)
+    printer.println()
 
     printer.println('return;')
 
     printer.un_scope()
 
 
-def _print_interface(stencil: core.Stencil, printer: codegen_utils.Printer):
+def _tile_pointers(stencil, input_buffer_configs, output_buffer_config):
+    '''Pointer to tile t of every port, tiles follow each other in a buffer'''
+    offsets = {var: config.lineBuffer for var, config in buffer.port_configs(stencil, input_buffer_configs).items()}
+    offsets[stencil.output_var] = output_buffer_config
+    return {var: '%s + t*TILE_BEATS(%d)' % (var, config.min_block_offset + config.max_block_offset)
+            for var, config in offsets.items()}
+
+
+def _print_interface(stencil: core.Stencil, printer: codegen_utils.Printer, input_buffer_configs,
+                     output_buffer_config):
     interfaces = []
-    for var in stencil.input_vars:
+    for var in stencil.input_ports:
         interfaces.append(var)
     interfaces.append(stencil.output_var)
-    printer.print_func('void unikernel', chain(map(lambda x: 'INTERFACE_WIDTH *%s' % x, interfaces)
+    printer.print_func('void unikernel', chain(map(lambda x: '%s *%s' % (_port_type(stencil, x), x), interfaces)
                                                , map(lambda x: 'float %s' % x, stencil.scalar_vars)
                                                ))
     printer.do_scope()
     for interface in interfaces:
-        printer.println('#pragma HLS INTERFACE m_axi port=%s offset=slave bundle=%s1'
-                        % (interface, interface))
+        printer.println('#pragma HLS INTERFACE m_axi port=%s offset=slave bundle=%s1%s'
+                        % (interface, interface, _burst_options(stencil)))
 
     printer.println()
 
@@ -500,6 +618,10 @@ def _print_interface(stencil: core.Stencil, printer: codegen_utils.Printer):
 
     printer.println()
 
+    if stencil.tiled:
+        pointers = _tile_pointers(stencil, input_buffer_configs, output_buffer_config)
+        interfaces = [pointers[interface] for interface in interfaces]
+
     parameters = copy.copy(interfaces)
     parameters.extend(stencil.scalar_vars)
     parameters2 = copy.copy(interfaces)
@@ -509,7 +631,11 @@ def _print_interface(stencil: core.Stencil, printer: codegen_utils.Printer):
     parameters2[-1] = temp
     parameters2.extend(stencil.scalar_vars)
 
-    if stencil.iterate/stencil.repeat_count > 1:
+    if stencil.tiled:
+        printer.println('TILE_LOOP: for(int t = 0; t < TILE_COUNT; t++){')
+        printer.do_indent()
+
+    if stencil.kernel_iterate/stencil.repeat_count > 1:
         printer.println("int i;")
         with printer.for_('i=0', 'i<ITERATION', 'i+=STAGE_COUNT'):
             printer.println('if(i%(2*STAGE_COUNT)==0)')
@@ -519,30 +645,29 @@ def _print_interface(stencil: core.Stencil, printer: codegen_utils.Printer):
     else:
         printer.println('%s(%s, 0);' % (stencil.app_name, ', '.join(parameters)))
 
+    if stencil.tiled:
+        printer.un_indent()
+        printer.println('}')
+
     printer.println('return;')
     printer.un_scope()
 
 
 def _print_stream_interface(stencil: core.Stencil, printer: codegen_utils.Printer, position):
     interfaces = []
-    for var in stencil.input_vars:
+    for var in stencil.input_ports:
         interfaces.append(var)
     interfaces.append(stencil.output_var)
+    streams = _stream_ports(position)
 
-    if position == 'up' or position == 'down':
-        printer.print_func('void %skernel' % position, chain(map(lambda x: 'INTERFACE_WIDTH *%s' % x, interfaces)
-                            , map(lambda x: 'float %s' % x, stencil.scalar_vars)
-                            , ['hls::stream<pkt> &stream_to', 'hls::stream<pkt> &stream_from']))
-    else:
-        printer.print_func('void %skernel' % position, chain(map(lambda x: 'INTERFACE_WIDTH *%s' % x, interfaces)
-                            , map(lambda x: 'float %s' % x, stencil.scalar_vars)
-                            , ['hls::stream<pkt> &stream_to_up', 'hls::stream<pkt> &stream_from_up',
-                              'hls::stream<pkt> &stream_to_down', 'hls::stream<pkt> &stream_from_down']))
+    printer.print_func('void %skernel' % position, chain(map(lambda x: '%s *%s' % (_port_type(stencil, x), x), interfaces)
+                        , map(lambda x: 'float %s' % x, stencil.scalar_vars)
+                        , ('hls::stream<pkt> &%s' % stream for _, to, from_ in streams for stream in (to, from_))))
 
     printer.do_scope()
     for interface in interfaces:
-        printer.println('#pragma HLS INTERFACE m_axi port=%s offset=slave bundle=%s1'
-                        % (interface, interface))
+        printer.println('#pragma HLS INTERFACE m_axi port=%s offset=slave bundle=%s1%s'
+                        % (interface, interface, _burst_options(stencil)))
 
     printer.println()
 
@@ -557,6 +682,7 @@ def _print_stream_interface(stencil: core.Stencil, printer: codegen_utils.Printe
 
     printer.println()
 
+    stream_names = [stream for _, to, from_ in streams for stream in (to, from_)]
     parameters = copy.copy(interfaces)
     parameters.extend(stencil.scalar_vars)
 
@@ -566,26 +692,28 @@ def _print_stream_interface(stencil: core.Stencil, printer: codegen_utils.Printe
     parameters2[-1] = temp
     parameters2.extend(stencil.scalar_vars)
 
+    def print_pass(parameters, result):
+        if stencil.architecture == 'dataflow':
+            # the backbone forwards the rows the neighbours need while it stores them
+            printer.println('%s(%s, i, %s);' % (stencil.app_name, ', '.join(parameters), ', '.join(stream_names)))
+        else:
+            printer.println('%s(%s, i);' % (stencil.app_name, ', '.join(parameters)))
+            with printer.if_('i + STAGE_COUNT < ITERATION'):
+                printer.println('exchange_stream(%s, %s);' % (result, ', '.join(stream_names)))
+
     if stencil.iterate/stencil.repeat_count > 1:
         printer.println("int i;")
-        with printer.for_('i=0', 'i<ITERATION', 'i+=STAGE_COUNT*2'):
-            printer.println('if(i%(2*STAGE_COUNT)==0)')
-            printer.println('\t%s(%s, i);' % (stencil.app_name, ', '.join(parameters)))
-
-            if position == 'up' or position == 'down':
-                printer.println('\texchange_stream(%s, stream_to, stream_from);' % interfaces[-1])
-            else:
-                printer.println('\texchange_stream(%s, stream_to_up, stream_from_up, stream_to_down, stream_from_down);'
-                                % interfaces[-1])
-            printer.println('else')
-            printer.println('\t%s(%s, i);' % (stencil.app_name, ', '.join(parameters2)))
-
-            if position == 'up' or position == 'down':
-                printer.println('\texchange_stream(%s, stream_to, stream_from);' % interfaces[-2])
-            else:
-                printer.println('\texchange_stream(%s, stream_to_up, stream_from_up, stream_to_down, stream_from_down);'
-                                % interfaces[-2])
-
+        with printer.for_('i=0', 'i<ITERATION', 'i+=STAGE_COUNT'):
+            with printer.ifel_('i%(2*STAGE_COUNT)==0'):
+                print_pass(parameters, interfaces[-1])
+            printer.println('} else {')
+            printer.do_indent()
+            print_pass(parameters2, interfaces[-2])
+            printer.un_indent()
+            printer.println('}')
+
+    elif stencil.architecture == 'dataflow':
+        printer.println('%s(%s, 0, %s);' % (stencil.app_name, ', '.join(parameters), ', '.join(stream_names)))
     else:
         printer.println('%s(%s, 0);' % (stencil.app_name, ', '.join(parameters)))
 
@@ -593,12 +721,95 @@ def _print_stream_interface(stencil: core.Stencil, printer: codegen_utils.Printe
     printer.un_scope()
 
 
-def _print_stream_function(printer: codegen_utils.Printer, output_buffer_config, position):
-    min_block_offset = output_buffer_config.min_block_offset
-    max_block_offset = output_buffer_config.max_block_offset
-    if position == 'up':
-        printer.println(hls_kernel_codes.up_exchange)
-    elif position == 'mid':
-        printer.println(hls_kernel_codes.mid_exchange)
-    elif position == 'down':
-        printer.println(hls_kernel_codes.down_exchange)
+# (offset, count) of the beats a kernel sends to its up or down neighbour, the
+# first and last rows of its partition, and of the halo it receives from it
+_SENT_BEATS = {'up': ('TOP_APPEND*STAGE_COUNT', 'BOTTOM_APPEND*STAGE_COUNT'),
+               'down': ('GRID_COLS/WIDTH_FACTOR*PART_ROWS', 'TOP_APPEND*STAGE_COUNT')}
+_RECEIVED_BEATS = {'up': ('0', 'TOP_APPEND*STAGE_COUNT'),
+                   'down': ('TOP_APPEND*STAGE_COUNT + GRID_COLS/WIDTH_FACTOR*PART_ROWS', 'BOTTOM_APPEND*STAGE_COUNT')}
+
+def _stream_ports(position):
+    '''(neighbour, stream to it, stream from it) of every neighbour of a streaming kernel'''
+    if position == 'mid':
+        return [('up', 'stream_to_up', 'stream_from_up'), ('down', 'stream_to_down', 'stream_from_down')]
+    return [('down' if position == 'up' else 'up', 'stream_to', 'stream_from')]
+
+def _print_halo_receive(printer: codegen_utils.Printer, position):
+    '''Print the processes draining the streams from the neighbours into FIFOs as deep as their halos'''
+    streams = _stream_ports(position)
+    printer.println('static hls::stream<INTERFACE_WIDTH> %s;'
+                    % ', '.join('halo_from_%s' % neighbour for neighbour, _, _ in streams))
+    for neighbour, _, _ in streams:
+        printer.println('#pragma HLS stream variable=halo_from_%s depth=%s'
+                        % (neighbour, _RECEIVED_BEATS[neighbour][1]))
+    for neighbour, _, from_ in streams:
+        printer.println('receive_halo(%s, halo_from_%s, %s);' % (from_, neighbour, _RECEIVED_BEATS[neighbour][1]))
+
+def _print_stream_function(stencil: core.Stencil, printer: codegen_utils.Printer, position):
+    '''Print the exchange of the halos of a streaming kernel with its neighbours
+
+    Every kernel sends before it receives, and the halos it receives are
+    drained into FIFOs by processes of their own, so no kernel waits for its
+    neighbours to send. With the dataflow architecture, store forwards the rows
+    the neighbours need as the last stage computes them, otherwise
+    exchange_stream sends them after every pass. The m_axi port of the result
+    is accessed by a single process of a dataflow region, store_forward or
+    exchange_halos, which sends before it stores the halos; only the FIFOs run
+    beside it.
+    '''
+    streams = _stream_ports(position)
+    printer.println(hls_kernel_codes.send_halo)
+    printer.println(hls_kernel_codes.receive_halo)
+
+    printer.print_func('static void store_halos', chain(
+        ('hls::stream<INTERFACE_WIDTH> &halo_from_%s' % neighbour for neighbour, _, _ in streams),
+        ['INTERFACE_WIDTH *dst']))
+    printer.do_scope()
+    printer.println('#pragma HLS inline')
+    for neighbour, _, _ in streams:
+        printer.println('store(halo_from_%s, dst, %s, %s);' % ((neighbour,) + _RECEIVED_BEATS[neighbour]))
+    printer.un_scope()
+    printer.println()
+
+    if stencil.architecture == 'dataflow':
+        printer.print_func('static void store_forward', chain(
+            ['hls::stream<INTERFACE_WIDTH> &src', 'INTERFACE_WIDTH *dst', 'int offset', 'int count'],
+            ('hls::stream<pkt> &%s' % to for _, to, _ in streams),
+            ('hls::stream<INTERFACE_WIDTH> &halo_from_%s' % neighbour for neighbour, _, _ in streams)))
+        printer.do_scope()
+        printer.println('STORE_LOOP:')
+        with printer.for_('int i = 0', 'i < count', 'i++'):
+            printer.println('#pragma HLS pipeline II=1')
+            printer.println('INTERFACE_WIDTH temp = src.read();')
+            printer.println('dst[offset + i] = temp;')
+            printer.println('pkt boundary;')
+            printer.println('boundary.data = temp;')
+            for neighbour, to, _ in streams:
+                count = _SENT_BEATS[neighbour][1]
+                with printer.if_('i < %s' % count if neighbour == 'up' else 'i >= count - %s' % count):
+                    printer.println('%s.write(boundary);' % to)
+        printer.println('store_halos(%s, dst);' % ', '.join('halo_from_%s' % neighbour for neighbour, _, _ in streams))
+        printer.un_scope()
+        return
+
+    printer.print_func('static void exchange_halos', chain(
+        ['INTERFACE_WIDTH *result'],
+        ('hls::stream<pkt> &%s' % to for _, to, _ in streams),
+        ('hls::stream<INTERFACE_WIDTH> &halo_from_%s' % neighbour for neighbour, _, _ in streams)))
+    printer.do_scope()
+    for neighbour, to, _ in streams:
+        printer.println('send_halo(result, %s, %s, %s);' % ((to,) + _SENT_BEATS[neighbour]))
+    printer.println('store_halos(%s, result);' % ', '.join('halo_from_%s' % neighbour for neighbour, _, _ in streams))
+    printer.un_scope()
+    printer.println()
+
+    printer.print_func('static void exchange_stream', chain(
+        ['INTERFACE_WIDTH *result'],
+        ('hls::stream<pkt> &%s' % stream for _, to, from_ in streams for stream in (to, from_))))
+    printer.do_scope()
+    printer.println('#pragma HLS dataflow')
+    _print_halo_receive(printer, position)
+    printer.println('exchange_halos(result, %s, %s);'
+                    % (', '.join(to for _, to, _ in streams),
+                       ', '.join('halo_from_%s' % neighbour for neighbour, _, _ in streams)))
+    printer.un_scope()
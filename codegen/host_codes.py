@@ -16,9 +16,120 @@ const int pc[MAX_HBM_PC_COUNT] = {
     PC_NAME(24), PC_NAME(25), PC_NAME(26), PC_NAME(27), PC_NAME(28), PC_NAME(29), PC_NAME(30), PC_NAME(31)};
 '''
 
+value_functions = '''
+////////////////////ELEMENT VALUES//////////////////////////////////
+void read_value(std::ifstream &data_input, float &value) {
+    data_input >> value;
+}
+
+double to_double(float value) {
+    return value;
+}
+'''
+
+typed_value_functions = '''
+// half and fixed-point elements are kept as raw bits on the host
+struct half_bits {
+    uint16_t bits;
+};
+
+template<class T, int F>
+struct fixed_point {
+    T raw;
+};
+
+uint16_t float_to_half(float value) {
+    uint32_t x;
+    memcpy(&x, &value, sizeof(x));
+    uint16_t sign = (x >> 16) & 0x8000;
+    int exponent = (int)((x >> 23) & 0xff) - 127 + 15;
+    uint32_t mantissa = x & 0x7fffff;
+    if (((x >> 23) & 0xff) == 0xff) {
+        return sign | 0x7c00 | (mantissa ? 0x200 : 0);
+    }
+    if (exponent >= 31) {
+        return sign | 0x7c00;
+    }
+    if (exponent <= 0) {
+        if (exponent < -10) {
+            return sign;
+        }
+        mantissa |= 0x800000;
+        int shift = 14 - exponent;
+        uint32_t half = mantissa >> shift;
+        uint32_t rest = mantissa & ((1u << shift) - 1);
+        uint32_t halfway = 1u << (shift - 1);
+        if (rest > halfway || (rest == halfway && (half & 1))) {
+            half++;
+        }
+        return sign | half;
+    }
+    uint32_t half = ((uint32_t)exponent << 10) | (mantissa >> 13);
+    uint32_t rest = mantissa & 0x1fff;
+    if (rest > 0x1000 || (rest == 0x1000 && (half & 1))) {
+        half++;
+    }
+    return sign | half;
+}
+
+float half_to_float(uint16_t bits) {
+    uint32_t sign = (uint32_t)(bits & 0x8000) << 16;
+    uint32_t exponent = (bits >> 10) & 0x1f;
+    uint32_t mantissa = bits & 0x3ff;
+    uint32_t x = sign;
+    if (exponent == 0x1f) {
+        x = sign | 0x7f800000 | (mantissa << 13);
+    } else if (exponent != 0) {
+        x = sign | ((exponent + 112) << 23) | (mantissa << 13);
+    } else if (mantissa != 0) {
+        float value = ldexpf((float)mantissa, -24);
+        return sign ? -value : value;
+    }
+    float value;
+    memcpy(&value, &x, sizeof(value));
+    return value;
+}
+
+template<class T>
+void read_value(std::ifstream &data_input, T &value) {
+    long long temp;
+    data_input >> temp;
+    value = (T)temp;
+}
+
+void read_value(std::ifstream &data_input, half_bits &value) {
+    float temp;
+    data_input >> temp;
+    value.bits = float_to_half(temp);
+}
+
+template<class T, int F>
+void read_value(std::ifstream &data_input, fixed_point<T, F> &value) {
+    double temp;
+    data_input >> temp;
+    // floored like the default AP_TRN quantization and the golden data
+    value.raw = (T)(long long)floor(ldexp(temp, F));
+}
+
+template<class T>
+double to_double(T value) {
+    return (double)value;
+}
+
+double to_double(half_bits value) {
+    return half_to_float(value.bits);
+}
+
+template<class T, int F>
+double to_double(fixed_point<T, F> value) {
+    return ldexp((double)value.raw, -F);
+}
+'''
+
 reset_function = '''
 ////////////////////RESET FUNCTION//////////////////////////////////
-int fill_buffer(float* buffer, std::ifstream &data_input, size_t offset, size_t length) {
+template<class T>
+int fill_buffer(T* buffer, std::ifstream &data_input, size_t offset, size_t length) {
     data_input.seekg(std::ios::beg);
 
     float temp;
@@ -26,31 +137,197 @@ int fill_buffer(float* buffer, std::ifstream &data_input, size_t offset, size_t
         data_input >> temp;
     }
     for(size_t i = 0; i < length; i++){
-        data_input >> buffer[i];
+        read_value(data_input, buffer[i]);
     }
 
     return 0;
 }
 
-int fill_buffer(std::vector<float> &buffer, std::ifstream &data_input, size_t offset, size_t length) {
-    data_input.seekg(std::ios::beg);
+template<class T>
+int fill_buffer(std::vector<T> &buffer, std::ifstream &data_input, size_t offset, size_t length) {
+    return fill_buffer(buffer.data(), data_input, offset, length);
+}
 
-    float temp;
-    for(size_t i = 0; i < offset; i++){
-        data_input >> temp;
+'''
+
+binary_reset_function = '''
+////////////////////RESET FUNCTION//////////////////////////////////
+template<class T>
+const T* map_data_file(const std::string &path, size_t &count) {
+    int fd = open(path.c_str(), O_RDONLY);
+    if (fd < 0) {
+        std::cout << "Failed to open " << path << std::endl;
+        exit(EXIT_FAILURE);
+    }
+
+    struct stat file_stat;
+    fstat(fd, &file_stat);
+    count = file_stat.st_size / sizeof(T);
+    if (count == 0) {
+        close(fd);
+        return NULL;
     }
+
+    void* data = mmap(NULL, count*sizeof(T), PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (data == MAP_FAILED) {
+        std::cout << "Failed to map " << path << std::endl;
+        exit(EXIT_FAILURE);
+    }
+    madvise(data, count*sizeof(T), MADV_SEQUENTIAL);
+
+    return (const T*)data;
+}
+
+template<class T>
+void unmap_data_file(const T* data, size_t count) {
+    if (data != NULL) {
+        munmap((void*)data, count*sizeof(T));
+    }
+}
+
+template<class T>
+int fill_buffer(T* buffer, const T* data, size_t count, size_t offset, size_t length) {
+    if (offset >= count) {
+        return 0;
+    }
+    if (length > count - offset) {
+        length = count - offset;
+    }
+    memcpy(buffer, data + offset, length*sizeof(T));
+
+    return 0;
+}
+
+'''
+
+pack_function = '''
+////////////////////PACK FUNCTION///////////////////////////////////
+template<class T>
+void pack_buffer(std::vector<unsigned char, aligned_allocator<unsigned char> > &packed,
+                 const std::vector<T, aligned_allocator<T> > &buffer, int lane, int lanes) {
+    const size_t beat_bytes = DWIDTH/8;
+    const size_t bytes = buffer.size()*sizeof(T);
+    const unsigned char* data = (const unsigned char*)buffer.data();
+    for(size_t beat = 0; beat*beat_bytes < bytes; beat++){
+        size_t length = bytes - beat*beat_bytes < beat_bytes ? bytes - beat*beat_bytes : beat_bytes;
+        memcpy(packed.data() + (beat*lanes + lane)*beat_bytes, data + beat*beat_bytes, length);
+    }
+}
+
+'''
+
+tile_functions = '''
+////////////////////TILE FUNCTIONS//////////////////////////////////
+// first cell of tile t of kernel i in every inner dimension, shifted by its halo
+void tile_origin(int i, int t, long* origin, bool halo) {
+    int block = i % BLOCK_COUNT;
+    for(int d = TILE_DIM_COUNT - 1; d >= 0; d--){
+        int count = BLOCK_DIMS[d]/TILE_DIMS[d];
+        int blocks = GRID_DIMS[d]/BLOCK_DIMS[d];
+        origin[d] = (long)(block % blocks)*BLOCK_DIMS[d] + (long)(t % count)*TILE_DIMS[d]
+            - (halo ? TILE_HALOS[d] : 0);
+        t /= count;
+        block /= blocks;
+    }
+}
+
+// Copies tile t of kernel i from the grid, rows of TILE_COLS cells starting
+// at the cell first of the flattened tiled band. Like the flattened grid of
+// the reference, a halo beyond the first or last column continues in the
+// previous or next row, and cells beyond the grid are 0.
+template<class T>
+void tile_buffer(T* tile, const std::vector<T> &grid, int i, int t, long first, size_t length) {
+    long origin[TILE_DIM_COUNT];
+    tile_origin(i, t, origin, true);
+
+    for(size_t i = 0; i < length; i++){
+        long flat = first + (long)i;
+        long row = flat >= 0 ? flat/TILE_COLS : -((-flat + TILE_COLS - 1)/TILE_COLS);
+        long rest = flat - row*TILE_COLS;
+        long cell = row*GRID_COLS;
+        long stride = 1;
+        for(int d = TILE_DIM_COUNT - 1; d >= 0; d--){
+            cell += (origin[d] + rest % TILE_WIDTHS[d])*stride;
+            rest /= TILE_WIDTHS[d];
+            stride *= GRID_DIMS[d];
+        }
+        tile[i] = (cell >= 0 && cell < (long)GRID_ROWS*GRID_COLS) ? grid[cell] : T();
+    }
+}
+
+// Gathers the cells every tile of every kernel computes without its halo
+// back into bands of whole rows, the layout verify reads.
+template<class T>
+void untile_buffer(std::vector<std::vector<T, aligned_allocator<T> > >& results) {
+    const size_t first = (TOP_APPEND+OVERLAP_TOP_OVERHEAD)*WIDTH_FACTOR;
+    size_t tile_cells = 1;
+    for(int d = 0; d < TILE_DIM_COUNT; d++){
+        tile_cells *= TILE_DIMS[d];
+    }
+
+    std::vector<std::vector<T, aligned_allocator<T> > > bands(KERNEL_COUNT/BLOCK_COUNT);
+    for(size_t band = 0; band < bands.size(); band++){
+        bands[band].resize(first + (size_t)GRID_COLS*PART_ROWS);
+    }
+    for(int i = 0; i < KERNEL_COUNT; i++){
+        std::vector<T, aligned_allocator<T> >& partition = bands[i/BLOCK_COUNT];
+        size_t tile_size = results[i].size()/TILE_COUNT;
+        for(int t = 0; t < TILE_COUNT; t++){
+            long origin[TILE_DIM_COUNT];
+            tile_origin(i, t, origin, false);
+            for(int r = 0; r < PART_ROWS; r++){
+                for(size_t c = 0; c < tile_cells; c++){
+                    size_t rest = c;
+                    size_t src = 0, dst = 0, src_stride = 1, dst_stride = 1;
+                    for(int d = TILE_DIM_COUNT - 1; d >= 0; d--){
+                        src += (TILE_HALOS[d] + rest % TILE_DIMS[d])*src_stride;
+                        dst += (origin[d] + rest % TILE_DIMS[d])*dst_stride;
+                        rest /= TILE_DIMS[d];
+                        src_stride *= TILE_WIDTHS[d];
+                        dst_stride *= GRID_DIMS[d];
+                    }
+                    partition[first + (size_t)r*GRID_COLS + dst] = 
+                        results[i][t*tile_size + first + (size_t)r*TILE_COLS + src];
+                }
+            }
+        }
+    }
+    results.swap(bands);
+}
+
+'''
+
+halo_functions = '''
+////////////////////HALO REFRESH FUNCTIONS//////////////////////////
+// Copies length cells of the whole grid from offset, cells beyond it are 0
+template<class T>
+int fill_buffer(T* buffer, const std::vector<T> &grid, long offset, size_t length) {
     for(size_t i = 0; i < length; i++){
-        data_input >> buffer[i];
+        long cell = offset + (long)i;
+        buffer[i] = (cell >= 0 && cell < (long)grid.size()) ? grid[cell] : T();
     }
 
     return 0;
 }
 
+// Copies the cells every partition computes without its halo into the
+// whole grid, from which the next launch scatters the partitions again
+template<class T, class U>
+void gather_buffer(const std::vector<std::vector<T, aligned_allocator<T> > >& results, std::vector<U> &grid) {
+    for(size_t i = 0; i < results.size(); i++){
+        for(size_t j = 0; j < (size_t)GRID_COLS*PART_ROWS; j++){
+            grid[i*GRID_COLS*PART_ROWS + j] = results[i][j + (TOP_APPEND+OVERLAP_TOP_OVERHEAD)*WIDTH_FACTOR];
+        }
+    }
+}
+
 '''
 
 verify_function = '''
 ///////////////////VERIFY FUNCTION///////////////////////////////////
-bool verify(std::vector<std::vector<float, aligned_allocator<float> > >& results) {
+template<class T>
+bool verify(std::vector<std::vector<T, aligned_allocator<T> > >& results) {
     bool match = true;
     std::ofstream out("output.data");
     std::ofstream report("report.txt");
@@ -65,15 +342,15 @@ bool verify(std::vector<std::vector<float, aligned_allocator<float> > >& results
     fill_buffer(check_val, check_file, 0, GRID_COLS * GRID_ROWS);
     check_file.close();
     
-    for(int i = 0; i < KERNEL_COUNT; i++){
+    for(int i = 0; i < (int)results.size(); i++){
         for(int j = 0; j < GRID_COLS * PART_ROWS; j++){
-            out << results[i][j + (TOP_APPEND+OVERLAP_TOP_OVERHEAD)*WIDTH_FACTOR] << std::endl;
+            out << to_double(results[i][j + (TOP_APPEND+OVERLAP_TOP_OVERHEAD)*WIDTH_FACTOR]) << std::endl;
         
-            if(fabs(results[i][j + (TOP_APPEND+OVERLAP_TOP_OVERHEAD)*WIDTH_FACTOR] 
-                        - check_val[i * GRID_COLS * PART_ROWS + j]) > 1e-10){
+            if(fabs(to_double(results[i][j + (TOP_APPEND+OVERLAP_TOP_OVERHEAD)*WIDTH_FACTOR]) 
+                        - check_val[i * GRID_COLS * PART_ROWS + j]) > CHECK_TOLERANCE(check_val[i * GRID_COLS * PART_ROWS + j])){
                         
                 report << "Unmatch in position" << i << " : " << j / GRID_COLS << " : " << j % GRID_COLS 
-                    << "where " << results[i][j + (TOP_APPEND+OVERLAP_TOP_OVERHEAD)*WIDTH_FACTOR] << " != " 
+                    << "where " << to_double(results[i][j + (TOP_APPEND+OVERLAP_TOP_OVERHEAD)*WIDTH_FACTOR]) << " != " 
                     << check_val[i * GRID_COLS * PART_ROWS + j] << std::endl;
                 
                 match = false;            
@@ -86,6 +363,48 @@ bool verify(std::vector<std::vector<float, aligned_allocator<float> > >& results
 }
 '''
 
+binary_verify_function = '''
+///////////////////VERIFY FUNCTION///////////////////////////////////
+template<class T>
+bool verify(std::vector<std::vector<T, aligned_allocator<T> > >& results) {
+    bool match = true;
+    std::ofstream out("output.bin", std::ios::binary);
+    std::ofstream report("report.txt");
+    report.precision(18);
+    report << std::fixed;
+
+    size_t check_count;
+    const T* check_val = map_data_file<T>("../data/check.bin", check_count);
+    if (check_count < (size_t)GRID_COLS*GRID_ROWS) {
+        std::cout << "check.bin holds " << check_count << " values, expected " 
+            << (size_t)GRID_COLS*GRID_ROWS << std::endl;
+        unmap_data_file(check_val, check_count);
+        return false;
+    }
+
+    for(int i = 0; i < (int)results.size(); i++){
+        const T* result = results[i].data() + (TOP_APPEND+OVERLAP_TOP_OVERHEAD)*WIDTH_FACTOR;
+        out.write((const char*)result, sizeof(T)*GRID_COLS*PART_ROWS);
+
+        for(int j = 0; j < GRID_COLS * PART_ROWS; j++){
+            double expected = to_double(check_val[i * GRID_COLS * PART_ROWS + j]);
+            if(fabs(to_double(result[j]) - expected) > CHECK_TOLERANCE(expected)){
+
+                report << "Unmatch in position" << i << " : " << j / GRID_COLS << " : " << j % GRID_COLS 
+                    << "where " << to_double(result[j]) << " != " 
+                    << expected << std::endl;
+
+                match = false;
+            }
+        }
+    }
+
+    unmap_data_file(check_val, check_count);
+    std::cout << "TEST " << (match ? "PASSED" : "FAILED") << std::endl;
+    return match;
+}
+'''
+
 unikernel_init_opencl = '''
     if (argc != 2) {
         std::cout << "Usage: " << argv[0] << " <XCLBIN File>" << std::endl;
@@ -1,8 +1,10 @@
 import logging
 import copy
 
+from codegen import buffer
 from codegen import codegen_utils
 from codegen import host_codes
+from codegen import perf_model
 
 import core
 from dsl import ir
@@ -15,6 +17,13 @@ def host_gen(stencil, output_file, input_buffer_configs, output_buffer_config):
 
     include_files = ['<iostream>', '<string>', '<unistd.h>', '<vector>', '<fstream>', '<sys/time.h>',
                      '"math.h"', '"%s.h"' % stencil.app_name, '"hbm_config.h"']
+    typed = any(data_type.kind != 'float' for data_type in stencil.types.values())
+    if stencil.data_format == 'binary':
+        include_files.extend(['<cstring>', '<fcntl.h>', '<sys/mman.h>', '<sys/stat.h>'])
+    elif typed or stencil.packs:
+        include_files.append('<cstring>')
+    if stencil.boarder_type == 'hybrid':
+        include_files.append('<algorithm>')
     for file_name in include_files:
         printer.println('#include %s' %file_name)
 
@@ -22,12 +31,38 @@ def host_gen(stencil, output_file, input_buffer_configs, output_buffer_config):
 
     printer.println(host_codes.HBM_def)
 
-    printer.println(host_codes.reset_function)
+    printer.println(host_codes.value_functions)
+    if typed:
+        printer.println(host_codes.typed_value_functions)
 
-    for buffer in input_buffer_configs.values():
-        buffer.print_c_load_func(printer)
+    for var, data_type in stencil.types.items():
+        printer.println('typedef %s %s_t;' % (data_type.host_type, var))
+    printer.println('#define CHECK_TOLERANCE(expected) (%s)' % stencil.types[stencil.output_var].tolerance)
+    printer.println()
+
+    if stencil.data_format == 'binary':
+        printer.println(host_codes.binary_reset_function)
+    else:
+        printer.println(host_codes.reset_function)
+
+    if stencil.tiled:
+        printer.println(host_codes.tile_functions)
 
-    printer.println(host_codes.verify_function)
+    for buffer_config in input_buffer_configs.values():
+        buffer_config.print_c_load_func(printer, stencil.data_format, stencil.tiled)
+
+    if stencil.packs:
+        printer.println(host_codes.pack_function)
+
+    if stencil.boarder_type == 'hybrid':
+        printer.println(host_codes.halo_functions)
+        input_buffer_configs[stencil.input_vars[-1]].print_c_scatter_func(printer, stencil.tiled)
+        printer.println()
+
+    if stencil.data_format == 'binary':
+        printer.println(host_codes.binary_verify_function)
+    else:
+        printer.println(host_codes.verify_function)
 
     _print_main(stencil, printer, input_buffer_configs, output_buffer_config)
 
@@ -45,10 +80,12 @@ def _print_main(stencil, printer, input_buffer_configs, output_buffer_config):
 
     printer.println()
 
+    port_configs = buffer.port_configs(stencil, input_buffer_configs)
+
     printer.println('// Init buffers')
-    for buffer in input_buffer_configs.values():
-        buffer.print_c_buffer_def(printer)
-        buffer.print_c_buffer_init(printer)
+    for buffer_config in port_configs.values():
+        buffer_config.print_c_buffer_def(printer)
+        buffer_config.print_c_buffer_init(printer)
         printer.println()
 
     output_buffer_config.print_c_buffer_def(printer)
@@ -58,8 +95,8 @@ def _print_main(stencil, printer, input_buffer_configs, output_buffer_config):
     printer.println()
 
     printer.println('// Allocate buffers in global memory')
-    for buffer in input_buffer_configs.values():
-        buffer.print_c_buffer_allocate(printer)
+    for buffer_config in port_configs.values():
+        buffer_config.print_c_buffer_allocate(printer)
         printer.println()
     output_buffer_config.print_c_buffer_allocate(printer)
     printer.println('std::cout << "%s buffers allocated." << std::endl;' % stencil.app_name)
@@ -69,7 +106,7 @@ def _print_main(stencil, printer, input_buffer_configs, output_buffer_config):
     printer.println('// Set kernel arguments')
 
     scalar_list = copy.copy(stencil.scalar_vars)
-    var_list = copy.copy(stencil.input_vars)
+    var_list = copy.copy(stencil.input_ports)
     var_list.append(stencil.output_var)
     with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
         count = 0
@@ -82,7 +119,7 @@ def _print_main(stencil, printer, input_buffer_configs, output_buffer_config):
 
         printer.println()
 
-        for var in stencil.input_vars:
+        for var in stencil.input_ports:
             printer.println('OCL_CHECK(err, err = q.enqueueMigrateMemObjects({device_%ss[i]}, 0/*means from host*/));'
                             % var)
 
@@ -92,14 +129,35 @@ def _print_main(stencil, printer, input_buffer_configs, output_buffer_config):
 
     printer.println()
 
+    # every pass of STAGE_COUNT iterations swaps the buffers
+    if perf_model.pass_count(stencil)%2 == 0:
+        final_result_buffer = stencil.input_vars[-1]
+    else:
+        final_result_buffer = stencil.output_var
+
+    if stencil.boarder_type == 'hybrid':
+        printer.println('std::vector<%s_t> %s_grid((size_t)GRID_ROWS*GRID_COLS);'
+                        % (stencil.input_vars[-1], stencil.input_vars[-1]))
+        printer.println()
+
     printer.println('struct timeval tv1, tv2;')
     printer.println('gettimeofday(&tv1, NULL);')
 
-    printer.println('// Launch kernels')
+    if stencil.boarder_type == 'hybrid':
+        printer.println('// Launch kernels, refreshing the halos of the partitions between launches')
+        printer.println('for (int epoch = 0; epoch < EPOCH_COUNT; epoch++) {')
+        printer.do_indent()
+        with printer.if_('epoch > 0'):
+            _print_halo_refresh(stencil, printer, final_result_buffer)
+    else:
+        printer.println('// Launch kernels')
     with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
         printer.println('OCL_CHECK(err, err = q.enqueueTask(kernels[i]));')
 
     printer.println('q.finish();')
+    if stencil.boarder_type == 'hybrid':
+        printer.un_indent()
+        printer.println('}')
     printer.println('std::cout << "Execution finished" << std::endl;')
 
     printer.println()
@@ -113,11 +171,6 @@ def _print_main(stencil, printer, input_buffer_configs, output_buffer_config):
 
     printer.println('// Check results')
 
-    if stencil.iterate%2 == 0:
-        final_result_buffer = stencil.input_vars[-1]
-    else:
-        final_result_buffer = stencil.output_var
-
     with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
         printer.println('OCL_CHECK(err, err = q.enqueueMigrateMemObjects({device_%ss[i]}, CL_MIGRATE_MEM_OBJECT_HOST));'
                         % final_result_buffer)
@@ -127,9 +180,34 @@ def _print_main(stencil, printer, input_buffer_configs, output_buffer_config):
 
     printer.println()
 
+    if stencil.tiled:
+        printer.println('untile_buffer(%ss);' % final_result_buffer)
     printer.println('bool match = verify(%ss);' % final_result_buffer)
 
     printer.println('return (match ? EXIT_SUCCESS : EXIT_FAILURE);')
 
     printer.un_indent()
-    printer.println('}')
\ No newline at end of file
+    printer.println('}')
+
+
+def _print_halo_refresh(stencil, printer, result_buffer):
+    '''Print the copy of the results of a launch to the host and back as the halos of the next one'''
+    var = stencil.input_vars[-1]
+    with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
+        printer.println('OCL_CHECK(err, err = q.enqueueMigrateMemObjects({device_%ss[i]}, CL_MIGRATE_MEM_OBJECT_HOST));'
+                        % result_buffer)
+    printer.println('q.finish();')
+
+    if stencil.tiled:
+        # untile_buffer reorders a copy, the buffers stay mapped to the device
+        printer.println('std::vector<std::vector<%s_t, aligned_allocator<%s_t> > > %s_bands(%ss);'
+                        % (result_buffer, result_buffer, result_buffer, result_buffer))
+        printer.println('untile_buffer(%s_bands);' % result_buffer)
+        printer.println('gather_buffer(%s_bands, %s_grid);' % (result_buffer, var))
+    else:
+        printer.println('gather_buffer(%ss, %s_grid);' % (result_buffer, var))
+    printer.println('scatter_%s_buffer(%ss, %s_grid);' % (var, var, var))
+
+    with printer.for_('int i = 0', 'i < KERNEL_COUNT', 'i++'):
+        printer.println('OCL_CHECK(err, err = q.enqueueMigrateMemObjects({device_%ss[i]}, 0/*means from host*/));' % var)
+    printer.println('q.finish();')
\ No newline at end of file
@@ -0,0 +1,268 @@
+import logging
+import math
+from functools import reduce
+
+from core import analysis
+from dsl import arithmatic
+
+_logger = logging.getLogger().getChild(__name__)
+
+# Cycles from issuing an m_axi read to the data being available.
+MEM_LATENCY = 64
+# Depth of the II=1 MAJOR_LOOP pipeline, paid once per loop, without the
+# stencil kernel, which adds the latency of its critical path.
+PIPELINE_DEPTH = 32
+# Latencies of operators and functions at 300 MHz by compute type, 1 if absent.
+OP_LATENCIES = {
+    'float': {'+': 7, '-': 7, '*': 4, '/': 12, 'sqrt': 12, 'fmaf': 8, 'ldexpf': 2, 'fabs': 0},
+    'half': {'+': 5, '-': 5, '*': 3, '/': 10, 'sqrt': 10, 'fabs': 0},
+    'fixed': {'*': 3, '/': 20, 'sqrt': 12},
+    'int': {'*': 3, '/': 36, 'abs': 1},
+}
+# Sustainable bandwidth of one HBM pseudo-channel in GB/s.
+HBM_CHANNEL_BANDWIDTH = 14.375
+# Sustainable bandwidth of the PCIe Gen3 x16 link to the card in GB/s, each way.
+PCIE_BANDWIDTH = 11.0
+# Bandwidth of the host copying between the grid and the partition buffers in GB/s.
+HOST_COPY_BANDWIDTH = 5.0
+# Seconds from enqueuing a launch of the kernels to them running.
+LAUNCH_OVERHEAD = 50e-6
+
+
+class Estimate():
+    """Per-kernel cycle breakdown of a generated design.
+
+    Every line item is in cycles of the slowest kernel over the whole run,
+    so the items add up to the total.
+    """
+
+    ITEMS = (
+        ('useful', 'useful compute'),
+        ('halo', 'redundant halo compute'),
+        ('skipped', 'skipped stages'),
+        ('prologue', 'buffer fill'),
+        ('pipeline', 'pipeline fill'),
+        ('memory_stall', 'memory stall'),
+        ('exchange', 'halo exchange'),
+    )
+
+    def __init__(self, stencil, freq_mhz):
+        self.app_name = stencil.app_name
+        self.freq_mhz = freq_mhz
+        self.kernel_count = stencil.kernel_count
+        self.repeat_count = stencil.repeat_count
+        self.iterate = stencil.iterate
+        self.boarder_type = stencil.boarder_type
+        self.cell_count = reduce(lambda x, y: x*y, stencil.size)
+        self.tile_count = stencil.tile_count
+        self.epoch_count = stencil.epoch_count
+        self.passes = 0
+        self.stage_trip_counts = []
+        self.kernel_latency = 0
+        # memories of the reuse buffers of one stage
+        self.bram = 0
+        self.uram = 0
+        for attr, _ in self.ITEMS:
+            setattr(self, attr, 0)
+
+    @property
+    def cycles(self):
+        return sum(getattr(self, attr) for attr, _ in self.ITEMS)
+
+    @property
+    def seconds(self):
+        return self.cycles / (self.freq_mhz * 1e6)
+
+    @property
+    def gcells_per_second(self):
+        return self.cell_count * self.iterate / self.seconds / 1e9
+
+    def report(self):
+        lines = ['%s: %d kernel(s), %d stage(s), %d pass(es), %s border, %g MHz'
+                 % (self.app_name, self.kernel_count, self.repeat_count, self.passes,
+                    self.boarder_type or 'overlap', self.freq_mhz)
+                 + (', %d tiles' % self.tile_count if self.tile_count > 1 else '')
+                 + (', %d launches of %d iterations' % (self.epoch_count, self.iterate // self.epoch_count)
+                    if self.epoch_count > 1 else ''),
+                 'MAJOR_LOOP trip counts per stage of the first pass: %s'
+                 % ', '.join('%d' % trip for trip in self.stage_trip_counts),
+                 'stencil kernel critical path: %d cycles' % self.kernel_latency,
+                 'reuse buffers per PE: %d BRAM18K, %d URAM' % (self.bram, self.uram),
+                 '%-24s %14s %8s' % ('item', 'cycles/kernel', 'share')]
+        for attr, name in self.ITEMS:
+            lines.append('%-24s %14d %7.2f%%' % (name, getattr(self, attr),
+                                                 100.0 * getattr(self, attr) / self.cycles))
+        lines.append('%-24s %14d' % ('total', self.cycles))
+        lines.append('time %.3f ms, %.3f GCell/s' % (self.seconds * 1e3, self.gcells_per_second))
+        return lines
+
+
+def _fill_cycles(input_buffer_configs):
+    '''Iterations of MAJOR_LOOP before i = 0, see hls_kernel_gen._fill_length'''
+    return max(buffer_config.lineBuffer.fill_length for buffer_config in input_buffer_configs.values())
+
+
+def kernel_latency(stencil):
+    '''Cycles of the critical path of the stencil kernel'''
+    latencies = OP_LATENCIES[stencil.compute_type.kind]
+    return arithmatic.critical_path(stencil.local_stmts, stencil.output_stmt.expr,
+                                    lambda operator: latencies.get(operator, 1))
+
+
+def part_beats(stencil):
+    '''INTERFACE_WIDTH beats of one tile of the partition of one kernel'''
+    tile_cols = reduce(lambda x, y: x*y, stencil.tile_size[1:])
+    # same evaluation order as TILE_COLS/WIDTH_FACTOR*PART_ROWS in C
+    return tile_cols // stencil.unroll_factor * stencil.size[0] // stencil.row_parts
+
+
+def block_beats(stencil):
+    '''INTERFACE_WIDTH beats of the cells one kernel computes, without halos'''
+    return reduce(lambda x, y: x*y, stencil.size) // stencil.unroll_factor // stencil.kernel_count
+
+
+def pass_count(stencil):
+    '''Calls of the backbone in one launch, see hls_kernel_gen._print_interface'''
+    if stencil.kernel_iterate / stencil.repeat_count > 1:
+        return math.ceil(stencil.kernel_iterate / stencil.repeat_count)
+    return 1
+
+
+def stage_trip_counts(stencil, output_buffer_config, finished):
+    '''MAJOR_LOOP trip counts of the stages of the pass after finished iterations, see hls_kernel_gen._trip_count'''
+    appends = output_buffer_config.min_block_offset + output_buffer_config.max_block_offset
+    stage_count = stencil.repeat_count
+    # PASS_TOP_OVERHEAD(finished)+PASS_BOTTOM_OVERHEAD(finished)
+    if not stencil.overlapped:
+        overhead = 0
+    elif stencil.kernel_iterate <= stage_count:
+        overhead = (stencil.kernel_iterate - stage_count) * appends
+    else:
+        overhead = max(0, stencil.kernel_iterate - finished - stage_count) * appends
+    return [part_beats(stencil) + overhead + appends*(stage_count - 1 - k) for k in range(stage_count)]
+
+
+def buffer_beats(stencil, output_buffer_config):
+    '''INTERFACE_WIDTH beats of the output buffer of one kernel, see head_gen TILE_BEATS'''
+    appends = output_buffer_config.min_block_offset + output_buffer_config.max_block_offset
+    overhead = (stencil.kernel_iterate - stencil.repeat_count) * appends if stencil.overlapped else 0
+    return (part_beats(stencil) + appends * stencil.repeat_count + overhead) * stencil.tile_count
+
+
+def refresh_seconds(stencil, output_buffer_config):
+    '''Seconds the host takes between two launches of the hybrid border to refresh the halos'''
+    buffer_bytes = buffer_beats(stencil, output_buffer_config) * stencil.width // 8 * stencil.kernel_count
+    grid_bytes = reduce(lambda x, y: x*y, stencil.size) * stencil.element_width // 8
+    # results to the host, gathered into the grid, scattered and back to the card
+    return (LAUNCH_OVERHEAD + 2 * buffer_bytes / (PCIE_BANDWIDTH * 1e9)
+            + (grid_bytes + buffer_bytes) / (HOST_COPY_BANDWIDTH * 1e9))
+
+
+def buffer_traffic(stencil, input_buffer_configs, output_buffer_config):
+    """Bytes every buffer of one kernel moves over the run.
+
+    Every pass reads each input, including the beats that fill its line
+    buffer, and writes the output. The output and the last input swap
+    roles between passes. Packed inputs move through the buffer of their
+    pack. Every tile moves its own halo, and every launch its buffers.
+
+    Returns:
+        dict of bytes by variable or pack, see core.Stencil.input_ports.
+    """
+    beat_bytes = stencil.width // 8
+    ports = {var: var for var in stencil.input_vars}
+    for pack in stencil.packs:
+        ports.update((var, analysis.pack_name(pack)) for var in pack)
+    traffic = {var: 0 for var in stencil.input_ports + [stencil.output_var]}
+    for i in range(pass_count(stencil) * stencil.epoch_count):
+        trip_counts = stage_trip_counts(stencil, output_buffer_config, i * stencil.repeat_count)
+        source, target = stencil.input_vars[-1], stencil.output_var
+        if i % pass_count(stencil) % 2 == 1:
+            source, target = target, source
+        for var, buffer_config in input_buffer_configs.items():
+            var = source if var == stencil.input_vars[-1] else ports[var]
+            traffic[var] += (trip_counts[0] + buffer_config.lineBuffer.fill_length) * beat_bytes * stencil.tile_count
+        traffic[target] += trip_counts[-1] * beat_bytes * stencil.tile_count
+    return traffic
+
+
+def estimate(stencil, input_buffer_configs, output_buffer_config, freq_mhz=300.0):
+    """Estimates the cycles of the generated kernels without synthesizing them.
+
+    Mirrors the loop bounds emitted by head_gen and hls_kernel_gen: the
+    MAJOR_LOOP trip count of every stage, the iterations that fill the line
+    buffers, and the halo exchange of the streaming mode.
+
+    Args:
+        stencil: core.Stencil to estimate.
+        input_buffer_configs: dict of buffer.InputBufferConfig per input.
+        output_buffer_config: buffer.OutputBufferConfig of the output.
+        freq_mhz: kernel clock in MHz.
+
+    Returns:
+        Estimate of the slowest kernel.
+    """
+    from codegen import hbm_gen
+
+    result = Estimate(stencil, freq_mhz)
+    result.kernel_latency = kernel_latency(stencil)
+    result.bram = sum(buffer_config.lineBuffer.bram for buffer_config in input_buffer_configs.values())
+    result.uram = sum(buffer_config.lineBuffer.uram for buffer_config in input_buffer_configs.values())
+
+    part = block_beats(stencil)
+    tiles = stencil.tile_count
+    top_append = output_buffer_config.min_block_offset
+    bottom_append = output_buffer_config.max_block_offset
+    stage_count = stencil.repeat_count
+
+    # the first pass computes the widest halo
+    result.stage_trip_counts = stage_trip_counts(stencil, output_buffer_config, 0)
+    result.passes = pass_count(stencil)
+
+    # stages of one pass run concurrently in a dataflow region, so a pass
+    # takes as long as its first (longest) stage plus the buffer fill of
+    # every stage, which delays the first output of the next one
+    prologue = stage_count * _fill_cycles(input_buffer_configs) + MEM_LATENCY
+
+    # one INTERFACE_WIDTH beat per cycle on every m_axi port, times the
+    # ports whose traffic the busiest pseudo channel carries
+    plan = hbm_gen.allocate(stencil, buffer_traffic(stencil, input_buffer_configs, output_buffer_config))
+    demand = stencil.width / 8 * freq_mhz * 1e6 / 1e9 * plan.contention
+
+    useful_iterations = stencil.kernel_iterate
+    for finished in range(0, result.passes * stage_count, stage_count):
+        trip = stage_trip_counts(stencil, output_buffer_config, finished)[0]
+        stall = trip * max(0.0, demand / HBM_CHANNEL_BANDWIDTH - 1)
+        stage_iterations = min(stage_count, useful_iterations)
+        useful_iterations -= stage_iterations
+        result.useful += part * stage_iterations // stage_count
+        result.skipped += part - part * stage_iterations // stage_count
+        # tiles run one after another, each with the halo of its columns
+        result.halo += trip * tiles - part
+        result.prologue += prologue * tiles
+        result.pipeline += stage_count * (PIPELINE_DEPTH + result.kernel_latency) * tiles
+        result.memory_stall += int(stall * tiles)
+
+    # every launch of the hybrid border is alike
+    for attr in ('useful', 'halo', 'skipped', 'prologue', 'pipeline', 'memory_stall'):
+        setattr(result, attr, getattr(result, attr) * stencil.epoch_count)
+    if stencil.epoch_count > 1:
+        result.exchange = int((stencil.epoch_count - 1) * refresh_seconds(stencil, output_buffer_config)
+                              * freq_mhz * 1e6)
+
+    if stencil.boarder_type == 'streaming':
+        # the halos received from the neighbours are stored after every pass,
+        # sends to and receives from both neighbours run concurrently
+        if stencil.kernel_count > 2:
+            halo_beats = (top_append + bottom_append) * stage_count
+        else:
+            halo_beats = max(top_append, bottom_append) * stage_count
+        if stencil.architecture == 'dataflow':
+            # store forwards the rows the neighbours need while it writes them
+            result.exchange = result.passes * (halo_beats + MEM_LATENCY)
+        elif stencil.iterate / stage_count > 1:
+            # the rows the neighbours need are read again after every pass but the last
+            result.exchange = (result.passes - 1) * (halo_beats + 2 * (PIPELINE_DEPTH + MEM_LATENCY))
+
+    _logger.debug('estimate of %s: %d cycles', stencil.app_name, result.cycles)
+    return result
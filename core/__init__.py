@@ -1,3 +1,4 @@
 from core import analysis
 
-Stencil = analysis.Stencil
\ No newline at end of file
+Stencil = analysis.Stencil
+stencil_from_program = analysis.stencil_from_program
\ No newline at end of file
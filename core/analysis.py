@@ -1,10 +1,20 @@
+import copy
 import logging
+import operator
+from functools import reduce
 
+from core import dtype
 from core import utils
 from dsl import arithmatic
+from dsl import utils as dsl_utils
 
 _logger = logging.getLogger().getChild(__name__)
 
+# Interface widths the generated m_axi ports support.
+INTERFACE_WIDTHS = (64, 128, 256, 512, 1024)
+# Structures of the generated kernels, see hls_kernel_gen.kernel_gen.
+ARCHITECTURES = ('inline', 'dataflow')
+
 
 class Stencil():
 
@@ -12,13 +22,28 @@ class Stencil():
         self.iterate = kwargs.pop('iterate')
         self.boarder_type = kwargs.pop('boarder_type')
         self.kernel_count = kwargs.pop('kernel_count')
-        self.repeat_count = kwargs.pop('repeat_count')
+        self.repeat_count = kwargs.pop('repeat_count') or 1
         self.app_name = kwargs.pop('app_name')
         self.size = kwargs.pop('size')
         self.scalar_stmts = kwargs.pop('scalar_stmts')
         self.input_stmts = kwargs.pop('input_stmts')
         self.local_stmts = kwargs.pop('local_stmts')
         self.output_stmt = kwargs.pop('output_stmt')
+        self.data_format = kwargs.pop('data_format', 'text')
+        self.fast_math = kwargs.pop('fast_math', False)
+        self.reassociate = kwargs.pop('reassociate', False)
+        self.width = kwargs.pop('width', 0) or 512
+        if self.width not in INTERFACE_WIDTHS:
+            raise dsl_utils.SemanticError('interface width %d is not one of %s'
+                                          % (self.width, ', '.join(map(str, INTERFACE_WIDTHS))))
+        self.architecture = kwargs.pop('architecture', 'inline')
+        if self.architecture not in ARCHITECTURES:
+            raise dsl_utils.SemanticError('kernel architecture %s is not one of %s'
+                                          % (self.architecture, ', '.join(ARCHITECTURES)))
+        self.pack_inputs = kwargs.pop('pack_inputs', False)
+        self.tile = kwargs.pop('tile', None)
+        self.partition = kwargs.pop('partition', None)
+        self.epoch = kwargs.pop('epoch', None)
 
         self.scalar_vars = []
         for scalar in self.scalar_stmts:
@@ -30,6 +55,9 @@ class Stencil():
 
         _logger.debug("Get all input vars: [%s]",
                       ', '.join(self.input_vars))
+        if self.pack_inputs and not self.packs:
+            _logger.warning('pack_inputs needs two read-only inputs that fit a %d-bit port, nothing is packed',
+                            max(INTERFACE_WIDTHS))
 
         self.output_var = self.output_stmt.ref.name
 
@@ -37,18 +65,260 @@ class Stencil():
 
         self.output_idx = self.output_stmt.ref.idx
 
-        self.output_stmt.expr = arithmatic.simplify(self.output_stmt.expr)
+        self.types = {}
+        for stmt in self.input_stmts:
+            self.types[stmt.name] = dtype.parse(stmt.type)
+        self.types[self.output_var] = dtype.parse(self.output_stmt.type)
+        if len(set(data_type.bits for data_type in self.types.values())) != 1:
+            raise dsl_utils.SemanticError('inputs and output must have the same element width, got %s'
+                                          % ', '.join('%s %s' % item for item in self.types.items()))
+        if self.types[self.input_vars[-1]] != self.types[self.output_var]:
+            raise dsl_utils.SemanticError('the output replaces input %s between iterations and must have its type %s'
+                                          % (self.input_vars[-1], self.types[self.input_vars[-1]]))
+        self.element_width = self.types[self.output_var].bits
+        self.compute_type = dtype.compute_type(self.types.values())
+
+        _logger.debug("Get element types: [%s], compute in %s",
+                      ', '.join('%s %s' % (data_type, name) for name, data_type in self.types.items()),
+                      self.compute_type)
+
+        # constants and identities are only exact in float arithmetic, and a
+        # common subexpression of another type is rounded when it is hoisted
+        # into a local of the compute type; regrouping them across other
+        # operands changes rounding and needs --reassociate, which still
+        # leaves quotients alone where division truncates or quantizes
+        algebraic = all(data_type.kind == 'float' for data_type in self.types.values())
+        float_division = self.compute_type.kind in ('float', 'half')
+        self.output_stmt = copy.copy(self.output_stmt)
+        self.output_stmt.expr = arithmatic.simplify(self.output_stmt.expr, algebraic, self.reassociate, float_division)
         for i in range(0, len(self.local_stmts)):
-            self.local_stmts[i].let = arithmatic.simplify(self.local_stmts[i].let)
+            self.local_stmts[i].let = arithmatic.simplify(self.local_stmts[i].let, algebraic, self.reassociate,
+                                                          float_division)
+        if algebraic:
+            self.local_stmts, self.output_stmt.expr = arithmatic.eliminate_common_subexpressions(
+                self.local_stmts, self.output_stmt.expr, self.output_idx)
+            self._map_exprs(lambda expr: arithmatic.lower(expr, self.fast_math))
+        if self.reassociate:
+            self._map_exprs(lambda expr: arithmatic.balance(expr, float_division))
+        self.critical_path = arithmatic.critical_path(self.local_stmts, self.output_stmt.expr)
+        _logger.debug('critical path of the stencil kernel: %d operations', self.critical_path)
 
         self.all_refs = utils.find_relative_ref_position(self.output_stmt, self.output_idx, {})
         for local_stmt in self.local_stmts:
             self.all_refs = utils.find_relative_ref_position(local_stmt.let,
                                                              tuple(0 for i in range(0, len(self.output_idx))),
                                                              self.all_refs)
+        # positions are collected in sets, sort them so the ports of the
+        # generated code do not depend on their hashes
+        self.all_refs = {name: sorted(positions) for name, positions in self.all_refs.items()}
 
         _logger.debug("Get references: \n\t%s",
                       '\n\t'.join("%s:\t%s" % (name, ", ".join("(" + ", ".join("%d" % i[j]
                                                                         for j in range(0, len(self.output_idx)))+")"
                                                                             for i in pos))
-                                                                                for name, pos in self.all_refs.items()))
\ No newline at end of file
+                                                                                for name, pos in self.all_refs.items()))
+
+        if self.partition is not None:
+            self.partition = tuple(self.partition)
+            if len(self.partition) != len(self.size):
+                raise dsl_utils.SemanticError('partition needs a count for every dimension of %s, got %s'
+                                              % (tuple(self.size), self.partition))
+            for count, dim in zip(self.partition, self.size):
+                if count <= 0 or dim % count != 0:
+                    raise dsl_utils.SemanticError('partition count %d does not split a dimension of %d'
+                                                  % (count, dim))
+            # the partition overrides COUNT of the program
+            self.kernel_count = reduce(operator.mul, self.partition)
+            _logger.debug('%d kernels in blocks of %s', self.kernel_count, self.block_size)
+
+        if self.tile is not None:
+            self.tile = tuple(self.tile)
+            if len(self.tile) != len(self.size) - 1:
+                raise dsl_utils.SemanticError('tile needs an extent for every inner dimension of %s, got %s'
+                                              % (tuple(self.size), self.tile))
+            for extent, dim in zip(self.tile, self.block_size[1:]):
+                if extent <= 0 or dim % extent != 0:
+                    raise dsl_utils.SemanticError('tile extent %d does not split a block dimension of %d'
+                                                  % (extent, dim))
+
+        if self.epoch is not None:
+            if self.boarder_type != 'hybrid':
+                raise dsl_utils.SemanticError('iterations per launch need the hybrid border')
+            if self.epoch <= 0 or self.iterate % self.epoch != 0:
+                raise dsl_utils.SemanticError('%d iterations per launch do not split ITERATE %d'
+                                              % (self.epoch, self.iterate))
+
+        if self.tiled:
+            if not self.overlapped and self.iterate != 1:
+                raise dsl_utils.SemanticError('tiles and blocks only exchange their halo through the overlap border')
+            _logger.debug('%d tiles of %s, halos %s', self.tile_count, self.tile_size, self.tile_halos)
+
+    def _map_exprs(self, func):
+        '''Replaces the local and output expressions with func(expr), leaving the parsed program intact'''
+        self.output_stmt.expr = func(self.output_stmt.expr)
+        local_stmts = []
+        for local_stmt in self.local_stmts:
+            local_stmt = copy.copy(local_stmt)
+            local_stmt.let = copy.copy(local_stmt.let)
+            local_stmt.let.expr = func(local_stmt.let.expr)
+            local_stmts.append(local_stmt)
+        self.local_stmts = local_stmts
+
+    @property
+    def unroll_factor(self):
+        '''Elements carried by one INTERFACE_WIDTH beat, i.e. PARA_FACTOR'''
+        return self.width // self.element_width
+
+    @property
+    def overlapped(self):
+        '''Whether kernels recompute the halo of their partition instead of exchanging it'''
+        return self.boarder_type in ('overlap', 'hybrid')
+
+    @property
+    def kernel_iterate(self):
+        '''Iterations of one launch of the kernels, the hybrid border refreshes halos on the host between launches'''
+        if self.boarder_type == 'hybrid' and self.epoch is not None:
+            return self.epoch
+        return self.iterate
+
+    @property
+    def epoch_count(self):
+        '''Launches of the kernels'''
+        return self.iterate // self.kernel_iterate
+
+    @property
+    def row_parts(self):
+        '''Bands of rows the grid is split into, PART_ROWS rows each'''
+        if self.partition is None:
+            return self.kernel_count
+        return self.partition[0]
+
+    @property
+    def block_size(self):
+        '''Part of the grid of one kernel, a band of whole rows unless the partition splits inner dimensions'''
+        if self.partition is None:
+            return (self.size[0] // self.kernel_count,) + tuple(self.size[1:])
+        return tuple(dim // count for dim, count in zip(self.size, self.partition))
+
+    @property
+    def tiled(self):
+        '''Whether kernels stream a part of the inner dimensions at a time, see tile_size'''
+        return self.tile is not None or self.block_size[1:] != tuple(self.size[1:])
+
+    @property
+    def tile_extents(self):
+        '''Cells of a tile in every inner dimension without its halo'''
+        if self.tile is None:
+            return self.block_size[1:]
+        return self.tile
+
+    @property
+    def reach(self):
+        '''(before, after) cells around the output every input is read at in every dimension, through the locals'''
+        reach = {}
+        for var in self.input_vars:
+            positions = self.all_refs[var]
+            reach[var] = tuple((max(0, -min(position[dim] for position in positions)),
+                                max(0, max(position[dim] for position in positions)))
+                               for dim in range(len(self.size)))
+        return reach
+
+    def cone(self, iterations):
+        """Cells the output depends on after a number of iterations.
+
+        Only the last input carries the result of an iteration into the
+        next one. The other inputs are read again by every iteration, so
+        their reach only adds to iterations - 1 steps of the last input.
+
+        Returns:
+            (before, after) cells in every dimension.
+        """
+        if iterations <= 0:
+            return [(0, 0)] * len(self.size)
+        iterated = self.reach[self.input_vars[-1]]
+        cone = []
+        for dim in range(len(self.size)):
+            cone.append(tuple(max(reach[dim][side] + (iterations - 1) * iterated[dim][side]
+                                  for reach in self.reach.values())
+                              for side in range(2)))
+        return cone
+
+    @property
+    def tile_halos(self):
+        '''(before, after) halo of a tile in every inner dimension, which ITERATE iterations spoil'''
+        if not self.tiled:
+            return [(0, 0)] * (len(self.size) - 1)
+        halos = [list(halo) for halo in self.cone(self.kernel_iterate)[1:]]
+        # a row of a tile is whole INTERFACE_WIDTH beats
+        halos[-1][1] += -(self.tile_extents[-1] + sum(halos[-1])) % self.unroll_factor
+        return [tuple(halo) for halo in halos]
+
+    @property
+    def tile_size(self):
+        '''Size of the grid a kernel streams through at once, one tile with its halo, or the whole grid'''
+        if not self.tiled:
+            return tuple(self.size)
+        return (self.size[0],) + tuple(extent + before + after
+                                       for extent, (before, after) in zip(self.tile_extents, self.tile_halos))
+
+    @property
+    def tile_count(self):
+        '''Tiles of the block of a kernel, one after another'''
+        if not self.tiled:
+            return 1
+        return reduce(operator.mul, (dim // extent for dim, extent in zip(self.block_size[1:], self.tile_extents)))
+
+    @property
+    def packs(self):
+        '''Groups of read-only inputs interleaved into one buffer, as many as fit the widest port'''
+        if not self.pack_inputs:
+            return []
+        # the last input swaps with the output between passes
+        read_only = self.input_vars[:-1]
+        lanes = max(INTERFACE_WIDTHS) // self.width
+        packs = [tuple(read_only[i:i + lanes]) for i in range(0, len(read_only), lanes)]
+        return [pack for pack in packs if len(pack) > 1]
+
+    @property
+    def input_ports(self):
+        '''Input buffers in memory in the order of input_vars, a pack takes the place of its first input'''
+        ports = []
+        for var in self.input_vars:
+            pack = next((pack for pack in self.packs if var in pack), None)
+            if pack is None:
+                ports.append(var)
+            elif var == pack[0]:
+                ports.append(pack_name(pack))
+        return ports
+
+
+def pack_name(pack):
+    '''Buffer and m_axi port of a group of packed inputs'''
+    return '%s_packed' % '_'.join(pack)
+
+
+def stencil_from_program(program, **kwargs):
+    """Builds a Stencil from a parsed DSL program.
+
+    Args:
+        program: ir.Program returned by the textX metamodel.
+        kwargs: extra Stencil options, e.g. data_format, or overrides of the
+            program header such as width.
+
+    Returns:
+        Stencil of the program.
+    """
+    kwargs.setdefault('width', program.width)
+    return Stencil(
+        iterate=program.iterate,
+        boarder_type=program.boarder_type,
+        kernel_count=program.kernel_count,
+        repeat_count=program.repeat_count,
+        app_name=program.app_name,
+        size=program.size,
+        scalar_stmts=program.scalar_stmts,
+        input_stmts=program.input_stmts,
+        local_stmts=program.local_stmts,
+        output_stmt=program.output_stmt,
+        **kwargs
+    )
@@ -0,0 +1,144 @@
+import re
+
+from dsl import utils as dsl_utils
+
+_FIXED = re.compile(r'^fixed<\s*(\d+)\s*,\s*(-?\d+)\s*>$')
+_INTEGER = re.compile(r'^(u?)int(8|16|32)$')
+
+_RAW_TYPES = {8: 'uint8_t', 16: 'uint16_t', 32: 'uint32_t'}
+
+
+class DataType():
+    """Element type of an input or output array.
+
+    Attributes:
+        name: type as written in the DSL, e.g. 'uint8' or 'fixed<16,8>'.
+        kind: one of 'float', 'half', 'int' and 'fixed'.
+        bits: width of one element in memory.
+        signed: whether integers and fixed-point values carry a sign.
+        frac_bits: fractional bits of a fixed-point value.
+    """
+
+    def __init__(self, name, kind, bits, signed=True, frac_bits=0):
+        self.name = name
+        self.kind = kind
+        self.bits = bits
+        self.signed = signed
+        self.frac_bits = frac_bits
+
+    def __eq__(self, other):
+        return isinstance(other, DataType) and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def c_type(self):
+        '''Type of an element in the kernel'''
+        if self.kind == 'int':
+            return '%sint%d_t' % ('' if self.signed else 'u', self.bits)
+        if self.kind == 'fixed':
+            return 'ap_fixed<%d, %d>' % (self.bits, self.bits - self.frac_bits)
+        return self.kind
+
+    @property
+    def raw_type(self):
+        '''Unsigned integer holding the bits of an element'''
+        return _RAW_TYPES[self.bits]
+
+    @property
+    def host_type(self):
+        '''Type of an element in the host buffers, see host_codes.typed_value_functions'''
+        if self.kind == 'half':
+            return 'half_bits'
+        if self.kind == 'fixed':
+            return 'fixed_point<%s, %d>' % ('int%d_t' % self.bits, self.frac_bits)
+        return self.c_type
+
+    @property
+    def numpy_type(self):
+        '''Name of the NumPy dtype of an element in the binary data files'''
+        if self.kind == 'float':
+            return 'float32'
+        if self.kind == 'half':
+            return 'float16'
+        if self.kind == 'fixed':
+            return 'int%d' % self.bits
+        return '%sint%d' % ('' if self.signed else 'u', self.bits)
+
+    @property
+    def tolerance(self):
+        '''C expression of the largest difference verify() accepts from the check value expected'''
+        if self.kind == 'float':
+            return '1e-10'
+        if self.kind == 'half':
+            # one unit in the last place of a half
+            return '%r*fmax(1.0, fabs(expected))' % 2.0 ** -10
+        if self.kind == 'fixed':
+            return '%r' % 2.0 ** -self.frac_bits
+        return '0'
+
+    def c_from_raw(self, raw):
+        '''C expression reinterpreting the raw_type lvalue raw as c_type'''
+        if self.kind == 'int':
+            return '(%s)%s' % (self.c_type, raw)
+        if self.kind == 'fixed':
+            return 'fixed_from_raw<%s >(%s)' % (self.c_type, raw)
+        return '*((%s*)(&%s))' % (self.c_type, raw)
+
+    def c_to_raw(self, value):
+        '''C expression reinterpreting the c_type lvalue value as raw_type'''
+        if self.kind == 'int':
+            return '(%s)%s' % (self.raw_type, value)
+        if self.kind == 'fixed':
+            return '(%s)%s.range()' % (self.raw_type, value)
+        return '*((%s *)(&%s))' % (self.raw_type, value)
+
+
+FLOAT = DataType('float', 'float', 32)
+
+
+def parse(name):
+    """Parses an element type of the DSL.
+
+    Args:
+        name: 'float', 'half', '[u]int{8,16,32}' or 'fixed<W,I>' with W total
+            and I integer bits; an empty name means float.
+
+    Returns:
+        DataType of name.
+
+    Raises:
+        dsl_utils.SemanticError: if the type is unknown or has an unsupported width.
+    """
+    if not name or name == 'float':
+        return FLOAT
+    if name == 'half':
+        return DataType(name, 'half', 16)
+    match = _INTEGER.match(name)
+    if match is not None:
+        return DataType(name, 'int', int(match.group(2)), signed=match.group(1) != 'u')
+    match = _FIXED.match(name)
+    if match is not None:
+        bits, int_bits = int(match.group(1)), int(match.group(2))
+        if bits not in _RAW_TYPES or not 0 <= bits - int_bits <= bits:
+            raise dsl_utils.SemanticError('unsupported fixed-point type %s, width must be 8, 16 or 32 '
+                                          'and integer bits between 0 and the width' % name)
+        return DataType('fixed<%d,%d>' % (bits, int_bits), 'fixed', bits, frac_bits=bits - int_bits)
+    raise dsl_utils.SemanticError('unknown element type %s' % name)
+
+
+def compute_type(data_types):
+    """Type the stencil kernel computes in for a set of element types.
+
+    The widest kind wins: float, then half, then fixed point (the first one
+    given), and 32-bit integers when every element is an integer.
+    """
+    for kind in ('float', 'half', 'fixed'):
+        for data_type in data_types:
+            if data_type.kind == kind:
+                return data_type
+    return parse('int32')
@@ -0,0 +1,364 @@
+import logging
+import os
+import re
+from functools import reduce
+
+import numpy as np
+
+from core import dtype
+from core import utils
+from dsl import ir
+from dsl import utils as dsl_utils
+
+_logger = logging.getLogger().getChild(__name__)
+
+# value the generated host passes for every scalar argument (see host_gen)
+DEFAULT_SCALAR_VALUE = 1.5
+
+# elements evaluated at once, small enough for the temporaries to stay in cache
+CHUNK_SIZE = 1 << 14
+
+_NUM_SUFFIX = re.compile(r'[FfLlUu]+$')
+
+_BINARY_OPS = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    '/': np.divide,
+    '%': np.fmod,
+    '<': np.less,
+    '>': np.greater,
+    '<=': np.less_equal,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+    '&&': np.logical_and,
+    '||': np.logical_or,
+    '&': np.bitwise_and,
+    '|': np.bitwise_or,
+    '^': np.bitwise_xor,
+}
+
+_UNARY_OPS = {
+    '+': lambda x: x,
+    '-': np.negative,
+    '!': np.logical_not,
+    '~': np.invert,
+}
+
+
+def _fmaf(x, y, z):
+    """x * y + z rounded once to float32, like the fmaf of the kernel.
+
+    The product of two float32 values is exact in float64, but rounding the
+    float64 sum to float32 would round twice. The sum is rounded to odd
+    instead, using its exact error, which leaves float32 rounding unchanged.
+    """
+    product = np.asarray(x, dtype=np.float64) * np.asarray(y, dtype=np.float64)
+    addend = np.asarray(z, dtype=np.float64)
+    total = product + addend
+    # two-sum, total + error is exactly product + addend
+    virtual = total - product
+    error = (product - (total - virtual)) + (addend - virtual)
+    inexact_even = np.isfinite(total) & (error != 0) & (total.view(np.int64) & 1 == 0)
+    total = np.where(inexact_even, np.nextafter(total, np.where(error > 0, np.inf, -np.inf)), total)
+    return total.astype(np.float32)
+
+
+_CALLS = {
+    'sqrt': np.sqrt,
+    'fabs': np.abs,
+    'abs': np.abs,
+    # inserted by arithmatic.lower
+    'ldexpf': lambda x, exponent: np.ldexp(x, np.int32(exponent)),
+    'fmaf': _fmaf,
+}
+
+_INTEGER_LITERAL = re.compile(r'[+-]?\d+[UuLl]*$')
+
+
+def parse_num(num: str) -> np.float32:
+    """Parses a DSL literal the way the generated kernel casts it.
+
+    Every literal of a float stencil is emitted as '(float)<num>' by
+    ir.Operand.c_expr, so the value is rounded to float32 regardless of how
+    it is written.
+    """
+    return np.float32(float(_NUM_SUFFIX.sub('', num)))
+
+
+def encode(values, data_type):
+    """Converts values to the raw elements of data_type, as stored in memory.
+
+    Integers are truncated toward zero and fixed-point values floored, like
+    the C casts and the default AP_TRN quantization, and like the host reads
+    its data files; both wrap on overflow.
+    """
+    values = np.asarray(values)
+    if data_type.kind == 'float':
+        return values.astype(np.float32)
+    if data_type.kind == 'half':
+        return values.astype(np.float16)
+    if data_type.kind == 'fixed':
+        values = np.floor(values * 2.0**data_type.frac_bits)
+    else:
+        values = np.trunc(values)
+    with np.errstate(invalid='ignore'):
+        return values.astype(np.int64).astype(data_type.numpy_type)
+
+
+def decode(raw, data_type):
+    """Converts raw elements of data_type to values the executor computes with."""
+    raw = np.asarray(raw)
+    if data_type.kind == 'fixed':
+        return raw.astype(np.float64) * 2.0**-data_type.frac_bits
+    if data_type.kind == 'int':
+        return raw.astype(np.float64)
+    return raw.astype(np.float32)
+
+
+def quantize(values, data_type):
+    """Rounds values to the nearest representable values of data_type."""
+    if data_type.kind == 'float':
+        return np.asarray(values, dtype=np.float32)
+    return decode(encode(values, data_type), data_type)
+
+
+class ReferenceExecutor():
+    """Evaluates a stencil over the whole grid with NumPy array operations.
+
+    The grid is handled in the flattened layout used by the line buffers: a
+    reference x(i, j) is a shift of the flattened array by
+    cvt_idx2offset((i, j), size) elements, and elements shifted in from
+    outside the grid read as zero, just like the zero-initialized host
+    buffers of the boundary partitions.
+
+    The kernels compute and store the halo beyond the grid like any other
+    cells, so the iterated input does not stay zero there: those cells
+    evolve until the hardware reads zeros again, see refresh_period. The
+    executor evolves them as far as they reach back into the grid.
+
+    Non-float stencils are computed in float64 (float32 for half) and
+    rounded to the element types wherever the kernel stores a value: the
+    inputs, the locals, which have the compute type, and the output of every
+    iteration. Integer stencils divide integer operands with truncation;
+    per-operation rounding of half and fixed-point arithmetic is not modeled.
+    """
+
+    def __init__(self, stencil, scalars=None):
+        self.stencil = stencil
+        self.size = tuple(stencil.size)
+        self.cell_count = reduce(lambda x, y: x*y, self.size)
+        self.types = stencil.types
+        self.compute_type = stencil.compute_type
+        if self.compute_type.kind in ('float', 'half'):
+            self.work_dtype = np.float32
+        else:
+            self.work_dtype = np.float64
+        self.scalars = {}
+        for scalar in stencil.scalar_vars:
+            value = DEFAULT_SCALAR_VALUE
+            if scalars is not None and scalar in scalars:
+                value = scalars[scalar]
+            self.scalars[scalar] = np.float32(value)
+
+        offsets = [0]
+        for positions in stencil.all_refs.values():
+            offsets.extend(utils.find_refs_by_offset(list(positions), self.size))
+        self.margin = max(abs(offset) for offset in offsets)
+        # evolved cells beyond the grid and the margin they read
+        self.pad = self.margin * min(self.refresh_period, stencil.iterate)
+
+    @property
+    def refresh_period(self):
+        """Iterations after which the kernels read zeros beyond the grid again.
+
+        Overlapped kernels store the halo a later pass reads, up to the end of
+        a launch, after which the hybrid border scatters the grid again. The
+        other kernels only store their partition, so every pass of
+        repeat_count stages starts from the zero-initialized halo.
+        """
+        if self.stencil.overlapped:
+            return self.stencil.kernel_iterate
+        return self.stencil.repeat_count
+
+    def _pad(self, array):
+        """Surrounds a flattened grid with zeros so that every reference is a slice."""
+        padded = np.zeros(self.cell_count + 2*self.pad, dtype=self.work_dtype)
+        padded[self.pad:self.pad + self.cell_count] = array
+        return padded
+
+    def evaluate(self, node, relative, arrays, env, chunk):
+        """Evaluates an expression tree over the whole grid.
+
+        Args:
+            node: ir.Node to evaluate.
+            relative: index the references of node are relative to.
+            arrays: dict of zero-padded flattened input arrays.
+            env: dict of already evaluated locals and scalars.
+            chunk: (begin, end) range of the flattened grid to evaluate, which
+                may extend beyond the grid.
+
+        Returns:
+            np.ndarray of the chunk, or a float32 scalar.
+        """
+
+        def recurse(child):
+            return self.evaluate(child, relative, arrays, env, chunk)
+
+        if isinstance(node, ir.Ref):
+            offset = utils.find_refs_by_offset([utils.cal_relative(node.idx, relative)], self.size)[0]
+            begin = self.pad + chunk[0] + offset
+            return arrays[node.name][begin:begin + chunk[1] - chunk[0]]
+        if isinstance(node, ir.Var):
+            return env[node.name]
+        if isinstance(node, ir.BinaryOp):
+            result = recurse(node.operand[0])
+            integral = self._integral(node.operand[0])
+            for operator, operand in zip(node.operator, node.operand[1:]):
+                if operator == '/' and integral and self._integral(operand):
+                    result = np.trunc(np.divide(result, recurse(operand)))
+                else:
+                    result = _BINARY_OPS[operator](result, recurse(operand))
+                    integral = integral and self._integral(operand)
+            return result
+        if isinstance(node, ir.Unary):
+            result = recurse(node.operand)
+            for operator in reversed(node.operator):
+                result = _UNARY_OPS[operator](result)
+            return result
+        if isinstance(node, ir.Operand):
+            for attr in ('call', 'ref', 'expr', 'var'):
+                if getattr(node, attr) is not None:
+                    return recurse(getattr(node, attr))
+            return parse_num(node.num)
+        if isinstance(node, ir.Call):
+            args = [recurse(arg) for arg in node.arg]
+            if node.name == 'if':
+                return np.where(args[0], args[1], args[2])
+            return _CALLS[node.name](*args)
+        raise dsl_utils.InternalError('cannot evaluate %s' % type(node).__name__)
+
+    def _integral(self, node):
+        """Whether node has an integer type in the C code of an integer stencil."""
+        if self.compute_type.kind != 'int':
+            return False
+        if isinstance(node, ir.Ref):
+            return self.types[node.name].kind == 'int'
+        if isinstance(node, ir.Var):
+            # locals have the compute type, scalars are float
+            return node.name not in self.scalars
+        if isinstance(node, ir.BinaryOp):
+            return all(self._integral(operand) for operand in node.operand)
+        if isinstance(node, ir.Unary):
+            return self._integral(node.operand)
+        if isinstance(node, ir.Operand):
+            for attr in ('call', 'ref', 'expr', 'var'):
+                if getattr(node, attr) is not None:
+                    return self._integral(getattr(node, attr))
+            return _INTEGER_LITERAL.match(node.num) is not None
+        if isinstance(node, ir.Call):
+            if node.name == 'if':
+                return self._integral(node.arg[1]) and self._integral(node.arg[2])
+            return node.name == 'abs' and self._integral(node.arg[0])
+        return False
+
+    def step(self, arrays, result, reach=0):
+        """Computes one iteration of the output statement.
+
+        The grid is evaluated chunk by chunk so that the temporaries of the
+        expression tree stay in cache.
+
+        Args:
+            arrays: dict of zero-padded flattened float32 inputs.
+            result: np.ndarray padded like the inputs the output is written to.
+            reach: cells beyond either end of the grid to compute as well.
+        """
+        origin = tuple(0 for _ in self.size)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for begin in range(-reach, self.cell_count + reach, CHUNK_SIZE):
+                chunk = (begin, min(begin + CHUNK_SIZE, self.cell_count + reach))
+                env = dict(self.scalars)
+                for local_stmt in self.stencil.local_stmts:
+                    value = self.evaluate(local_stmt.let.expr, origin, arrays, env, chunk)
+                    env[local_stmt.let.name] = quantize(value, self.compute_type)
+                value = self.evaluate(self.stencil.output_stmt.expr,
+                                      tuple(self.stencil.output_idx), arrays, env, chunk)
+                result[self.pad + chunk[0]:self.pad + chunk[1]] = quantize(value, self.types[self.stencil.output_var])
+
+    def run(self, inputs):
+        """Runs ITERATE iterations with the ping-pong scheme of the kernel.
+
+        Like _print_interface, the output of an iteration replaces the last
+        input variable while the other inputs stay constant. Beyond the grid,
+        the last input is zero at the start of every refresh_period and
+        evolves in between.
+
+        Args:
+            inputs: dict of input name to array of the grid size.
+
+        Returns:
+            np.ndarray shaped like the grid holding the final result.
+        """
+        arrays = {}
+        for name in self.stencil.input_vars:
+            array = quantize(np.asarray(inputs[name]).reshape(-1), self.types[name])
+            if array.size != self.cell_count:
+                raise ValueError('input %s has %d elements, expected %d'
+                                 % (name, array.size, self.cell_count))
+            arrays[name] = self._pad(array)
+
+        iterated = self.stencil.input_vars[-1]
+        output = np.zeros_like(arrays[iterated])
+        period = self.refresh_period
+        for i in range(self.stencil.iterate):
+            _logger.debug('reference iteration %d', i)
+            if i % period == 0:
+                arrays[iterated][:self.pad] = 0
+                arrays[iterated][self.pad + self.cell_count:] = 0
+            # the cells beyond the grid the rest of the period still reads
+            end = min(i - i % period + period, self.stencil.iterate)
+            self.step(arrays, output, self.margin * (end - i - 1))
+            arrays[iterated], output = output, arrays[iterated]
+        return arrays[iterated][self.pad:self.pad + self.cell_count].reshape(self.size)
+
+
+def load_inputs(stencil, data_dir, data_format='text'):
+    """Loads the input files read by the generated host.
+
+    Text inputs are '<data_dir>/<input>.data' with whitespace separated
+    values, binary inputs are '<data_dir>/<input>.bin' with raw elements of
+    the input type.
+    """
+    inputs = {}
+    for name in stencil.input_vars:
+        if data_format == 'binary':
+            path = os.path.join(data_dir, '%s.bin' % name)
+            _logger.info('load reference input %s', path)
+            inputs[name] = decode(np.fromfile(path, dtype=stencil.types[name].numpy_type), stencil.types[name])
+        else:
+            path = os.path.join(data_dir, '%s.data' % name)
+            _logger.info('load reference input %s', path)
+            inputs[name] = np.fromfile(path, dtype=np.float64, sep=' ')
+    return inputs
+
+
+def save_check_data(result, data_dir, data_format='text', data_type=dtype.FLOAT):
+    """Writes the result as the check file of the generated verify()."""
+    if data_format == 'binary':
+        path = os.path.join(data_dir, 'check.bin')
+        _logger.info('write reference result %s', path)
+        encode(result, data_type).tofile(path)
+    else:
+        path = os.path.join(data_dir, 'check.data')
+        _logger.info('write reference result %s', path)
+        quantize(result, data_type).tofile(path, sep='\n', format='%.9g')
+        with open(path, 'a') as file:
+            file.write('\n')
+
+
+def golden_gen(stencil, data_dir, scalars=None):
+    executor = ReferenceExecutor(stencil, scalars)
+    result = executor.run(load_inputs(stencil, data_dir, stencil.data_format))
+    save_check_data(result, data_dir, stencil.data_format, stencil.types[stencil.output_var])
+    return result
@@ -1,3 +1,5 @@
+import functools
+
 lan = """
 Program:
 (
@@ -6,23 +8,26 @@ Program:
     ('KERNEL' ':' app_name=ID)
     ('COUNT' ':' kernel_count=INT)
     ('REPEAT' ':' repeat_count=INT)?
+    ('WIDTH' ':' width=INT)?
     (scalar_stmts=ScalarStmt)*
     (input_stmts=InputStmt)+
     (local_stmts=LocalStmt)*
     (output_stmt=OutputStmt)
 )#;
 
-BoarderType: 'overlap' | 'streaming';
+BoarderType: 'overlap' | 'streaming' | 'hybrid';
 
 Comment: /\/\/.*$/;
 
 ScalarStmt: 'scalar' name=ID;
 
-InputStmt: 'input' name=ID '(' size=INT (',' size=INT)* ')'; //now all inputs&outputs are forced to be float value
+ElemType: /(float|half|u?int(8|16|32)|fixed<\s*\d+\s*,\s*-?\d+\s*>)(?!\w)/;
+
+InputStmt: 'input' (type=ElemType)? name=ID '(' size=INT (',' size=INT)* ')'; //float if the type is omitted
 
 LocalStmt: 'local' let=Let;
 
-OutputStmt: 'output' ref=Ref '=' expr=Expr;//now all inputs&outputs are forced to be float value
+OutputStmt: 'output' (type=ElemType)? ref=Ref '=' expr=Expr;//float if the type is omitted
 
 //Specify Expressions
 Dec: /\d+([Uu][Ll][Ll]?|[Ll]?[Ll]?[Uu]?)/;
@@ -68,4 +73,17 @@ UnaryOp: '+'|'-'|'~'|'!';
 Operand: call=Call | ref=Ref | num=Num | '(' expr=Expr ')' | var=Var;
 Call: name=FuncName '(' arg=Expr (',' arg=Expr)* ')';
 Var: name=ID;
-"""
\ No newline at end of file
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def metamodel():
+    """textX metamodel of the DSL, whose model objects are the classes of dsl.ir.
+
+    Building the metamodel takes far longer than parsing a program, so it is
+    built once per process; textX metamodels cannot be pickled to disk. Worker
+    pools forked after the first call inherit it.
+    """
+    import textx
+    from dsl import ir
+    return textx.metamodel_from_str(lan, classes=ir.CLASSES)
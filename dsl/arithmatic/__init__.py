@@ -1,15 +1,24 @@
 import collections
 import logging
 
+from dsl.arithmatic import balance as balancing
 from dsl.arithmatic import base
+from dsl.arithmatic import cse
+from dsl.arithmatic import lower as lowering
 
 _logger = logging.getLogger().getChild(__name__)
 
-def simplify(expr):
+def simplify(expr, algebraic=False, reassociate=False, float_division=True):
     """Simplifies expressions.
 
         Args:
             expr: A haoda.ir.Node or a sequence of haoda.ir.Node.
+            algebraic: Also fold constants and apply algebraic identities, which
+                assumes float arithmetic.
+            reassociate: Also regroup chains, literals and repeated terms across
+                other operands, which changes the rounding of results.
+            float_division: Whether '/' rounds rather than truncates, so that
+                reassociate may regroup quotients.
 
         Returns:
             Simplified haoda.ir.Node or sequence.
@@ -19,11 +28,85 @@ def simplify(expr):
         _logger.debug('None expr, no simplification.')
         return expr
 
-    passes = base.compose(
-        base.flatten,
-        base.print_tree)
+    if algebraic:
+        passes = base.compose(
+            lambda node: base.flatten(node, reassociate, float_division),
+            base.fixed_point(base.compose(
+                lambda node: base.fold_constants(node, reassociate),
+                lambda node: base.apply_identities(node, reassociate),
+                lambda node: base.flatten(node, reassociate, float_division))),
+            base.print_tree)
+    else:
+        passes = base.compose(
+            lambda node: base.flatten(node, reassociate, float_division),
+            base.print_tree)
 
-    if isinstance(expr, collections.Iterable):
+    if isinstance(expr, collections.abc.Iterable):
         return type(expr)(map(passes, expr))
 
-    return passes(expr)
\ No newline at end of file
+    return passes(expr)
+
+
+def eliminate_common_subexpressions(local_stmts, output_expr, output_idx):
+    """Evaluates repeated computations of a stencil once, see cse.eliminate.
+
+        Args:
+            local_stmts: A sequence of ir.LocalStmt.
+            output_expr: The ir.Node of the output statement.
+            output_idx: The index of the output reference.
+
+        Returns:
+            A list of ir.LocalStmt and the new output expression.
+    """
+
+    return cse.eliminate(local_stmts, output_expr, output_idx)
+
+
+def lower(expr, fast_math=False):
+    """Lowers arithmetic to cheaper operators, see lower.lower.
+
+        Args:
+            expr: A haoda.ir.Node or a sequence of haoda.ir.Node.
+            fast_math: Whether rewrites may change the rounding of results.
+
+        Returns:
+            Lowered haoda.ir.Node or sequence.
+    """
+
+    if isinstance(expr, collections.abc.Iterable):
+        return type(expr)(lowering.lower(_, fast_math) for _ in expr)
+
+    return lowering.lower(expr, fast_math)
+
+
+def balance(expr, float_division=True):
+    """Reassociates long chains into balanced trees, see balance.balance.
+
+        Args:
+            expr: A haoda.ir.Node or a sequence of haoda.ir.Node.
+            float_division: Whether '/' rounds rather than truncates, so that
+                quotients may be regrouped.
+
+        Returns:
+            Balanced haoda.ir.Node or sequence.
+    """
+
+    if isinstance(expr, collections.abc.Iterable):
+        return type(expr)(balancing.balance(_, float_division) for _ in expr)
+
+    return balancing.balance(expr, float_division)
+
+
+def critical_path(local_stmts, output_expr, latency=None):
+    """Latency of the longest dependent chain of a stencil, see balance.critical_path.
+
+        Args:
+            local_stmts: A sequence of ir.LocalStmt.
+            output_expr: The ir.Node of the output statement.
+            latency: A callable returning the latency of an operator or function.
+
+        Returns:
+            The latency from the references to the output.
+    """
+
+    return balancing.critical_path(local_stmts, output_expr, latency)
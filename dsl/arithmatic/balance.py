@@ -0,0 +1,116 @@
+import logging
+
+from dsl import ir
+from dsl.arithmatic import base
+
+_logger = logging.getLogger().getChild(__name__)
+
+# operators whose chains may be evaluated in any grouping
+_ASSOCIATIVE = ('+', '*', '||', '&&', '|', '&', '^')
+
+def _tree(node_type, operator, operands):
+    """Combines operands with operator as a balanced binary tree."""
+    if len(operands) == 1:
+        return operands[0]
+    middle = (len(operands) + 1) // 2
+    return node_type(operator=[operator], operand=[_tree(node_type, operator, operands[:middle]),
+                                                   _tree(node_type, operator, operands[middle:])])
+
+def _balance(node: ir.BinaryOp, float_division) -> ir.Node:
+    if len(node.operand) < 3:
+        return node
+    operators = set(node.operator)
+    if len(operators) == 1 and node.operator[0] in _ASSOCIATIVE:
+        return _tree(type(node), node.operator[0], list(node.operand))
+    if isinstance(node, ir.AddSub):
+        # a - b + c - d is (a + c) - (b + d)
+        positive = [operand for sign, operand in base.signed_terms(node) if sign == '+']
+        negative = [operand for sign, operand in base.signed_terms(node) if sign == '-']
+        subtrahend = _tree(type(node), '+', negative)
+        if not positive:
+            return ir.Unary(operator=['-'], operand=subtrahend)
+        return type(node)(operator=['-'], operand=[_tree(type(node), '+', positive), subtrahend])
+    if isinstance(node, ir.MulDiv) and operators <= {'*', '/'} and float_division:
+        # a / b * c / d is (a * c) / (b * d), unless division truncates
+        factors = list(zip(('*', *node.operator), node.operand))
+        dividend = _tree(type(node), '*', [operand for operator, operand in factors if operator == '*'])
+        divisor = _tree(type(node), '*', [operand for operator, operand in factors if operator == '/'])
+        return type(node)(operator=['/'], operand=[dividend, divisor])
+    return node
+
+def balance(node: ir.Node, float_division=True) -> ir.Node:
+    """Reassociates chains of operations into balanced trees.
+
+    BinaryOp.c_expr evaluates a flattened chain from left to right, so its
+    critical path grows with every operand. This pass regroups chains of an
+    associative operator, sums and products of quotients so that n operands
+    take about log2(n) dependent operations. Regrouping changes the rounding
+    of floating-point results. Products of quotients are left alone when
+    division truncates, since a / b * c is not a * c / b in integers.
+
+    Args:
+        node: ir.Node to balance, flattened.
+        float_division: Whether '/' rounds rather than truncates.
+
+    Returns:
+        node: balanced ir.Node, which must not be flattened again.
+    """
+
+    def post_recursion(node, args=None):
+        if isinstance(node, ir.BinaryOp):
+            return _balance(node, float_division)
+        return node
+
+    if not isinstance(node, ir.Node):
+        return node
+
+    return node.visit(None, post_recursion=post_recursion)
+
+def depth(node: ir.Node, latency, var_depths) -> int:
+    """Latency of the longest chain of dependent operations in node.
+
+    Args:
+        node: ir.Node to measure.
+        latency: callable returning the latency of a binary operator or a
+            function name.
+        var_depths: dict of the depths of locals.
+
+    Returns:
+        Latency of node from its inputs.
+    """
+    if isinstance(node, ir.Var):
+        return var_depths.get(node.name, 0)
+    if isinstance(node, ir.BinaryOp):
+        result = depth(node.operand[0], latency, var_depths)
+        for operator, operand in zip(node.operator, node.operand[1:]):
+            result = max(result, depth(operand, latency, var_depths)) + latency(operator)
+        return result
+    if isinstance(node, ir.Unary):
+        return depth(node.operand, latency, var_depths)
+    if isinstance(node, ir.Operand):
+        for attr in ('call', 'ref', 'expr', 'var'):
+            if getattr(node, attr) is not None:
+                return depth(getattr(node, attr), latency, var_depths)
+        return 0
+    if isinstance(node, ir.Call):
+        return max(depth(arg, latency, var_depths) for arg in node.arg) + latency(node.name)
+    return 0
+
+def critical_path(local_stmts, output_expr, latency=None) -> int:
+    """Latency of the longest chain of dependent operations of a stencil kernel.
+
+    Args:
+        local_stmts: sequence of ir.LocalStmt.
+        output_expr: ir.Node of the output statement.
+        latency: callable returning the latency of a binary operator or a
+            function name; every operation takes 1 by default.
+
+    Returns:
+        Latency from the references to the output.
+    """
+    if latency is None:
+        latency = lambda operator: 1
+    var_depths = {}
+    for local_stmt in local_stmts:
+        var_depths[local_stmt.let.name] = depth(local_stmt.let.expr, latency, var_depths)
+    return depth(output_expr, latency, var_depths)
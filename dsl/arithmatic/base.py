@@ -1,22 +1,44 @@
 import functools
 import logging
+import math
+import re
+import struct
 
 from dsl import ir
 from dsl import utils
 
 _logger = logging.getLogger().getChild(__name__)
 
+_NUM_SUFFIX = re.compile(r'[FfLlUu]+$')
+
 def compose(*funcs):
     """Composes functions. The first function in funcs are invoked the first.
     """
     return functools.reduce(lambda g, f: lambda x: f(g(x)), funcs, lambda x: x)
 
-def flatten(node: ir.Node) -> ir.Node:
+def fixed_point(func, limit=16):
+    """Returns a function applying func until the result stops changing."""
+
+    def repeat(x):
+        for _ in range(limit):
+            y = func(x)
+            if str(y) == str(x):
+                return y
+            x = y
+        return x
+
+    return repeat
+
+def flatten(node: ir.Node, reassociate=False, float_division=True) -> ir.Node:
     """Flattens an node if possible.
 
         Flattens an node if it is:
             + a singleton BinaryOp; or
-            + a compound BinaryOp with reduction operators; or
+            + a compound BinaryOp with reduction operators, where a chain of
+              '+' or '*' is only merged into the left of the chain unless
+              reassociate, since float operations are evaluated from left to
+              right, and a chain with '%', or with '/' unless float_division,
+              never; or
             + a compound Operand; or
             + a Unary with an identity operator.
 
@@ -28,6 +50,9 @@ def flatten(node: ir.Node) -> ir.Node:
 
       Args:
             node: ir.Node to flatten.
+            reassociate: Whether operands of '+' and '*' may be regrouped.
+            float_division: Whether '/' rounds, so that a quotient may be
+                regrouped like a product; a truncating one may not.
 
       Returns:
             node: flattened ir.Node.
@@ -41,7 +66,7 @@ def flatten(node: ir.Node) -> ir.Node:
 
             # Flatten singleton BinaryOp
             if len(node.operand) == 1:
-                return flatten(node.operand[0])
+                return flatten(node.operand[0], reassociate, float_division)
 
             # Flatten BinaryOp with reduction operators
             new_operator, new_operand = [], []
@@ -51,15 +76,17 @@ def flatten(node: ir.Node) -> ir.Node:
                     new_operator.append(child_operator)
                 # The first operator can always be flattened if two operations has the
                 # same type.
-                if child_operator in (None, '||', '&&', *'|&+*') and \
-                        type(child_operand) is type(node):
+                if type(child_operand) is type(node) and \
+                        (child_operator in (None, '||', '&&', *'|&') or
+                         reassociate and child_operator in ('+', '*') and '%' not in child_operand.operator and
+                         (float_division or '/' not in child_operand.operator)):
                     new_operator.extend(child_operand.operator)
                     new_operand.extend(child_operand.operand)
                 else:
                     new_operand.append(child_operand)
                 # At least 1 operand is flattened.
             if len(new_operand) > len(node.operand):
-                return flatten(type(node)(operator=new_operator, operand=new_operand))
+                return flatten(type(node)(operator=new_operator, operand=new_operand), reassociate, float_division)
 
             # Flatten compound Operand
             if isinstance(node, ir.Operand):
@@ -67,7 +94,7 @@ def flatten(node: ir.Node) -> ir.Node:
                     val = getattr(node, attr)
                     if val is not None:
                         if isinstance(val, ir.Node):
-                            return flatten(val)
+                            return flatten(val, reassociate, float_division)
                         break
                 else:
                     raise utils.InternalError('undefined Operand')
@@ -78,7 +105,7 @@ def flatten(node: ir.Node) -> ir.Node:
                 val = getattr(node, attr)
                 if val is not None:
                     if isinstance(val, ir.Node):
-                        return flatten(val)
+                        return flatten(val, reassociate, float_division)
                     break
             else:
                 raise utils.InternalError('undefined Operand')
@@ -89,10 +116,10 @@ def flatten(node: ir.Node) -> ir.Node:
             if minus_count % 2 == 0:
                 plus_count = node.operator.count('+')
                 if plus_count + minus_count == len(node.operator):
-                    return flatten(node.operand)
+                    return flatten(node.operand, reassociate, float_division)
             not_count = node.operator.count('!')
             if not_count % 2 == 0 and not_count == len(node.operator):
-                return flatten(node.operand)
+                return flatten(node.operand, reassociate, float_division)
 
         return node
 
@@ -101,6 +128,235 @@ def flatten(node: ir.Node) -> ir.Node:
 
     return node.visit(visitor)
 
+def to_float32(value):
+    """Rounds value to float32, returns None if it is not a finite float32."""
+    try:
+        value = struct.unpack('f', struct.pack('f', value))[0]
+    except OverflowError:
+        return None
+    if not math.isfinite(value):
+        return None
+    return value
+
+def literal_value(node):
+    """Returns the float32 value of a literal Operand, or None for other nodes."""
+    if isinstance(node, ir.Operand) and node.num is not None:
+        return to_float32(float(_NUM_SUFFIX.sub('', str(node.num))))
+    return None
+
+def make_literal(value) -> ir.Operand:
+    """Makes a literal Operand of a float32 value, with the shortest decimal that rounds to it."""
+    if value == 0.0 and math.copysign(1.0, value) < 0:
+        # an integer literal would drop the sign
+        num = '-0.0'
+    elif value.is_integer():
+        num = str(int(value))
+    else:
+        num = next(num for num in ('%.*g' % (digits, value) for digits in range(1, 10))
+                   if to_float32(float(num)) == value)
+    return ir.Operand(call=None, ref=None, num=num, expr=None, var=None)
+
+def adds_negative_zero(sign, operand) -> bool:
+    """Whether a (sign, operand) term adds -0.0, the only zero that leaves every float sum unchanged."""
+    value = literal_value(operand)
+    return value == 0.0 and (math.copysign(1.0, value) < 0) == (sign == '+')
+
+def signed_terms(node: ir.AddSub):
+    """Returns the (sign, operand) terms of a flattened AddSub."""
+    return list(zip(('+', *node.operator), node.operand))
+
+def make_sum(node_type, terms):
+    """Builds node_type from (sign, operand) terms, the inverse of signed_terms."""
+    if not terms:
+        return make_literal(0.0)
+    sign, operand = terms[0]
+    if sign == '-':
+        value = literal_value(operand)
+        if value is not None:
+            operand = make_literal(-value)
+        else:
+            operand = ir.Unary(operator=['-'], operand=operand)
+    if len(terms) == 1:
+        return operand
+    return node_type(operator=[sign for sign, _ in terms[1:]],
+                     operand=[operand] + [operand for _, operand in terms[1:]])
+
+def fold_constants(node: ir.Node, reassociate=False) -> ir.Node:
+    """Evaluates arithmetic on literals.
+
+    Literals are float32 in the generated code, so they are folded with
+    float32 arithmetic:
+        + signs of a literal are applied to it;
+        + a leading run of literals of an AddSub or a MulDiv is folded, as C
+          evaluates it;
+        + with reassociate, which changes the rounding of results, the literal
+          terms of an AddSub are summed into the first of them, and the
+          literal factors and divisors of a MulDiv are multiplied into the
+          first factor and the first divisor.
+
+    Args:
+        node: ir.Node to fold, flattened.
+        reassociate: Whether literals may be regrouped across other operands.
+
+    Returns:
+        node: ir.Node with folded literals.
+    """
+
+    def post_recursion(node, args=None):
+        if isinstance(node, ir.Unary) and set(node.operator) <= set('+-'):
+            value = literal_value(node.operand)
+            if value is not None:
+                return make_literal(-value if node.operator.count('-') % 2 else value)
+
+        elif isinstance(node, ir.AddSub):
+            terms = signed_terms(node)
+            if reassociate:
+                terms, total, first = [], 0.0, None
+                for sign, operand in signed_terms(node):
+                    value = literal_value(operand)
+                    if value is None:
+                        terms.append((sign, operand))
+                        continue
+                    total = to_float32(total - value if sign == '-' else total + value)
+                    if total is None:
+                        return node
+                    if first is None:
+                        first = len(terms)
+                        terms.append(None)
+                if first is not None:
+                    terms[first] = (('-', make_literal(-total)) if total < 0 and first > 0
+                                    else ('+', make_literal(total)))
+            # fold a leading run of literals, as C evaluates it
+            while len(terms) > 1:
+                lhs, rhs = literal_value(terms[0][1]), literal_value(terms[1][1])
+                if lhs is None or rhs is None:
+                    break
+                value = to_float32(lhs - rhs if terms[1][0] == '-' else lhs + rhs)
+                if value is None:
+                    break
+                terms[:2] = [('+', make_literal(value))]
+            if len(terms) < len(node.operand):
+                return make_sum(type(node), terms)
+
+        elif isinstance(node, ir.MulDiv) and '%' not in node.operator:
+            factors = list(zip(('*', *node.operator), node.operand))
+            if reassociate:
+                factors, products = [], {}
+                for operator, operand in zip(('*', *node.operator), node.operand):
+                    value = literal_value(operand)
+                    if value is None:
+                        factors.append((operator, operand))
+                        continue
+                    if operator not in products:
+                        products[operator] = [len(factors), value]
+                        factors.append(None)
+                    else:
+                        products[operator][1] = to_float32(products[operator][1] * value)
+                        if products[operator][1] is None:
+                            return node
+                for operator, (position, value) in products.items():
+                    factors[position] = (operator, make_literal(value))
+            # fold a leading pair of literals, as C evaluates it
+            while len(factors) > 1:
+                lhs, rhs = literal_value(factors[0][1]), literal_value(factors[1][1])
+                if lhs is None or rhs is None or (factors[1][0] == '/' and rhs == 0.0):
+                    break
+                value = to_float32(lhs * rhs if factors[1][0] == '*' else lhs / rhs)
+                if value is None:
+                    break
+                factors[:2] = [('*', make_literal(value))]
+            if len(factors) < len(node.operand):
+                if len(factors) == 1:
+                    return factors[0][1]
+                return type(node)(operator=[operator for operator, _ in factors[1:]],
+                                  operand=[operand for _, operand in factors])
+
+        return node
+
+    if not isinstance(node, ir.Node):
+        return node
+
+    return node.visit(None, post_recursion=post_recursion)
+
+def apply_identities(node: ir.Node, reassociate=False) -> ir.Node:
+    """Removes operations that do not change a value.
+
+    Rewrites:
+        + x - 0 and x + -0.0 to x, but not x + 0 or 0 + x, which turn -0.0
+          into +0.0;
+        + x * 1, x / 1 and 1 * x to x;
+        + a leading x + x to x * 2;
+        + with reassociate, which changes the rounding of results, repeated
+          terms of an AddSub to a multiple, e.g. x + y + x to x * 2 + y,
+          terms that cancel out, and every zero term, which may change the
+          sign of a zero result.
+    The coefficient goes last so that a flattened x stays a prefix that can
+    be shared.
+
+    Args:
+        node: ir.Node to rewrite, flattened and folded.
+        reassociate: Whether terms may be merged across other operands.
+
+    Returns:
+        node: rewritten ir.Node.
+    """
+
+    def post_recursion(node, args=None):
+        if isinstance(node, ir.AddSub) and not reassociate:
+            terms = [term for term in signed_terms(node) if not adds_negative_zero(*term)]
+            if not terms:
+                return node
+            if len(terms) > 1 and terms[0][0] == terms[1][0] and \
+                    (type(terms[0][1]), terms[0][1]) == (type(terms[1][1]), terms[1][1]):
+                terms[:2] = [(terms[0][0], ir.MulDiv(operator=['*'], operand=[terms[0][1], make_literal(2.0)]))]
+            if len(terms) == len(node.operand):
+                return node
+            return make_sum(type(node), terms)
+
+        if isinstance(node, ir.AddSub):
+            coefficients, order = {}, []
+            for sign, operand in signed_terms(node):
+                if literal_value(operand) == 0.0:
+                    continue
+                key = (type(operand), operand)
+                if key not in coefficients:
+                    coefficients[key] = 0
+                    order.append(key)
+                coefficients[key] += -1 if sign == '-' else 1
+            if len(order) == len(node.operand):
+                return node
+            terms = []
+            for key in order:
+                coefficient, operand = coefficients[key], key[1]
+                if coefficient == 0:
+                    continue
+                if abs(coefficient) != 1:
+                    operand = ir.MulDiv(operator=['*'], operand=[operand, make_literal(float(abs(coefficient)))])
+                terms.append(('-' if coefficient < 0 else '+', operand))
+            return make_sum(type(node), terms)
+
+        if isinstance(node, ir.MulDiv):
+            factors = [(operator, operand)
+                       for operator, operand in zip(('*', *node.operator), node.operand)
+                       if operator == '%' or literal_value(operand) != 1.0]
+            if len(factors) == len(node.operand):
+                return node
+            if not factors:
+                return make_literal(1.0)
+            if factors[0][0] != '*':
+                factors.insert(0, ('*', make_literal(1.0)))
+            if len(factors) == 1:
+                return factors[0][1]
+            return type(node)(operator=[operator for operator, _ in factors[1:]],
+                              operand=[operand for _, operand in factors])
+
+        return node
+
+    if not isinstance(node, ir.Node):
+        return node
+
+    return node.visit(None, post_recursion=post_recursion)
+
 def print_tree(node, printer=_logger.debug):
     """Prints the node type as a tree.
 
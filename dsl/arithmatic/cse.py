@@ -0,0 +1,186 @@
+import collections
+import copy
+import itertools
+import logging
+
+from dsl import ir
+
+_logger = logging.getLogger().getChild(__name__)
+
+def _children(node: ir.Node):
+    for attr in node.SCALAR_ATTRS:
+        child = getattr(node, attr)
+        if isinstance(child, ir.Node):
+            yield child
+    for attr in node.LINEAR_ATTRS:
+        for child in getattr(node, attr):
+            if isinstance(child, ir.Node):
+                yield child
+
+def _subtrees(node: ir.Node):
+    """Yields node and all nodes below it in pre-order."""
+    yield node
+    for child in _children(node):
+        yield from _subtrees(child)
+
+def _size(node: ir.Node) -> int:
+    return sum(1 for _ in _subtrees(node))
+
+def _key(node: ir.Node):
+    # ir.Node.__eq__ ignores the node type, e.g. AddSub and MulDiv with equal
+    # operands and operators
+    return type(node), node
+
+def _is_computation(node: ir.Node) -> bool:
+    """Whether node costs an operator in the generated kernel."""
+    if isinstance(node, ir.BinaryOp):
+        return len(node.operand) > 1
+    return isinstance(node, ir.Call)
+
+def _is_alias(node: ir.Node) -> bool:
+    """Whether a local defined as node only renames a value."""
+    if isinstance(node, ir.Operand):
+        return node.num is not None
+    return isinstance(node, (ir.Ref, ir.Var))
+
+def _prefixes(node: ir.Node):
+    """Yields the leading operations of a flattened BinaryOp, e.g. a + b of a + b + c.
+
+    Operations are evaluated from left to right, so a prefix is a value of its
+    own that other expressions may share.
+    """
+    if isinstance(node, ir.BinaryOp):
+        for i in range(2, len(node.operand)):
+            yield type(node)(operator=node.operator[:i - 1], operand=node.operand[:i])
+
+def _candidates(node: ir.Node):
+    for subtree in _subtrees(node):
+        if _is_computation(subtree):
+            yield subtree
+            yield from _prefixes(subtree)
+
+def _replace(node: ir.Node, replacements: dict) -> ir.Node:
+    def visitor(node, args=None):
+        if isinstance(node, ir.Node) and _key(node) in replacements:
+            return replacements[_key(node)]
+        for prefix in _prefixes(node):
+            if _key(prefix) in replacements:
+                count = len(prefix.operand)
+                return type(node)(operator=node.operator[count - 1:],
+                                  operand=(replacements[_key(prefix)],) + node.operand[count:])
+        return None
+
+    return node.visit(visitor)
+
+def shift_refs(node: ir.Node, offset: tuple) -> ir.Node:
+    """Adds offset to the index of every reference in node."""
+
+    def visitor(node, args=None):
+        if isinstance(node, ir.Ref):
+            node.idx = tuple(i + j for i, j in zip(node.idx, offset))
+            return node
+        return None
+
+    return node.visit(visitor)
+
+def eliminate(local_stmts, output_expr, output_idx):
+    """Eliminates common subexpressions of a stencil.
+
+    Every computation that appears more than once among the locals and the
+    output, including leading operations of a flattened BinaryOp, is evaluated
+    once into a local, largest first. A computation equal
+    to a preceding local is replaced by that local. Afterwards locals that only
+    rename a reference, a local or a literal are propagated into their uses,
+    and locals that are not used are removed.
+
+    Locals reference the grid relative to the origin while the output
+    references it relative to output_idx, so the output is shifted into the
+    frame of the locals while subexpressions are moved between them.
+
+    Args:
+        local_stmts: sequence of ir.LocalStmt, which are not modified.
+        output_expr: ir.Node of the output statement.
+        output_idx: index of the output reference.
+
+    Returns:
+        (local_stmts, output_expr) with common subexpressions eliminated.
+    """
+    # a statement is [name, expr], the output has no name; equal subtrees are
+    # shared so that counting them compares identities
+    table = {}
+    stmts = [[stmt.let.name, ir.intern(stmt.let.expr, table)] for stmt in local_stmts]
+    stmts.append([None, ir.intern(shift_refs(output_expr, tuple(-i for i in output_idx)), table)])
+
+    used_names = set(name for name, _ in stmts)
+    for _, expr in stmts:
+        used_names.update(node.name for node in _subtrees(expr) if isinstance(node, (ir.Ref, ir.Var)))
+    new_names = ('cse%d' % i for i in itertools.count())
+
+    while True:
+        counts = collections.Counter()
+        order = []
+        for _, expr in stmts:
+            for node in _candidates(expr):
+                if _key(node) not in counts:
+                    order.append(node)
+                counts[_key(node)] += 1
+        repeated = [node for node in order if counts[_key(node)] > 1]
+        if not repeated:
+            break
+        target = max(repeated, key=_size)
+
+        first = next(i for i, (_, expr) in enumerate(stmts)
+                     if any(_key(node) == _key(target) for node in _candidates(expr)))
+        if stmts[first][0] is not None and _key(stmts[first][1]) == _key(target):
+            name = stmts[first][0]
+            first += 1
+        else:
+            name = next(name for name in new_names if name not in used_names)
+            used_names.add(name)
+            stmts.insert(first, [name, target])
+            first += 1
+        _logger.debug('evaluate %s once as %s', target, name)
+        replacements = {_key(target): ir.Var(name=name)}
+        for stmt in stmts[first:]:
+            stmt[1] = _replace(stmt[1], replacements)
+
+    # propagate aliases
+    i = 0
+    while i < len(stmts) - 1:
+        name, expr = stmts[i]
+        if _is_alias(expr):
+            _logger.debug('propagate %s = %s', name, expr)
+            del stmts[i]
+            replacements = {_key(ir.Var(name=name)): expr}
+            for stmt in stmts[i:]:
+                stmt[1] = _replace(stmt[1], replacements)
+        else:
+            i += 1
+
+    # remove unused locals
+    live = set()
+    for stmt in reversed(stmts):
+        name, expr = stmt
+        if name is not None and name not in live:
+            _logger.debug('remove unused local %s', name)
+            stmt[1] = None
+            continue
+        live.update(node.name for node in _subtrees(expr) if isinstance(node, ir.Var))
+
+    result = []
+    local_by_name = {stmt.let.name: stmt for stmt in local_stmts}
+    for name, expr in stmts[:-1]:
+        if expr is None:
+            continue
+        stmt = local_by_name.get(name)
+        if stmt is not None and stmt.let.expr is expr:
+            result.append(stmt)
+            continue
+        if stmt is not None:
+            stmt = copy.copy(stmt)
+            stmt.let = copy.copy(stmt.let)
+            stmt.let.expr = expr
+        else:
+            stmt = ir.LocalStmt(let=ir.Let(name=name, expr=expr))
+        result.append(stmt)
+    return result, shift_refs(stmts[-1][1], tuple(output_idx))
@@ -0,0 +1,110 @@
+import logging
+import math
+
+from dsl import ir
+from dsl.arithmatic import base
+
+_logger = logging.getLogger().getChild(__name__)
+
+def _exponent(value):
+    """Returns k if value is 2**k, or None."""
+    if value is None or value <= 0:
+        return None
+    mantissa, exponent = math.frexp(value)
+    if mantissa != 0.5:
+        return None
+    return exponent - 1
+
+def _call(name, *args) -> ir.Call:
+    return ir.Call(name=name, arg=args)
+
+def _ldexpf(node: ir.Node, exponent: int) -> ir.Call:
+    """x * 2**exponent, which only adjusts the exponent bits and costs no multiplier."""
+    exponent_arg = base.make_literal(float(exponent))
+    exponent_arg.num_c_type = 'int'
+    return _call('ldexpf', node, exponent_arg)
+
+def _negate(node: ir.Node) -> ir.Node:
+    value = base.literal_value(node)
+    if value is not None:
+        return base.make_literal(-value)
+    return ir.Unary(operator=['-'], operand=node)
+
+def _is_product(node: ir.Node) -> bool:
+    return isinstance(node, ir.MulDiv) and tuple(node.operator) == ('*',)
+
+def _lower_mul_div(node: ir.MulDiv, fast_math: bool) -> ir.Node:
+    operands, operators = [node.operand[0]], []
+
+    def chain():
+        if len(operands) == 1:
+            return operands[0]
+        return type(node)(operator=operators, operand=operands)
+
+    factors = list(zip(node.operator, node.operand[1:]))
+    # 2**k * x is x * 2**k
+    exponent = _exponent(base.literal_value(operands[0]))
+    if exponent is not None and factors and factors[0][0] == '*':
+        operands[0] = _ldexpf(factors[0][1], exponent)
+        factors = factors[1:]
+
+    for operator, operand in factors:
+        value = base.literal_value(operand)
+        exponent = _exponent(value)
+        if operator in '*/' and exponent is not None:
+            head = _ldexpf(chain(), exponent if operator == '*' else -exponent)
+            operands[:], operators[:] = [head], []
+            continue
+        if operator == '/' and fast_math and value:
+            reciprocal = base.to_float32(1.0 / value)
+            if reciprocal is not None:
+                _logger.debug('multiply by the reciprocal of %s', operand)
+                operator, operand = '*', base.make_literal(reciprocal)
+        operators.append(operator)
+        operands.append(operand)
+    return chain()
+
+def _lower_add_sub(node: ir.AddSub) -> ir.Node:
+    terms = base.signed_terms(node)
+    products = [(sign, operand) for sign, operand in terms if _is_product(operand)]
+    if not products:
+        return node
+    others = [(sign, operand) for sign, operand in terms if not _is_product(operand)]
+    if others:
+        result = base.make_sum(type(node), others)
+    else:
+        result = base.make_sum(type(node), products[:1])
+        products = products[1:]
+    for sign, product in products:
+        lhs, rhs = product.operand
+        result = _call('fmaf', _negate(lhs) if sign == '-' else lhs, rhs, result)
+    return result
+
+def lower(node: ir.Node, fast_math=False) -> ir.Node:
+    """Lowers arithmetic to cheaper operators of the kernel.
+
+    Always rewrites multiplication and division by a power of two to ldexpf,
+    which is exact. With fast_math, which changes the rounding of results:
+        + division by a literal becomes multiplication by its reciprocal;
+        + the products of an AddSub are accumulated with fmaf, a fused
+          multiply-add that maps to a DSP cascade.
+
+    Args:
+        node: ir.Node to lower, simplified with algebraic identities.
+        fast_math: Whether rewrites may change rounding.
+
+    Returns:
+        node: lowered ir.Node.
+    """
+
+    def post_recursion(node, args=None):
+        if isinstance(node, ir.MulDiv) and '%' not in node.operator:
+            node = _lower_mul_div(node, fast_math)
+        if fast_math and isinstance(node, ir.AddSub):
+            node = _lower_add_sub(node)
+        return node
+
+    if not isinstance(node, ir.Node):
+        return node
+
+    return node.visit(None, post_recursion=post_recursion)
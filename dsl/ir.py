@@ -4,6 +4,15 @@ from dsl import utils
 
 class Node():
     """A immutable, hashable IR node.
+
+    The structural hash of a node is computed once and cached, which also
+    caches the hashes of its children. A hashed node is frozen, setting an
+    attribute raises, so no cached hash goes stale. Nodes are shared between
+    trees, so they must only be modified through copies, as Node.visit hands
+    them to callbacks; copies drop the cached hash.
+
+    Nodes cannot use __slots__: textX sets attributes of its own, e.g. parent
+    and _tx_position, on the objects it creates from the classes of the DSL.
     """
     SCALAR_ATTRS = ()
     LINEAR_ATTRS = ()
@@ -18,17 +27,37 @@ class Node():
         for attr in self.LINEAR_ATTRS:
             setattr(self, attr, tuple(kwargs.pop(attr)))
 
+    def __setattr__(self, name, value):
+        if '_hash' in self.__dict__:
+            raise utils.InternalError('cannot set %s of a hashed %s, modify a copy' % (name, type(self).__name__))
+        super().__setattr__(name, value)
+
+    def __getstate__(self):
+        # used by copy and pickle, a copy is hashed again once it is complete
+        return {key: value for key, value in self.__dict__.items() if key != '_hash'}
+
     def __hash__(self):
-        return hash((tuple(getattr(self, _) for _ in self.SCALAR_ATTRS),
-                 tuple(tuple(getattr(self, _)) for _ in self.LINEAR_ATTRS)))
+        try:
+            return self.__dict__['_hash']
+        except KeyError:
+            pass
+        # set through __dict__, which keeps it
+        self.__dict__['_hash'] = hash((tuple(getattr(self, _) for _ in self.SCALAR_ATTRS),
+                                       tuple(tuple(getattr(self, _)) for _ in self.LINEAR_ATTRS)))
+        return self.__dict__['_hash']
 
     def __eq__(self, other):
+        if self is other:
+            return True
+        # nodes with the same attributes are only equal if their hashes are,
+        # which are computed from frozen nodes only
+        if (isinstance(other, Node) and self.SCALAR_ATTRS == other.SCALAR_ATTRS and
+                self.LINEAR_ATTRS == other.LINEAR_ATTRS and hash(self) != hash(other)):
+            return False
         return all(hasattr(other, attr) and
                getattr(self, attr) == getattr(other, attr)
                for attr in self.ATTRS)
 
-
-
     def visit(self, callback, args=None, pre_recursion=None, post_recursion=None):
         """A general-purpose, flexible, and powerful visitor.
 
@@ -44,6 +73,11 @@ class Node():
         If the same object is returned by the callback, if any attribute is
         changed, it will not be recursively visited. If an attribute is unchanged,
         it will be recursively visited.
+
+        Without a callback, or if the callback leaves the copy as it is, a node
+        whose children are unchanged is returned itself rather than a copy, so
+        unchanged subtrees are shared with self. pre_recursion and
+        post_recursion therefore receive nodes of self and must not modify them.
         """
 
         def callback_wrapper(callback, obj, args):
@@ -54,21 +88,33 @@ class Node():
                 return result
             return obj
 
-        self_copy = copy.copy(self)
-        obj = callback_wrapper(callback, self_copy, args)
-        if obj is not self_copy:
-            return obj
-        self_copy = callback_wrapper(pre_recursion, copy.copy(self), args)
-        scalar_attrs = {attr: getattr(self_copy, attr).visit(
+        obj = self
+        if callback is not None:
+            self_copy = copy.copy(self)
+            obj = callback_wrapper(callback, self_copy, args)
+            if obj is not self_copy:
+                return obj
+            if _same_attrs(obj, self):
+                obj = self
+        source = callback_wrapper(pre_recursion, self, args)
+        scalar_attrs = {attr: getattr(source, attr).visit(
             callback, args, pre_recursion, post_recursion)
-                    if isinstance(getattr(self_copy, attr), Node)
-                    else getattr(self_copy, attr)
-                    for attr in self_copy.SCALAR_ATTRS}
+                    if isinstance(getattr(source, attr), Node)
+                    else getattr(source, attr)
+                    for attr in source.SCALAR_ATTRS}
         linear_attrs = {attr: tuple(_.visit(
             callback, args, pre_recursion, post_recursion)
                                 if isinstance(_, Node) else _
-                                for _ in getattr(self_copy, attr))
-                    for attr in self_copy.LINEAR_ATTRS}
+                                for _ in getattr(source, attr))
+                    for attr in source.LINEAR_ATTRS}
+
+        def update(attr, value):
+            nonlocal obj
+            if value is getattr(obj, attr):
+                return
+            if obj is self:
+                obj = copy.copy(self)
+            setattr(obj, attr, value)
 
         for attr in self.SCALAR_ATTRS:
         # old attribute may not exist in mutated object
@@ -76,19 +122,60 @@ class Node():
                 continue
             if getattr(obj, attr) is getattr(self, attr):
                 if isinstance(getattr(obj, attr), Node):
-                    setattr(obj, attr, scalar_attrs[attr])
+                    update(attr, scalar_attrs[attr])
         for attr in self.LINEAR_ATTRS:
         # old attribute may not exist in mutated object
             if not hasattr(obj, attr):
                 continue
-            setattr(obj, attr, tuple(
+            values = tuple(
                 c if a is b and isinstance(a, Node) else a
                 for a, b, c in zip(getattr(obj, attr), getattr(self, attr),
-                             linear_attrs[attr])))
+                             linear_attrs[attr]))
+            if any(a is not b for a, b in zip(values, getattr(obj, attr))):
+                update(attr, values)
         return callback_wrapper(post_recursion, obj, args)
 
+def _same_attrs(node, other):
+    '''Whether two nodes hold the same objects, apart from their cached hashes'''
+    attrs = {key: value for key, value in node.__dict__.items() if key != '_hash'}
+    other_attrs = {key: value for key, value in other.__dict__.items() if key != '_hash'}
+    return attrs.keys() == other_attrs.keys() and all(value is other_attrs[key] for key, value in attrs.items())
+
+def _intern_key(node):
+    # attributes set on copies, e.g. num_c_type, tell apart otherwise equal
+    # nodes; parent and the attributes of textX start with _ or are ignored
+    extra = tuple(sorted((key, value) for key, value in node.__dict__.items()
+                         if key not in node.ATTRS and key != 'parent' and not key.startswith('_')))
+    return type(node), node, extra
+
+def intern(node, table=None):
+    """Replaces structurally equal subtrees of node with one shared node.
+
+    Equal nodes are then identical, so looking them up in a dict or a set
+    compares them by identity instead of recursively.
+
+    Args:
+        node: Node to intern.
+        table: dict of the shared nodes, to share them between several trees.
+
+    Returns:
+        node: Node with shared subtrees, node itself if it has none.
+    """
+    if table is None:
+        table = {}
+
+    def post_recursion(node, args=None):
+        return table.setdefault(_intern_key(node), node)
+
+    if not isinstance(node, Node):
+        return node
+
+    return node.visit(None, post_recursion=post_recursion)
+
 class Let(Node):
     SCALAR_ATTRS = 'name', 'expr'
+    # set on copies by the kernel generator for non-float stencils
+    c_type = 'float'
 
     def __str__(self):
         result = '{} = {}'.format(self.name, self.expr)
@@ -96,7 +183,7 @@ class Let(Node):
 
     @property
     def c_expr(self):
-        return 'const {} {} = {};'.format('float', self.name, self.expr.c_expr)
+        return 'const {} {} = {};'.format(self.c_type, self.name, self.expr.c_expr)
 
 class Ref(Node):
     SCALAR_ATTRS = ('name',)
@@ -179,6 +266,8 @@ class Unary(Node):
 
 class Operand(Node):
     SCALAR_ATTRS = 'call', 'ref', 'num', 'expr', 'var'
+    # set on copies by the kernel generator for non-float stencils
+    num_c_type = 'float'
 
     def __str__(self):
         for attr in ('call', 'ref', 'num', 'var'):
@@ -193,7 +282,7 @@ class Operand(Node):
             if attr == 'num':
                 attr = getattr(self, attr)
                 if attr is not None:
-                    return '(float)' + str(attr)
+                    return '({})'.format(self.num_c_type) + str(attr)
             else:
                 attr = getattr(self, attr)
                 if attr is not None:
@@ -243,14 +332,14 @@ class ScalarStmt(Node):
         return result
 
 class InputStmt(Node):
-    SCALAR_ATTRS = ('name', )
+    SCALAR_ATTRS = ('name', 'type')
     LINEAR_ATTRS = ('size', )
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
     def __str__(self):
-        result = 'input float: {}'.format(self.name)
+        result = 'input {}: {}'.format(self.type or 'float', self.name)
         if self.size:
             result += '[{}]'.format(', '.join(map(str, self.size)))
         return result
@@ -262,17 +351,17 @@ class LocalStmt(Node):
         return str(self.let)
 
 class OutputStmt(Node):
-    SCALAR_ATTRS = 'ref', 'expr'
+    SCALAR_ATTRS = 'ref', 'expr', 'type'
 
     @property
     def name(self):
         return self.ref.name
 
     def __str__(self):
-        return 'output float: {} = {}'.format(self.ref, self.expr)
+        return 'output {}: {} = {}'.format(self.type or 'float', self.ref, self.expr)
 
 class Program(Node):
-    SCALAR_ATTRS = ('iterate', 'app_name', 'kernel_count', 'repeat_count', 'output_stmt', 'boarder_type')
+    SCALAR_ATTRS = ('iterate', 'app_name', 'kernel_count', 'repeat_count', 'width', 'output_stmt', 'boarder_type')
     LINEAR_ATTRS = ('scalar_stmts', 'input_stmts', 'local_stmts')
 
     def __init__(self, **kwargs):
@@ -287,6 +376,7 @@ class Program(Node):
             'boarder type: {}'.format(self.boarder_type),
             'kernel count: {}'.format(self.kernel_count),
             'repeat count: {}'.format(self.repeat_count),
+            'width: {}'.format(self.width) if self.width else None,
             'size: {}'.format(self.size),
             '\n'.join(map(str, self.scalar_stmts)),
             '\n'.join(map(str, self.input_stmts)),
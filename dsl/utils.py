@@ -18,7 +18,19 @@ def parenthesize(expr) -> str:
 
 def unparenthesize(expr) -> str:
     expr_str = str(expr)
-    while expr_str.startswith('(') and expr_str.endswith(')'):
+    while expr_str.startswith('(') and expr_str.endswith(')') and _enclosed(expr_str):
         expr_str = expr_str[1:-1]
     return expr_str
 
+def _enclosed(expr_str: str) -> bool:
+    """Whether the first parenthesis of expr_str matches the last one, unlike in '(a) * (b)'."""
+    depth = 0
+    for char in expr_str[:-1]:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return False
+    return True
+
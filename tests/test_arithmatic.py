@@ -0,0 +1,133 @@
+'''Tests of the arithmetic passes over the IR of stencil kernels'''
+import math
+
+import pytest
+
+import core
+import dsl
+from dsl import arithmatic
+from dsl.arithmatic import base
+
+
+def parse(expr):
+    '''Parsed output expression of a program on inputs a and b, before analysis'''
+    program = '''KERNEL: T
+COUNT: 1
+ITERATE: 1
+input float a(32, 32)
+input float b(32, 32)
+output float y(0, 0) = %s
+''' % expr
+    return dsl.metamodel().model_from_str(program).output_stmt.expr
+
+
+def output_expr(expr, type_='float', **options):
+    '''c_expr of the output of a one-statement stencil on inputs a and b, after analysis'''
+    program = '''KERNEL: T
+COUNT: 1
+ITERATE: 1
+input %s a(32, 32)
+input %s b(32, 32)
+output %s y(0, 0) = %s
+''' % (type_, type_, type_, expr)
+    stencil = core.stencil_from_program(dsl.metamodel().model_from_str(program), **options)
+    return stencil.output_stmt.expr.c_expr
+
+
+@pytest.mark.parametrize('type_', ['int32', 'fixed<16,8>'])
+def test_reassociate_keeps_truncating_quotients(type_):
+    assert output_expr('a(0, 0) / b(0, 0) * a(0, 1) / b(0, 1)', type_, reassociate=True) == \
+        '(a / b * a / b)'
+    assert output_expr('a(0, 0) * (b(0, 0) / a(0, 1)) * b(0, 1)', type_, reassociate=True) == \
+        '((a * (b / a)) * b)'
+
+
+def test_reassociate_regroups_float_quotients():
+    assert output_expr('a(0, 0) / b(0, 0) * a(0, 1) / b(0, 1)', reassociate=True) == '((a * a) / (b * b))'
+
+
+@pytest.mark.parametrize('type_', ['float', 'int32'])
+def test_reassociate_keeps_remainders(type_):
+    assert output_expr('a(0, 0) * (b(0, 0) % a(0, 1))', type_, reassociate=True) == '(a * (b % a))'
+
+
+@pytest.mark.parametrize('expr, flat, regrouped', [
+    ('a(0, 0) + (b(0, 0) + a(0, 1))', '(a(0, 0) + (b(0, 0) + a(0, 1)))', '(a(0, 0) + b(0, 0) + a(0, 1))'),
+    ('(a(0, 0) + b(0, 0)) + a(0, 1)', '(a(0, 0) + b(0, 0) + a(0, 1))', '(a(0, 0) + b(0, 0) + a(0, 1))'),
+    ('a(0, 0) - (b(0, 0) + a(0, 1))', '(a(0, 0) - (b(0, 0) + a(0, 1)))', '(a(0, 0) - (b(0, 0) + a(0, 1)))'),
+])
+def test_flatten(expr, flat, regrouped):
+    assert str(arithmatic.simplify(parse(expr), algebraic=True)) == flat
+    assert str(arithmatic.simplify(parse(expr), algebraic=True, reassociate=True)) == regrouped
+
+
+@pytest.mark.parametrize('expr, folded, regrouped', [
+    ('2 * 3 + a(0, 0)', '(6 + a(0, 0))', '(6 + a(0, 0))'),
+    ('a(0, 0) + 2 * 3', '(a(0, 0) + 6)', '(a(0, 0) + 6)'),
+    ('a(0, 0) + 1 + 2', '(a(0, 0) + 1 + 2)', '(a(0, 0) + 3)'),
+    ('2 * a(0, 0) * 3', '(2 * a(0, 0) * 3)', '(6 * a(0, 0))'),
+    ('a(0, 0) / 0', '(a(0, 0) / 0)', '(a(0, 0) / 0)'),
+])
+def test_fold_constants(expr, folded, regrouped):
+    assert str(base.fold_constants(base.flatten(parse(expr)))) == folded
+    assert str(base.fold_constants(base.flatten(parse(expr), True), True)) == regrouped
+
+
+@pytest.mark.parametrize('expr, rewritten, regrouped', [
+    ('a(0, 0) * 1 - 0', 'a(0, 0)', 'a(0, 0)'),
+    ('a(0, 0) / 1 + b(0, 0)', '(a(0, 0) + b(0, 0))', '(a(0, 0) + b(0, 0))'),
+    ('a(0, 0) + a(0, 0) + b(0, 0)', '((a(0, 0) * 2) + b(0, 0))', '((a(0, 0) * 2) + b(0, 0))'),
+    ('a(0, 0) + b(0, 0) + a(0, 0)', '(a(0, 0) + b(0, 0) + a(0, 0))', '((a(0, 0) * 2) + b(0, 0))'),
+    ('a(0, 0) + b(0, 0) - a(0, 0)', '(a(0, 0) + b(0, 0) - a(0, 0))', 'b(0, 0)'),
+    ('a(0, 0) % 1', '(a(0, 0) % 1)', '(a(0, 0) % 1)'),
+    # -0.0 + 0 is +0.0, so only adding -0.0 is an identity
+    ('a(0, 0) + 0', '(a(0, 0) + 0)', 'a(0, 0)'),
+    ('0 + a(0, 0)', '(0 + a(0, 0))', 'a(0, 0)'),
+    ('-0 + a(0, 0)', 'a(0, 0)', 'a(0, 0)'),
+    ('a(0, 0) + 0 * -1', 'a(0, 0)', 'a(0, 0)'),
+])
+def test_apply_identities(expr, rewritten, regrouped):
+    assert str(arithmatic.simplify(parse(expr), algebraic=True)) == rewritten
+    assert str(arithmatic.simplify(parse(expr), algebraic=True, reassociate=True)) == regrouped
+
+
+def test_fold_keeps_negative_zero():
+    folded = base.fold_constants(base.flatten(parse('0 * -1')))
+    assert str(folded) == '-0.0'
+    assert math.copysign(1.0, base.literal_value(folded)) < 0
+
+
+def test_eliminate_common_subexpressions():
+    expr = arithmatic.simplify(parse('(a(0, 0) + b(0, 0)) * (a(0, 0) + b(0, 0)) + a(0, 0) * b(0, 1)'), True)
+    local_stmts, output_expr = arithmatic.eliminate_common_subexpressions([], expr, (0, 0))
+    assert [str(stmt) for stmt in local_stmts] == ['cse0 = (a(0, 0) + b(0, 0))']
+    assert str(output_expr) == '((cse0 * cse0) + (a(0, 0) * b(0, 1)))'
+
+
+def test_eliminate_shifted_subexpressions():
+    expr = arithmatic.simplify(parse('a(1, 0) * b(1, 0) + a(1, 0) * b(1, 0) * 3'), True)
+    local_stmts, output_expr = arithmatic.eliminate_common_subexpressions([], expr, (1, 0))
+    # locals reference the grid relative to the origin, the output relative to its index
+    assert [str(stmt) for stmt in local_stmts] == ['cse0 = (a(0, 0) * b(0, 0))']
+    assert str(output_expr) == '(cse0 + (cse0 * 3))'
+
+
+@pytest.mark.parametrize('expr, lowered, fast', [
+    ('a(0, 0) * 4', 'ldexpf(a(0, 0), 2)', 'ldexpf(a(0, 0), 2)'),
+    ('a(0, 0) / 4', 'ldexpf(a(0, 0), -2)', 'ldexpf(a(0, 0), -2)'),
+    ('a(0, 0) / 3', '(a(0, 0) / 3)', '(a(0, 0) * 0.33333334)'),
+    ('a(0, 0) * b(0, 0) + 1', '((a(0, 0) * b(0, 0)) + 1)', 'fmaf(a(0, 0), b(0, 0), 1)'),
+])
+def test_lower(expr, lowered, fast):
+    expr = arithmatic.simplify(parse(expr), True)
+    # calls are printed with spaces around their names
+    assert str(arithmatic.lower(expr)).strip().replace(' (', '(') == lowered
+    assert str(arithmatic.lower(expr, fast_math=True)).strip().replace(' (', '(') == fast
+
+
+def test_balance():
+    expr = base.flatten(parse('a(0, 0) + b(0, 0) + a(1, 0) + b(1, 0) - a(0, 1) - b(0, 1)'))
+    balanced = arithmatic.balance(expr)
+    assert str(balanced) == '(((a(0, 0) + b(0, 0)) + (a(1, 0) + b(1, 0))) - (a(0, 1) + b(0, 1)))'
+    assert arithmatic.critical_path([], expr) == 5
+    assert arithmatic.critical_path([], balanced) == 3
@@ -0,0 +1,55 @@
+'''Tests of the in-memory code generation'''
+import os
+
+import pytest
+
+import codegen
+import core
+import dsl
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+
+PROGRAM = '''KERNEL: T
+COUNT: 2
+ITERATE: 4
+BOARDER: %s
+input float x(64, 64)
+output float y(0, 0) = x(-1, 0) + x(0, 0) + x(1, 0)
+'''
+
+
+@pytest.mark.parametrize('border, kernels', [
+    ('overlap', ['unikernel.cpp']),
+    ('streaming', ['upkernel.cpp', 'midkernel.cpp', 'downkernel.cpp']),
+])
+def test_generate_files(border, kernels):
+    artifacts = codegen.generate(PROGRAM % border)
+    assert sorted(artifacts) == sorted(['T.h', 'host.cpp', 'hbm_config.h', 'settings.cfg'] + kernels)
+    assert all(isinstance(text, str) and text for text in artifacts.values())
+
+
+def test_generate_is_deterministic():
+    with open(os.path.join(TESTS, 'soda', 'jacobi2d.dsl')) as file:
+        text = file.read()
+    stencil = core.stencil_from_program(dsl.metamodel().model_from_str(text))
+    assert codegen.generate(text) == codegen.generate(text) == codegen.generate(stencil)
+
+
+def test_generate_options():
+    default = codegen.generate(PROGRAM % 'overlap')
+    binary = codegen.generate(PROGRAM % 'overlap', data_format='binary')
+    assert default['unikernel.cpp'] == binary['unikernel.cpp']
+    assert default['host.cpp'] != binary['host.cpp']
+    stencil = core.stencil_from_program(dsl.metamodel().model_from_str(PROGRAM % 'overlap'))
+    with pytest.raises(TypeError):
+        codegen.generate(stencil, data_format='binary')
+
+
+def test_write_artifacts(tmp_path):
+    artifacts = codegen.generate(PROGRAM % 'overlap')
+    key = codegen.fingerprint(PROGRAM % 'overlap', {})
+    assert sorted(codegen.write_artifacts(artifacts, str(tmp_path), key)) == sorted(artifacts)
+    assert codegen.is_current(str(tmp_path), key)
+    assert codegen.write_artifacts(artifacts, str(tmp_path), key) == []
+    (tmp_path / 'host.cpp').write_text('')
+    assert not codegen.is_current(str(tmp_path), key)
@@ -0,0 +1,117 @@
+'''Checks of the generated host code, against stand-ins of the vendor headers where it needs them'''
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+import codegen
+from codegen import host_codes
+from core import dtype
+from core import reference
+
+# just enough of the Xilinx runtime and HLS headers for g++ -fsyntax-only
+SHIMS = {
+    'CL/cl_ext_xilinx.h': '',
+    'ap_int.h': '#pragma once\ntemplate<int N> struct ap_uint {};\ntemplate<int N> struct ap_int {};\n',
+    'ap_fixed.h': '#pragma once\ntemplate<int W, int I> struct ap_fixed {};\n',
+    'hls_half.h': '#pragma once\ntypedef short half;\n',
+    'ap_axi_sdata.h': '#pragma once\n#include "ap_int.h"\n'
+                      'template<int D, int U, int I, int E> struct ap_axiu { ap_uint<D> data; };\n',
+    'xcl2.hpp': '''#pragma once
+#include <cstddef>
+#include <memory>
+#include <string>
+#include <utility>
+#include <vector>
+typedef int cl_int;
+enum { CL_SUCCESS, CL_DEVICE_NAME, CL_MEM_EXT_PTR_XILINX, CL_MEM_READ_WRITE, CL_MEM_READ_ONLY, CL_MEM_WRITE_ONLY,
+       CL_MEM_USE_HOST_PTR, CL_MIGRATE_MEM_OBJECT_HOST, CL_QUEUE_OUT_OF_ORDER_EXEC_MODE_ENABLE,
+       CL_QUEUE_PROFILING_ENABLE, XCL_MEM_TOPOLOGY = 1 << 31 };
+#define OCL_CHECK(error, call) call
+struct cl_mem_ext_ptr_t { unsigned flags; void *obj; void *param; };
+template<class T> struct aligned_allocator : std::allocator<T> {
+    template<class U> struct rebind { typedef aligned_allocator<U> other; };
+    aligned_allocator() = default;
+    template<class U> aligned_allocator(const aligned_allocator<U> &) {}
+};
+namespace cl {
+struct Device { template<int N> std::string getInfo() const { return ""; } };
+struct Context { Context() {} Context(const Device &, void *, void *, void *, cl_int *) {} };
+struct Buffer { Buffer(const Context &, int, std::size_t, void *, cl_int *) {} };
+struct Program {
+    typedef std::vector<std::pair<const void *, std::size_t> > Binaries;
+    Program() {}
+    Program(const Context &, const std::vector<Device> &, const Binaries &, void *, cl_int *) {}
+};
+struct Kernel {
+    Kernel(const Program &, const char *, cl_int *) {}
+    template<class T> cl_int setArg(int, const T &) { return CL_SUCCESS; }
+};
+struct CommandQueue {
+    CommandQueue() {}
+    CommandQueue(const Context &, const Device &, int, cl_int *) {}
+    cl_int enqueueMigrateMemObjects(const std::vector<Buffer> &, int) { return CL_SUCCESS; }
+    cl_int enqueueTask(const Kernel &) { return CL_SUCCESS; }
+    cl_int finish() { return CL_SUCCESS; }
+};
+}
+namespace xcl {
+std::vector<cl::Device> get_xil_devices();
+std::vector<unsigned char> read_binary_file(const std::string &);
+}
+''',
+}
+
+PROGRAM = '''KERNEL: T
+COUNT: 2
+ITERATE: 2
+%sinput %s a(64, 64)
+input %s b(64, 64)
+input %s c(64, 64)
+output %s y(0, 0) = a(-1, 0) + a(0, 0) + a(1, 0) + b(0, 1) + c(0, 0)
+'''
+
+
+@pytest.mark.skipif(shutil.which('g++') is None, reason='g++ is not available')
+@pytest.mark.parametrize('options', [{}, {'pack_inputs': True}, {'border': 'streaming'}],
+                         ids=['default', 'packed', 'streaming'])
+@pytest.mark.parametrize('type_', ['float', 'half', 'fixed<16,8>', 'int16', 'uint8', 'int32'])
+def test_host_compiles(tmp_path, type_, options):
+    options = dict(options)
+    border = 'BOARDER: %s\n' % options.pop('border') if 'border' in options else ''
+    for name, text in SHIMS.items():
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_text(text)
+    for name, text in codegen.generate(PROGRAM % ((border,) + (type_,) * 4), **options).items():
+        (tmp_path / name).write_text(text)
+    result = subprocess.run(['g++', '-std=c++14', '-fsyntax-only', '-I', str(tmp_path), str(tmp_path / 'host.cpp')],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.mark.skipif(shutil.which('g++') is None, reason='g++ is not available')
+@pytest.mark.parametrize('type_', ['fixed<16,8>', 'fixed<8,4>', 'int16'])
+def test_host_reads_like_encode(tmp_path, type_):
+    data_type = dtype.parse(type_)
+    values = [0.0, 0.5, 1.0 / 3, -1.0 / 3, 2.99, -2.99, 7.126, -7.126] if data_type.kind == 'fixed' else \
+        [0, 1, -1, 300, -300, 32767]
+    (tmp_path / 'data.txt').write_text(' '.join(repr(value) for value in values))
+    (tmp_path / 'main.cpp').write_text('''#include <cmath>
+#include <cstdint>
+#include <cstring>
+#include <fstream>
+#include <iostream>
+%s
+int main() {
+    std::ifstream data_input("%s");
+    %s value;
+    for (int i = 0; i < %d; i++) {
+        read_value(data_input, value);
+        std::cout << (long long)*(int%d_t *)&value << std::endl;
+    }
+}
+''' % (host_codes.typed_value_functions, tmp_path / 'data.txt', data_type.host_type, len(values), data_type.bits))
+    subprocess.run(['g++', '-std=c++14', '-o', str(tmp_path / 'main'), str(tmp_path / 'main.cpp')], check=True)
+    output = subprocess.run([str(tmp_path / 'main')], capture_output=True, text=True, check=True).stdout
+    assert [int(raw) for raw in output.split()] == reference.encode(values, data_type).tolist()
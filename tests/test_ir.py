@@ -0,0 +1,47 @@
+'''Tests of the IR nodes'''
+import copy
+
+import pytest
+
+from dsl import ir
+from dsl import utils
+
+
+def ref(name, *idx):
+    return ir.Ref(name=name, idx=idx)
+
+
+def test_hashed_nodes_are_frozen():
+    node = ir.AddSub(operator=['+'], operand=[ref('a', 0, 0), ref('b', 0, 1)])
+    hash(node)
+    with pytest.raises(utils.InternalError):
+        node.operand[0].name = 'c'
+    with pytest.raises(utils.InternalError):
+        node.operator = ('-',)
+
+
+def test_copies_of_hashed_nodes_are_hashed_again():
+    node = ir.AddSub(operator=['+'], operand=[ref('a', 0, 0), ref('b', 0, 1)])
+    other = copy.copy(node)
+    other.operator = ('-',)
+    assert hash(node) != hash(other)
+    assert node != other
+    other = copy.copy(other)
+    other.operator = ('+',)
+    assert hash(node) == hash(other)
+    assert node == other
+
+
+def test_visit_shares_unchanged_subtrees():
+    node = ir.AddSub(operator=['+'], operand=[ref('a', 0, 0), ref('b', 0, 1)])
+    hash(node)
+
+    def rename(obj, args):
+        if isinstance(obj, ir.Ref) and obj.name == 'b':
+            obj.name = 'c'
+
+    result = node.visit(rename)
+    assert result == ir.AddSub(operator=['+'], operand=[ref('a', 0, 0), ref('c', 0, 1)])
+    assert result.operand[0] is node.operand[0]
+    assert node.operand[1].name == 'b'
+    assert node.visit(lambda obj, args: None) is node
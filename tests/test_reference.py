@@ -0,0 +1,112 @@
+'''Tests of the NumPy reference executor'''
+import numpy as np
+import pytest
+
+import core
+import dsl
+from core import dtype
+from core import reference
+
+
+def make_stencil(text, **options):
+    return core.stencil_from_program(dsl.metamodel().model_from_str(text), **options)
+
+
+HEAT = '''KERNEL: T
+COUNT: %d
+ITERATE: %d
+REPEAT: %d
+BOARDER: %s
+input float c(8, 16)
+input float x(8, 16)
+output float y(0, 0) = 0.5 * x(-1, 0) + x(0, -1) - 0.25 * x(0, 1) + c(0, 0) * x(1, 0)
+'''
+
+
+def scalar_heat(c, x, iterate, period):
+    '''HEAT cell by cell on the flattened grid with as many rows beyond it as
+    iterations, zero at the start of every period and computed like the grid
+    in between, as the kernels store them'''
+    rows, cols = x.shape
+    c = np.concatenate([np.zeros(iterate*cols), c.reshape(-1), np.zeros(iterate*cols)]).astype(np.float32)
+    x = np.concatenate([np.zeros(iterate*cols), x.reshape(-1), np.zeros(iterate*cols)]).astype(np.float32)
+    grid = slice(iterate*cols, (iterate + rows)*cols)
+
+    def at(p):
+        return x[p] if 0 <= p < x.size else np.float32(0)
+
+    for i in range(iterate):
+        if i % period == 0:
+            x[:grid.start] = 0
+            x[grid.stop:] = 0
+        x = np.array([np.float32(0.5)*at(p - cols) + at(p - 1) - np.float32(0.25)*at(p + 1) + c[p]*at(p + cols)
+                      for p in range(x.size)], dtype=np.float32)
+    return x[grid].reshape(rows, cols)
+
+
+@pytest.mark.parametrize('count, iterate, repeat, border, options, period', [
+    (1, 1, 1, 'overlap', {}, 1),
+    (2, 3, 1, 'overlap', {}, 3),
+    (2, 4, 2, 'overlap', {}, 4),
+    (2, 4, 1, 'hybrid', {'epoch': 2}, 2),
+    (2, 3, 1, 'streaming', {}, 1),
+    (2, 4, 2, 'streaming', {}, 2),
+])
+def test_executor_matches_scalar_loop(count, iterate, repeat, border, options, period):
+    stencil = make_stencil(HEAT % (count, iterate, repeat, border), **options)
+    executor = reference.ReferenceExecutor(stencil)
+    assert executor.refresh_period == period
+    rng = np.random.default_rng(0)
+    inputs = {'c': rng.random((8, 16), dtype=np.float32), 'x': rng.random((8, 16), dtype=np.float32)}
+    np.testing.assert_array_equal(executor.run(inputs), scalar_heat(inputs['c'], inputs['x'], iterate, period))
+
+
+def test_encode_floors_truncates_and_wraps():
+    assert reference.encode([1.03, -1.03, 8.0], dtype.parse('fixed<8,4>')).tolist() == [16, -17, -128]
+    assert reference.encode([1.9, -1.9, 200], dtype.parse('int8')).tolist() == [1, -1, -56]
+    assert reference.encode([300], dtype.parse('uint8')).tolist() == [44]
+
+
+def test_decode_inverts_encode():
+    for name in ('float', 'half', 'fixed<16,8>', 'int16'):
+        data_type = dtype.parse(name)
+        values = reference.quantize([0.5, -2.25, 3.0], data_type)
+        np.testing.assert_array_equal(reference.decode(reference.encode(values, data_type), data_type), values)
+
+
+def test_quantize():
+    assert reference.quantize(0.1, dtype.parse('half')) == np.float16(0.1)
+    assert reference.quantize(0.1, dtype.FLOAT) == np.float32(0.1)
+    assert reference.quantize(-0.1, dtype.parse('fixed<16,8>')) == -26 / 256
+
+
+def test_fmaf_rounds_once():
+    x = np.float32(1 + 2**-12)
+    # x * x is halfway between two float32 values, the addend decides
+    assert reference._fmaf(x, x, np.float32(2**-60)) == np.float32(1 + 2**-11 + 2**-23)
+    assert reference._fmaf(x, x, np.float32(-2**-60)) == np.float32(1 + 2**-11)
+
+
+def test_integer_division_truncates():
+    stencil = make_stencil('''KERNEL: T
+COUNT: 1
+ITERATE: 1
+input int32 a(2, 16)
+input int32 b(2, 16)
+output int32 y(0, 0) = a(0, 0) / b(0, 0) * 2
+''')
+    a = np.array([[-7, 7, 9, -9] * 4] * 2)
+    b = np.full((2, 16), 2)
+    result = reference.ReferenceExecutor(stencil).run({'a': a, 'b': b})
+    assert result[0, :4].tolist() == [-6, 6, 8, -8]
+
+
+def test_golden_gen(tmp_path):
+    stencil = make_stencil(HEAT % (2, 3, 1, 'overlap'))
+    rng = np.random.default_rng(1)
+    inputs = {name: rng.random((8, 16), dtype=np.float32) for name in ('c', 'x')}
+    for name, array in inputs.items():
+        np.savetxt(str(tmp_path / ('%s.data' % name)), array.reshape(1, -1), fmt='%.9g')
+    result = reference.golden_gen(stencil, str(tmp_path))
+    np.testing.assert_array_equal(result, reference.ReferenceExecutor(stencil).run(inputs))
+    np.testing.assert_array_equal(np.loadtxt(str(tmp_path / 'check.data'), dtype=np.float32), result.reshape(-1))